@@ -34,7 +34,7 @@ import time
 import os
 
 from ts_helpers.ts_helpers import establishconnection, testconnection
-from db_helpers import preptable
+from db_helpers import preptable, preparedlayer
 
 
 # ----- set various generic (location dependend) data in metadata table (xy from well)
@@ -49,8 +49,14 @@ def assign_parcelvalues(engine, tbl):
         ...
     """
     loctable = ".".join([tbl.split(".")[0], tbl.split(".")[1].split("_")[0]])
+    # the subdivided copy has a row per piece of a parcel. A well on the
+    # border of parcels is assigned to the parcel that contains it, otherwise
+    # to the lowest aan_id, so every run gives the same parcel
+    parcels = preparedlayer(
+        engine, "assign_parcelvalues", "public.input_parcels_2022"
+    )
 
-    strsql = f"""select 
+    strsql = f"""select distinct on (l.well_id)
         l.well_id, 
         ip.aan_id, 
         type_peilb, 
@@ -61,7 +67,8 @@ def assign_parcelvalues(engine, tbl):
         ROUND(y_coord::numeric,2) 
         from {tbl} l 
         join {loctable} loc on loc.locationkey = l.well_id
-        join input_parcels_2022 ip on st_within(loc.geom, ip.geom)"""
+        join {parcels} ip on st_intersects(loc.geom, ip.geom)
+        order by l.well_id, st_contains(ip.geom, loc.geom) desc, ip.aan_id"""
     locs = engine.execute(strsql).fetchall()
     for i in range(len(locs)):
         lockey = locs[i][0]
@@ -32,7 +32,7 @@ import time
 
 # import StringIO
 import os
-from db_helpers import preptable
+from db_helpers import preptable, preparedlayer
 
 
 # Get locations from database
@@ -40,19 +40,20 @@ from db_helpers import preptable
 # Using WMS (there doesn't seem to be a WFS deployed by PDOK) was a bit hard.
 # therefore GPGK from https://www.pdok.nl/atom-downloadservices/-/article/bro-bodemkaart-sgm- has
 # been downloaded and loaded into the database
-def getdatafromdb(engine, x, y):
+def getdatafromdb(engine, x, y, layer="soilmap.soilarea"):
     """get point value soilunit
 
     Args:
         x (double pecision): longitude
         y (double pecision): latitude
+        layer (string): soilarea layer or its subdivided copy (see db_helpers.preparelayers)
 
     Returns:
         text: soilunit for given point
     """
-    strsql = f"""SELECT su.soilunit_code FROM soilmap.soilarea sa 
+    strsql = f"""SELECT su.soilunit_code FROM {layer} sa 
     JOIN soilmap.soilarea_soilunit su on su.maparea_id = sa.maparea_id 
-    WHERE st_within(st_geomfromewkt('SRID=28992;POINT({x} {y})'), sa.geom)"""
+    WHERE st_intersects(st_geomfromewkt('SRID=28992;POINT({x} {y})'), sa.geom)"""
     try:
         scode = engine.execute(strsql).fetchone()[0]
         print("scode", scode)
@@ -73,6 +74,7 @@ def assign_soiltype(engine, tbl):
         ...
     """
     preptable(engine, tbl, "soil_class", "text")
+    layer = preparedlayer(engine, "assign_soiltype", "soilmap.soilarea")
     strsql = f"""select well_id, 
             x_well,
             y_well from {tbl}"""
@@ -81,7 +83,7 @@ def assign_soiltype(engine, tbl):
         lockey = locs[i][0]
         x = locs[i][1]
         y = locs[i][2]
-        soildata = getdatafromdb(engine, x, y)
+        soildata = getdatafromdb(engine, x, y, layer)
         strsql = f"""insert into {tbl} (well_id, soil_class) 
                      VALUES ({lockey},'{soildata}')
                         ON CONFLICT(well_id)
@@ -31,32 +31,42 @@
 # base packages
 import os
 import pandas as pd
+from sqlalchemy import text
 
 # import custum functions
 from ts_helpers.ts_helpers import establishconnection, testconnection
+from ts_helpers.ts_helpers import ormmodules, ormmodels, statstable
 
 
 def settimeseriesstats(engine, tbl, nwtbl):
-    con = engine.connect()
+    """Sets start_date, end_date and records per well in nwtbl in one update.
+    For the schemas with a summary table the summary per series is aggregated
+    (see ts_helpers.statstable), otherwise the values table itself"""
     n = tbl.split("_")[0]
+    schema = f"{n}_timeseries"
     print("retrieve time window information for", n)
 
-    strsql = f"""select well_id, min(datetime) as mindate,max(datetime) as maxdate, count(*) as nrecords
-      from {n}_timeseries.location l
-      JOIN {nwtbl} mt on mt.well_id = l.locationkey
-      JOIN {n}_timeseries.timeseries t on t.locationkey = l.locationkey
-      JOIN {n}_timeseries.parameter p on p.parameterkey = t.parameterkey
-      JOIN {n}_timeseries.timeseriesvaluesandflags tsv on tsv.timeserieskey = t.timeserieskey
-    group by well_id
-    """
-    res = pd.read_sql(strsql, con)
-    for id, row in res.iterrows():
-        strsql = f"""update {nwtbl} set 
-                    start_date = '{row['mindate']}', 
-                    end_date = '{row['maxdate']}',
-                    records = {row['nrecords']} 
-                    where well_id = {row['well_id']}"""
-        engine.execute(strsql)
+    if schema in ormmodules:
+        stats = statstable(engine, ormmodels(schema).TimeSeriesStats)
+        source = f"""select t.locationkey as well_id, min(s.firstdatetime) as mindate,
+            max(s.lastdatetime) as maxdate, sum(s.nrecords) as nrecords
+          from {schema}.timeseries t
+          JOIN {stats.fullname} s on s.timeserieskey = t.timeserieskey
+        group by t.locationkey"""
+    else:
+        source = f"""select t.locationkey as well_id, min(datetime) as mindate,
+            max(datetime) as maxdate, count(*) as nrecords
+          from {schema}.timeseries t
+          JOIN {schema}.timeseriesvaluesandflags tsv on tsv.timeserieskey = t.timeserieskey
+        group by t.locationkey"""
+    strsql = f"""update {nwtbl} mt set
+                start_date = s.mindate,
+                end_date = s.maxdate,
+                records = s.nrecords
+                from ({source}) s
+                where mt.well_id = s.well_id"""
+    with engine.begin() as conn:
+        conn.execute(text(strsql))
 
 
 def test():
@@ -28,7 +28,7 @@
 # - assignment distance from well to various entities of top10
 
 ## various helper functions
-from db_helpers import preptable
+from db_helpers import preptable, preparedlayer
 
 # for every location the distance to ditch, road and centr of railroad is derived from top 10 data
 # bear in mind, this is a very time costly operation, takes a long time (well, up to an hour)!
@@ -51,6 +51,7 @@ def assign_t10(engine, tbl, metatable):
     """
     for t10 in dcttop10.keys():
         c = dcttop10[t10]
+        layer = preparedlayer(engine, "assign_top10", t10)
         print("retrieving distances between points from ", tbl, " for ", t10)
         nwtbl = metatable
         preptable(engine, nwtbl, c, "double precision")
@@ -61,7 +62,7 @@ def assign_t10(engine, tbl, metatable):
             lockey = locs[i][0]
             strsql = f"""SELECT locationkey, 
                 ST_DISTANCE(l.geom,wl.geom)
-                FROM {tbl} l, {t10} wl
+                FROM {tbl} l, {layer} wl
                 WHERE locationkey = {lockey}
                 ORDER BY
                 l.geom <-> wl.geom
@@ -98,8 +98,6 @@ def preptable(engine, tbl, columname, datatype):
             conn.commit()
     except Exception as e:
         print("following exception raised", e)
-    finally:
-        engine.dispose()
     return
 
 
@@ -122,6 +120,255 @@ def create_location_metadatatable(cf, tbl, dctcolumns):
             preptable(engine, nwtbl, columname, dctcolumns[columname])
     except Exception as e:
         print("following exception raised", e)
-    finally:
-        engine.dispose()
     return
+
+
+def shadowtable(engine, tbl):
+    """returns the name of the shadow table of tbl (schema.table) that a
+    rebuild loads into, a leftover shadow table of a failed rebuild is dropped
+
+    Args:
+        engine : sqlalchemy engine object
+        tbl (text): table incl. schema name
+
+    Returns:
+        text: shadow table incl. schema name
+    """
+    shadow = f"{tbl}_new"
+    with engine.connect() as conn:
+        conn.execute(text(f"drop table if exists {shadow}"))
+        conn.commit()
+    return shadow
+
+
+def swaptables(engine, schema, tables):
+    """replaces the tables by their shadow tables (see shadowtable) in one
+    transaction. The current tables are kept as <table>_old (a previous _old
+    table is dropped), indexes and constraints are renamed along, so readers
+    only wait for the renames and the next rebuild can reuse the names.
+
+    Args:
+        engine : sqlalchemy engine object
+        schema (text): schema of the tables
+        tables (list): table names without schema
+    """
+    strindexes = """select c.relname from pg_index i
+        join pg_class c on c.oid = i.indexrelid
+        where i.indrelid = to_regclass(:t)"""
+
+    def renameindexes(conn, tbl, old, new):
+        # names of indexes (incl. those of primary keys) are unique per schema
+        for (name,) in conn.execute(text(strindexes), {"t": f"{schema}.{tbl}"}).all():
+            if name.startswith(old):
+                conn.execute(
+                    text(
+                        f"alter index {schema}.{name} rename to {new + name[len(old):]}"
+                    )
+                )
+
+    with engine.begin() as conn:
+        for tbl in tables:
+            conn.execute(text(f"drop table if exists {schema}.{tbl}_old"))
+            if conn.execute(
+                text("select to_regclass(:t)"), {"t": f"{schema}.{tbl}"}
+            ).scalar():
+                renameindexes(conn, tbl, tbl, f"{tbl}_old")
+                conn.execute(text(f"alter table {schema}.{tbl} rename to {tbl}_old"))
+            conn.execute(text(f"alter table {schema}.{tbl}_new rename to {tbl}"))
+            renameindexes(conn, tbl, f"{tbl}_new", tbl)
+    print("swapped", ", ".join(f"{schema}.{t}" for t in tables))
+    return
+
+
+# reference layers of the enrichment steps: geometry column, whether the layer
+# has polygons (and gets a subdivided copy for point-in-polygon queries) and
+# per step the layer the step reads, the subdivided copy or the layer itself
+referencelayers = {}
+referencelayers["soilmap.soilarea"] = {
+    "geom": "geom",
+    "polygon": True,
+    "steps": {"assign_soiltype": "subdivided"},
+}
+referencelayers["public.input_parcels_2022"] = {
+    "geom": "geom",
+    "polygon": True,
+    # make_mastermetadata stores the geometry of the parcel, so it reads the layer
+    "steps": {"assign_parcelvalues": "subdivided", "make_mastermetadata": "layer"},
+}
+referencelayers["public.peilvak_gw_sw"] = {
+    "geom": "geom",
+    "polygon": True,
+    "steps": {"make_mastermetadata": "subdivided"},
+}
+for t10 in (
+    "top10.top10nl_waterdeel_lijn",
+    "top10.top10nl_spooras",
+    "top10.top10nl_wegdeel_hartlijn",
+):
+    referencelayers[t10] = {
+        "geom": "geom",
+        "polygon": False,
+        "steps": {"assign_top10": "layer"},
+    }
+
+# records per step and reference layer the prepared layer to read
+preparedtable = "public.preparedlayer"
+
+
+def subdividedname(layer):
+    """returns the name of the subdivided copy of layer (schema.table)"""
+    return f"{layer}_subdivided"
+
+
+def hasgistindex(engine, layer, geom="geom"):
+    """returns True if layer (schema.table) has a GiST index on column geom"""
+    strsql = """select count(*) from pg_index i
+        join pg_class c on c.oid = i.indexrelid
+        join pg_am am on am.oid = c.relam
+        join pg_attribute a on a.attrelid = i.indrelid and a.attnum = any(i.indkey)
+        where i.indrelid = to_regclass(:t) and am.amname = 'gist' and a.attname = :g"""
+    with engine.connect() as conn:
+        return conn.execute(text(strsql), {"t": layer, "g": geom}).scalar() > 0
+
+
+def subdividelayer(engine, layer, geom="geom", maxvertices=255):
+    """builds the subdivided copy of polygon layer (see subdividedname) with
+    ST_Subdivide, so st_within/st_intersects of a point only tests a small
+    piece of a polygon. The copy has the columns of the layer and parentid,
+    the same number for the pieces of one polygon. A point on a cut line lies
+    within neither piece, so query the copy with st_intersects. The copy is
+    built as shadow table and swapped in (see swaptables).
+
+    Args:
+        engine : sqlalchemy engine object
+        layer (text): polygon table incl. schema name
+        geom (text): geometry column
+        maxvertices (int): maximum number of vertices of a piece
+
+    Returns:
+        text: subdivided copy incl. schema name
+    """
+    copy = subdividedname(layer)
+    schema, name = copy.split(".")
+    shadow = shadowtable(engine, copy)
+    strcolumns = """select a.attname from pg_attribute a
+        where a.attrelid = to_regclass(:t) and a.attnum > 0 and not a.attisdropped
+        and a.attname not in (:g, 'parentid')
+        order by a.attnum"""
+    with engine.connect() as conn:
+        columns = [
+            r[0] for r in conn.execute(text(strcolumns), {"t": layer, "g": geom})
+        ]
+        columns = ", ".join(f's."{c}"' for c in columns)
+        strsql = f"""create table {shadow} as
+            select s.parentid, {columns},
+                st_subdivide(s."{geom}", {int(maxvertices)}) as "{geom}"
+            from (select row_number() over () as parentid, t.* from {layer} t
+                where t."{geom}" is not null) s"""
+        conn.execute(text(strsql))
+        conn.execute(text(f'create index on {shadow} using gist ("{geom}")'))
+        conn.execute(text(f"create index on {shadow} (parentid)"))
+        conn.commit()
+    swaptables(engine, schema, [name])
+    with engine.connect() as conn:
+        conn.execute(text(f"drop table if exists {copy}_old"))
+        conn.commit()
+    return copy
+
+
+def preparelayers(engine, layers=None, maxvertices=255, subdivide=True):
+    """prepares the reference layers of the enrichment steps: creates missing
+    GiST indexes, builds subdivided copies of the polygon layers (see
+    subdividelayer), analyzes the layers and records per step the layer to
+    read in preparedtable (see preparedlayer). Layers that do not exist are
+    skipped.
+
+    Args:
+        engine : sqlalchemy engine object
+        layers (list): layers incl. schema name, default all referencelayers
+        maxvertices (int): maximum number of vertices of a piece
+        subdivide (boolean): (re)build the subdivided copies, default True
+
+    Returns:
+        dictionary: (step, layer) --> prepared layer
+    """
+    strsql = f"""create table if not exists {preparedtable} (
+        step text, layer text, prepared text, modificationtime timestamp,
+        primary key (step, layer))"""
+    with engine.connect() as conn:
+        conn.execute(text(strsql))
+        conn.commit()
+    prepared = {}
+    for layer in layers or referencelayers:
+        setup = referencelayers[layer]
+        geom = setup["geom"]
+        with engine.connect() as conn:
+            exists = conn.execute(text("select to_regclass(:t)"), {"t": layer}).scalar()
+        if exists is None:
+            print("reference layer", layer, "does not exist, skipped")
+            continue
+        try:
+            if not hasgistindex(engine, layer, geom):
+                print("creating spatial index on", layer)
+                with engine.connect() as conn:
+                    conn.execute(text(f'create index on {layer} using gist ("{geom}")'))
+                    conn.commit()
+            copy = subdividedname(layer)
+            if setup["polygon"] and subdivide:
+                print("subdividing", layer)
+                subdividelayer(engine, layer, geom, maxvertices)
+            with engine.connect() as conn:
+                copyexists = conn.execute(
+                    text("select to_regclass(:t)"), {"t": copy}
+                ).scalar()
+                conn.execute(text(f"analyze {layer}"))
+                if copyexists is not None:
+                    conn.execute(text(f"analyze {copy}"))
+                for step, use in setup["steps"].items():
+                    target = copy if use == "subdivided" and copyexists else layer
+                    conn.execute(
+                        text(f"""insert into {preparedtable}
+                                (step, layer, prepared, modificationtime)
+                            values (:step, :layer, :prepared, localtimestamp)
+                            on conflict (step, layer) do update set
+                                prepared = excluded.prepared,
+                                modificationtime = excluded.modificationtime"""),
+                        {"step": step, "layer": layer, "prepared": target},
+                    )
+                    prepared[(step, layer)] = target
+                conn.commit()
+        except Exception as e:
+            print("following exception raised while preparing", layer, e)
+    return prepared
+
+
+def preparedlayer(engine, step, layer):
+    """returns the layer that step should read instead of layer (schema.table)
+    as recorded by preparelayers, layer itself if nothing is recorded
+
+    Args:
+        engine : sqlalchemy engine object
+        step (text): name of the step, e.g. assign_soiltype
+        layer (text): reference layer incl. schema name
+
+    Returns:
+        text: prepared layer incl. schema name
+    """
+    strsql = f"""select prepared from {preparedtable}
+        where step = :step and layer = :layer and to_regclass(prepared) is not null"""
+    try:
+        with engine.connect() as conn:
+            if (
+                conn.execute(
+                    text("select to_regclass(:t)"), {"t": preparedtable}
+                ).scalar()
+                is None
+            ):
+                return layer
+            prepared = conn.execute(
+                text(strsql), {"step": step, "layer": layer}
+            ).scalar()
+    except Exception as e:
+        print("following exception raised", e)
+        return layer
+    return prepared or layer
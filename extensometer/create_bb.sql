@@ -1,22 +1,22 @@
-drop table timeseries.boundingbox;
-create table timeseries.boundingbox as
-SELECT st_makeenvelope(min(st_x(l.geom)), min(st_y(l.geom)),max(st_x(l.geom)), max(st_y(geom)),28992) as bbgeom,
-left(name,3) as groupname,
-min(st_x(l.geom)) as minx,
-min(st_y(l.geom)) as miny,
-max(st_x(l.geom)) as maxx,
-max(st_y(l.geom)) as maxy 
-FROM timeseries.location l
-join timeseries.timeseries ts on ts.locationkey = l.locationkey
-where l.geom is not Null
-group by left(name,3)
+-- timeseries.boundingbox (extent per group of locations, the group is the
+-- first three characters of the name) is maintained by ts_helpers: the table
+-- is created and filled on first use and widened when locations are
+-- registered with ts_helpers.location or ts_helpers.location_many.
+-- Recompute after deleting or moving locations with
+--   ts_helpers.rebuildboundingbox(fc)
+-- The display names of the groups are kept in timeseries.groupname, store
+-- them with ts_helpers.setgroupnames(fc, {'ASD': 'Assendelft', ...}) or with
+-- the statements below.
 
-update timeseries.boundingbox as bb set groupname = f.fullname
-from (values
-	 ('Assendelft', 'ASD'),
-	 ('Aldeboarn', 'ALB'),
-	 ('Rouveen','ROV'),
-	  ('Gouderak', 'GOU'),
-	  ('Vegelinsoord', 'VEG')
-	 ) as f(fullname, groupname)
-where f.groupname=bb.groupname
\ No newline at end of file
+insert into timeseries.groupname (groupcode, groupname)
+values
+	 ('ASD', 'Assendelft'),
+	 ('ALB', 'Aldeboarn'),
+	 ('ROV', 'Rouveen'),
+	 ('GOU', 'Gouderak'),
+	 ('VEG', 'Vegelinsoord')
+on conflict (groupcode) do update set groupname = excluded.groupname;
+
+update timeseries.boundingbox as bb set groupname = g.groupname
+from timeseries.groupname g
+where g.groupcode = bb.groupcode;
@@ -67,6 +67,7 @@ from ts_helpers import (
     convertlttodate,
     stimestep,
 )
+from ts_bulk import writevalues
 
 # functions to use to import from ftp box
 
@@ -193,13 +194,7 @@ def timeseries_todb(file, metadata, name):
     dfw["timeserieskey"] = skeygws  # set series key for gws en temp
     dfw["flags"] = flagkey
 
-    dfw.to_sql(
-        "timeseriesvaluesandflags",
-        engine,
-        index=False,
-        if_exists="append",
-        schema="timeseries",
-    )
+    writevalues(engine, dfw, TimeSeriesValuesAndFlags)
 
     # adding temperatuur water to db
     dft = df[["datetime", "Temperatuur water"]]
@@ -207,13 +202,7 @@ def timeseries_todb(file, metadata, name):
     dft["timeserieskey"] = skeytempw  # set series key for gws en temp
     dft["flags"] = flagkey
 
-    dft.to_sql(
-        "timeseriesvaluesandflags",
-        engine,
-        index=False,
-        if_exists="append",
-        schema="timeseries",
-    )
+    writevalues(engine, dft, TimeSeriesValuesAndFlags)
 
     # adding temperatuur intern to db
     dfti = df[["datetime", "Temperatuur intern"]]
@@ -223,10 +212,4 @@ def timeseries_todb(file, metadata, name):
     dfti["timeserieskey"] = skeytempi  # set series key for gws en temp
     dfti["flags"] = flagkey
 
-    dfti.to_sql(
-        "timeseriesvaluesandflags",
-        engine,
-        index=False,
-        if_exists="append",
-        schema="timeseries",
-    )
+    writevalues(engine, dfti, TimeSeriesValuesAndFlags)
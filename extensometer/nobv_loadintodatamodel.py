@@ -74,7 +74,9 @@ from ts_helpers import (
     dateto_integer,
     convertlttodate,
     stimestep,
+    watermark,
 )
+from ts_bulk import writevalues
 
 # from ext_loaddataintodatamodel import metadata_location
 from sftp_tools import Sftp
@@ -202,20 +204,6 @@ r = engine.execute(stmt).fetchall()
 metadata = pd.DataFrame(r)
 
 
-# %%
-def latest_entry(skey):
-    """function to find the lastest timestep entry per skey.
-    input = skey
-    output = pandas df containing either none or a date"""
-    stmt = """select max(datetime) from timeseries.timeseriesvaluesandflags
-        where timeserieskey={s};""".format(
-        s=skey
-    )
-    r = engine.execute(stmt).fetchall()[0][0]
-    r = pd.to_datetime(r)
-    return r
-
-
 # %%
 # Connect to SFTP
 sftp.connect()
@@ -304,10 +292,10 @@ for dir in lstdir:
         df.rename(columns={"Datum": "datetime"}, inplace=True)  # change column name
 
         # TODO retrieving from the DB is a timeseries without timezone! this is not correct yet
-        r = latest_entry(skeygws)
+        r = watermark(fc, skeygws)
 
-        tempw = latest_entry(skeytempw)
-        tempi = latest_entry(skeytempi)
+        tempw = watermark(fc, skeytempw)
+        tempi = watermark(fc, skeytempi)
 
         dfw = df[["datetime", "Waterstand"]]
         dft = df[["datetime", "Temperatuur water"]]
@@ -322,13 +310,7 @@ for dir in lstdir:
             dfw["timeserieskey"] = skeygws  # set series key for gws en temp
             dfw["flags"] = flagkey
 
-            dfw.to_sql(
-                "timeseriesvaluesandflags",
-                engine,
-                index=False,
-                if_exists="append",
-                schema="timeseries",
-            )
+            writevalues(engine, dfw, TimeSeriesValuesAndFlags)
         else:
             print("not updating timeseries gws:", name)
 
@@ -341,13 +323,7 @@ for dir in lstdir:
             dft["timeserieskey"] = skeytempw  # set series key for gws en temp
             dft["flags"] = flagkey
 
-            dft.to_sql(
-                "timeseriesvaluesandflags",
-                engine,
-                index=False,
-                if_exists="append",
-                schema="timeseries",
-            )
+            writevalues(engine, dft, TimeSeriesValuesAndFlags)
         else:
             print("not updating timeseries tempw:", name)
 
@@ -360,13 +336,7 @@ for dir in lstdir:
             dfti["timeserieskey"] = skeytempi  # set series key for gws en temp
             dfti["flags"] = flagkey
 
-            dfti.to_sql(
-                "timeseriesvaluesandflags",
-                engine,
-                index=False,
-                if_exists="append",
-                schema="timeseries",
-            )
+            writevalues(engine, dfti, TimeSeriesValuesAndFlags)
         else:
             print("not updating timeseries tempi:", name)
 
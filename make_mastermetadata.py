@@ -35,6 +35,8 @@
 from sqlalchemy import text
 from ts_helpers.ts_helpers import establishconnection, testconnection
 from db_helpers import preptable, tablesetup, create_location_metadatatable
+from db_helpers import shadowtable, swaptables, preparedlayer
+from ts_helpers.ts_union import unionviewsql, sourcename, sourceschemas
 
 # globals
 cf = r"C:\develop\extensometer\connection_online.txt"
@@ -44,41 +46,33 @@ session, engine = establishconnection(cf)
 if not testconnection(engine):
     print("Connecting to database failed")
 
-# for security, remove _old tables and copy current (if exists) tables to _old
+# the tables are rebuilt as shadow tables (<table>_new), consumers keep reading
+# the current tables until all shadow tables are swapped in one transaction at
+# the end. The current tables are kept as <table>_old
 lsttables = ["gwm", "swm", "kalibratie", "validatie"]
 schema = "metadata_ongecontroleerd"
-for tbl in lsttables:
-    strsql = f"drop table if exists {schema}.{tbl}_old"
-    with engine.connect() as conn:
-        conn.execute(text(strsql))
-        conn.commit()
-    strsqln = f"alter table if exists {schema}.{tbl} rename to {tbl}_old"
-    with engine.connect() as conn:
-        conn.execute(text(strsqln))
-        conn.commit()
+shadow = {tbl: shadowtable(engine, f"{schema}.{tbl}") for tbl in lsttables}
 
 # create table
-nwtbl = "metadata_ongecontroleerd.gwm"
+nwtbl = shadow["gwm"]
 dctcolumns = tablesetup()
 create_location_metadatatable(cf, nwtbl, dctcolumns)
 print("table created", nwtbl)
 
-# setup dcttable with tables
-dcttable = {}
-dcttable["bro_timeseries.location"] = "placeholder"
-dcttable["hdsr_timeseries.location"] = "placeholder"
-dcttable["hhnk_timeseries.location"] = "placeholder"
-dcttable["wskip_timeseries.location"] = "placeholder"
-dcttable["waterschappen_timeseries.location"] = "placeholder"  # handmetingen
-dcttable["nobv_timeseries.location"] = "placeholder"  # nobv handmatige bewerkingen data
+# setup dcttable with tables, the sources are shared with the union layer
+dcttable = {f"{schema}.location": "placeholder" for schema in sourceschemas}
 
-# retrieve for every table in the dicttable all relevant data and transfer to nwtbl
-for tbl in dcttable.keys():
-    n = tbl.split("_")[0]
-    print("attempt to exectute queries for", n)
-    # NOBV and Waterschappen can have multipe parameters per location, only GWM now required.
-    if n == "nobv" or n == "waterschappen":
-        strsql = f"""insert into {nwtbl} (well_id, 
+# retrieve for all schemas in the dicttable the relevant data and transfer to
+# nwtbl in one statement over the union of the schemas (see ts_union)
+schemas = [tbl.split(".")[0] for tbl in dcttable.keys()]
+with engine.connect() as conn:
+    union = {
+        t: unionviewsql(conn, t, schemas)
+        for t in ("location", "location_metadata2", "timeseries", "parameter")
+    }
+print("attempt to exectute queries for", ", ".join(map(sourcename, schemas)))
+# NOBV and Waterschappen can have multipe parameters per location, only GWM now required.
+strsql = f"""insert into {nwtbl} (well_id, 
             aan_id,
             name,
             transect,
@@ -109,127 +103,58 @@ for tbl in dcttable.keys():
             parcel_geom,
             selection,
             description)
-        SELECT ('{n}_'||l.locationkey::text) as well_id, 
-            i.aan_id::integer,
-            l.name, 
-            mt.transect::integer,
-            'ref' as parcel_type,
-            mt.ditch_id,
-            '' as ditch_name, 
-            i.archetype as soil_class,
-            mt.z_surface_level_m_nap as z_surface_level_m_nap, 
-            mt.surface_level_ahn4_m_nap as ahn4_m_nap, 
-            mt.start_date,
-            mt.end_date,
-            mt.records,
-            mt.parcel_width_m, 
-            mt.summer_stage_m_nap,
-            mt.winter_stage_m_nap, 
-            st_x(l.geom),
-            st_y(l.geom),            
-            mt.distance_to_ditch_m,
-            mt.trenches,
-            mt.trench_depth_m_sfl,
-            mt.wis_distance_m,
-            mt.wis_depth_m_sfl,
-            Null::double precision as distance_to_wis_m,
-            l.tubetop as screen_top_m_sfl, 
-            l.tubebot as screen_bot_m_sfl,
-            l.altitude_msl as altitude_m_nap,
-            l.geom,
-            st_astext(st_force2d(i.geom)),
-            'yes' as selection,
-            l.description
-            FROM {n}_timeseries.location l
-            JOIN {n}_timeseries.location_metadata2 mt on mt.well_id = l.locationkey
-            JOIN {n}_timeseries.timeseries t on t.locationkey = l.locationkey
-            JOIN {n}_timeseries.parameter p on p.parameterkey = t.parameterkey
-            JOIN public.input_parcels_2022 i on st_within(l.geom,i.geom)
-            where p.id = 'GWM' and mt.distance_to_railroad_m > 10 and mt.distance_to_road_m > 10 and mt.distance_to_ditch_m > 5
-            ON CONFLICT(well_id)
-            DO NOTHING;"""
-        with engine.connect() as conn:
-            conn.execute(text(strsql))
-            conn.commit()
+    SELECT (l.source||'_'||l.locationkey::text) as well_id, 
+        i.aan_id::integer,
+        l.name, 
+        mt.transect::integer,
+        'ref' as parcel_type,
+        mt.ditch_id,
+        '' as ditch_name, 
+        i.archetype as soil_class,
+        CASE WHEN l.source in ('nobv', 'waterschappen')
+            THEN mt.z_surface_level_m_nap END::double precision as z_surface_level_m_nap, 
+        mt.surface_level_ahn4_m_nap as ahn4_m_nap, 
+        mt.start_date,
+        mt.end_date,
+        mt.records,
+        mt.parcel_width_m, 
+        mt.summer_stage_m_nap,
+        mt.winter_stage_m_nap, 
+        st_x(l.geom),
+        st_y(l.geom),            
+        mt.distance_to_ditch_m,
+        mt.trenches,
+        mt.trench_depth_m_sfl,
+        mt.wis_distance_m,
+        mt.wis_depth_m_sfl,
+        Null::double precision as distance_to_wis_m,
+        l.tubetop as screen_top_m_sfl, 
+        l.tubebot as screen_bot_m_sfl,
+        l.altitude_msl as altitude_m_nap,
+        l.geom,
+        st_astext(st_force2d(i.geom)),
+        'yes' as selection,
+        l.description
+        FROM ({union["location"]}) l
+        JOIN ({union["location_metadata2"]}) mt on mt.source = l.source and mt.well_id = l.locationkey
+        JOIN ({union["timeseries"]}) t on t.source = l.source and t.locationkey = l.locationkey
+        JOIN ({union["parameter"]}) p on p.source = t.source and p.parameterkey = t.parameterkey
+        JOIN public.input_parcels_2022 i on st_within(l.geom,i.geom)
+        where (l.source not in ('nobv', 'waterschappen') or p.id = 'GWM')
+        and mt.distance_to_railroad_m > 10 and mt.distance_to_road_m > 10 and mt.distance_to_ditch_m > 5
+        ON CONFLICT(well_id)
+        DO NOTHING;"""
+with engine.connect() as conn:
+    conn.execute(text(strsql))
+    conn.commit()
 
-    else:
-        strsql = f"""insert into {nwtbl} (well_id, 
-            aan_id,
-            name,
-            transect,
-            parcel_type,
-            ditch_id,
-            ditch_name,
-            soil_class,
-            z_surface_level_m_nap,
-            ahn4_m_nap,
-            start_date,
-            end_date,
-            records,
-            parcel_width_m,
-            summer_stage_m_nap,
-            winter_stage_m_nap,
-            x_well,
-            y_well,
-            distance_to_ditch_m,
-            trenches,
-            trench_depth_m_sfl,
-            wis_distance_m,
-            wis_depth_m_sfl,
-            distance_to_wis_m,
-            screen_top_m_sfl,
-            screen_bot_m_sfl,
-            altitude_m_nap,
-            geometry, 
-            parcel_geom,
-            selection,
-            description)
-        SELECT ('{n}_'||l.locationkey::text) as well_id, 
-            i.aan_id::integer,
-            l.name, 
-            mt.transect::integer,
-            'ref' as parcel_type,
-            mt.ditch_id,
-            '' as ditch_name, 
-            i.archetype as soil_class,
-            Null::double precision as z_surface_level_m_nap, 
-            mt.surface_level_ahn4_m_nap as ahn4_m_nap, 
-            mt.start_date,
-            mt.end_date,
-            mt.records,
-            mt.parcel_width_m, 
-            mt.summer_stage_m_nap,
-            mt.winter_stage_m_nap, 
-            st_x(l.geom),
-            st_y(l.geom),            
-            mt.distance_to_ditch_m,
-            mt.trenches,
-            mt.trench_depth_m_sfl,
-            mt.wis_distance_m,
-            mt.wis_depth_m_sfl,
-            Null::double precision as distance_to_wis_m,
-            l.tubetop as screen_top_m_sfl, 
-            l.tubebot as screen_bot_m_sfl,
-            l.altitude_msl as altitude_m_nap,
-            l.geom,
-            st_astext(st_force2d(i.geom)),
-            'yes' as selection,
-            l.description
-            FROM {n}_timeseries.location l
-            JOIN {n}_timeseries.location_metadata2 mt on mt.well_id = l.locationkey
-            JOIN {n}_timeseries.timeseries t on t.locationkey = l.locationkey
-            JOIN {n}_timeseries.parameter p on p.parameterkey = t.parameterkey
-            JOIN public.input_parcels_2022 i on st_within(l.geom,i.geom)
-            where mt.distance_to_railroad_m > 10 and mt.distance_to_road_m > 10 and mt.distance_to_ditch_m > 5
-            ON CONFLICT(well_id)
-            DO NOTHING;"""
-        with engine.connect() as conn:
-            conn.execute(text(strsql))
-            conn.commit()
+# spatial index after the load, used by the assignment of ditches below
+with engine.connect() as conn:
+    conn.execute(text(f"create index on {nwtbl} using gist (geometry)"))
+    conn.commit()
 
-nwtbl = "metadata_ongecontroleerd.swm"
-strsql = f"""drop table if exists {nwtbl}; 
-create table if not exists {nwtbl} (source text primary key)"""
+nwtbl = shadow["swm"]
+strsql = f"""create table if not exists {nwtbl} (source text primary key)"""
 with engine.connect() as conn:
     conn.execute(text(strsql))
     conn.commit()
@@ -238,23 +163,46 @@ print("table created", nwtbl)
 preptable(engine, nwtbl, "name", "text")
 preptable(engine, nwtbl, "geom", "geometry(POINT, 28992)")
 
-for tbl in dcttable.keys():
-    n = tbl.split("_")[0]
-    if n == "nobv" or n == "waterschappen":
-        print(n)
-        strsql = f"""insert into {nwtbl} (source, name, geom)
-            SELECT ('{n}_'||l.locationkey::text) as source, l.name, l.geom FROM {n}_timeseries.location l
-            JOIN {n}_timeseries.location_metadata2 mt on mt.well_id = l.locationkey
-            JOIN {n}_timeseries.timeseries t on t.locationkey = l.locationkey
-            JOIN {n}_timeseries.parameter p on p.parameterkey = t.parameterkey where p.id = 'SWM'
-            ON CONFLICT(source)
-            DO NOTHING;"""
-        with engine.connect() as conn:
-            conn.execute(text(strsql))
-            conn.commit()
+schemas = [
+    tbl.split(".")[0]
+    for tbl in dcttable.keys()
+    if sourcename(tbl.split(".")[0]) in ("nobv", "waterschappen")
+]
+with engine.connect() as conn:
+    union = {
+        t: unionviewsql(conn, t, schemas)
+        for t in ("location", "location_metadata2", "timeseries", "parameter")
+    }
+strsql = f"""insert into {nwtbl} (source, name, geom)
+    SELECT (l.source||'_'||l.locationkey::text) as source, l.name, l.geom FROM ({union["location"]}) l
+    JOIN ({union["location_metadata2"]}) mt on mt.source = l.source and mt.well_id = l.locationkey
+    JOIN ({union["timeseries"]}) t on t.source = l.source and t.locationkey = l.locationkey
+    JOIN ({union["parameter"]}) p on p.source = t.source and p.parameterkey = t.parameterkey where p.id = 'SWM'
+    ON CONFLICT(source)
+    DO NOTHING;"""
+with engine.connect() as conn:
+    conn.execute(text(strsql))
+    conn.commit()
+
+with engine.connect() as conn:
+    conn.execute(text(f"create index on {nwtbl} using gist (geom)"))
+    conn.commit()
 
 
 # %%
+# the subdivided copy of the peilvakken (see db_helpers.preparelayers) has a row
+# per piece, the surface water locations are searched in all pieces (parentid)
+# of the peilvak of the well
+peilvak = preparedlayer(engine, "make_mastermetadata", "public.peilvak_gw_sw")
+if peilvak == "public.peilvak_gw_sw":
+    strpeilvak = f"""LEFT JOIN
+        {shadow["swm"]} swm ON ST_DWithin(swm.geom, p.geom, 0)"""
+else:
+    strpeilvak = f"""LEFT JOIN
+        {peilvak} ps ON ps.parentid = p.parentid
+    LEFT JOIN
+        {shadow["swm"]} swm ON ST_DWithin(swm.geom, ps.geom, 0)"""
+
 # !!!! query does not work inside of python, but does work in pg admin. Run this part in PG admin
 strsql = f"""WITH updated_values AS (
     SELECT DISTINCT ON (l.well_id) 
@@ -262,15 +210,14 @@ strsql = f"""WITH updated_values AS (
         swm.source AS swm_source,
         swm.name as ditch_name
     FROM
-        public.peilvak_gw_sw p
+        {peilvak} p
     JOIN
-        metadata_ongecontroleerd.gwm l ON ST_DWithin(l.geometry, p.geom, 0)
-    LEFT JOIN
-        metadata_ongecontroleerd.swm swm ON ST_DWithin(swm.geom, p.geom, 0)
+        {shadow["gwm"]} l ON ST_DWithin(l.geometry, p.geom, 0)
+    {strpeilvak}
     ORDER BY 
         l.source
 )
-UPDATE metadata_ongecontroleerd.gwm
+UPDATE {shadow["gwm"]}
 SET ditch_id = CASE 
                 WHEN updated_values.swm_source IS NULL THEN NULL 
                 ELSE updated_values.swm_source 
@@ -280,23 +227,21 @@ SET ditch_id = CASE
                 ELSE updated_values.ditch_name 
             END
 FROM updated_values
-WHERE metadata_ongecontroleerd.gwm.well_id = updated_values.all_source;"""
+WHERE {shadow["gwm"]}.well_id = updated_values.all_source;"""
 with engine.connect() as conn:
     conn.execute(text(strsql))
     conn.commit()
 
 # %%
-strsql = f"""drop table if exists metadata_ongecontroleerd.kalibratie; 
-create table metadata_ongecontroleerd.kalibratie as
-select * from metadata_ongecontroleerd.gwm
+strsql = f"""create table {shadow["kalibratie"]} as
+select * from {shadow["gwm"]}
 where ditch_id is not Null;"""
 with engine.connect() as conn:
     conn.execute(text(strsql))
     conn.commit()
 
-strsql = f"""drop table if exists metadata_ongecontroleerd.validatie;
-create table metadata_ongecontroleerd.validatie as
-select * from metadata_ongecontroleerd.gwm
+strsql = f"""create table {shadow["validatie"]} as
+select * from {shadow["gwm"]}
 where ditch_id is Null;"""
 with engine.connect() as conn:
     conn.execute(text(strsql))
@@ -304,6 +249,9 @@ with engine.connect() as conn:
 
 print("created table kalibratie, validatie")
 
+# replace the current tables by the rebuilt tables in one transaction
+swaptables(engine, schema, lsttables)
+
 # bear in mind ownership of the tables
 # does not work inside python and needs to be done in pgadmin
 user = "hendrik_gt"
@@ -160,6 +160,82 @@ class TimeSeriesValuesAndFlags(Base):
     )
 
 
+class TimeSeriesStats(Base):
+    __tablename__ = "timeseriesstats"
+    __table_args__ = {"schema": "hdsr_timeseries"}
+    timeserieskey = Column(
+        Integer,
+        ForeignKey("hdsr_timeseries.timeseries.timeserieskey", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    firstdatetime = Column(DateTime)
+    lastdatetime = Column(DateTime)
+    nrecords = Column(Integer)
+    minvalue = Column(Float)
+    maxvalue = Column(Float)
+    modificationtime = Column(DateTime)
+
+
+class TimeSeriesRollup(Base):
+    __tablename__ = "timeseriesrollup"
+    __table_args__ = (
+        PrimaryKeyConstraint("timeserieskey", "resolution", "datetime"),
+        {"schema": "hdsr_timeseries"},
+    )
+    timeserieskey = Column(
+        Integer,
+        ForeignKey("hdsr_timeseries.timeseries.timeserieskey", ondelete="CASCADE"),
+        nullable=False,
+    )
+    resolution = Column(String, nullable=False)
+    datetime = Column(DateTime, nullable=False)
+    minvalue = Column(Float)
+    meanvalue = Column(Float)
+    maxvalue = Column(Float)
+    nrecords = Column(Integer)
+
+
+class RollupState(Base):
+    __tablename__ = "rollupstate"
+    __table_args__ = {"schema": "hdsr_timeseries"}
+    resolution = Column(String, primary_key=True)
+    transactionkey = Column(Integer, nullable=False)
+    modificationtime = Column(DateTime)
+
+
+class ArchiveState(Base):
+    __tablename__ = "archivestate"
+    __table_args__ = {"schema": "hdsr_timeseries"}
+    timeserieskey = Column(
+        Integer,
+        ForeignKey("hdsr_timeseries.timeseries.timeserieskey", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    archivedbefore = Column(DateTime, nullable=False)
+    modificationtime = Column(DateTime)
+
+
+class BoundingBox(Base):
+    __tablename__ = "boundingbox"
+    __table_args__ = {"schema": "hdsr_timeseries"}
+    groupcode = Column(String, primary_key=True)
+    groupname = Column(String)
+    minx = Column(Float)
+    miny = Column(Float)
+    maxx = Column(Float)
+    maxy = Column(Float)
+    nlocations = Column(Integer)
+    bbgeom = Column(Geometry("POLYGON", srid=28992))
+    modificationtime = Column(DateTime)
+
+
+class GroupName(Base):
+    __tablename__ = "groupname"
+    __table_args__ = {"schema": "hdsr_timeseries"}
+    groupcode = Column(String, primary_key=True)
+    groupname = Column(String, nullable=False)
+
+
 """records pump history"""
 
 
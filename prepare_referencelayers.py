@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Copyright notice
+#   --------------------------------------------------------------------
+#   Copyright (C) 2024 Deltares
+#   Gerrit Hendriksen (gerrit.hendriksen@deltares.nl)
+#
+#   This library is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this library.  If not, see <http://www.gnu.org/licenses/>.
+#   --------------------------------------------------------------------
+#
+# This tool is part of <a href="http://www.OpenEarth.eu">OpenEarthTools</a>.
+# OpenEarthTools is an online collaboration to share and manage data and
+# programming tools in an open source, version controlled environment.
+# Sign up to recieve regular updates of this function, and to contribute
+# your own tools.
+
+# prepares the reference layers of the assign_* steps and make_mastermetadata
+# (see db_helpers.referencelayers): spatial indexes, subdivided copies of the
+# polygon layers and fresh statistics. Run after loading or updating a layer.
+
+from ts_helpers.ts_helpers import establishconnection, testconnection
+from db_helpers import preparelayers
+
+if __name__ == "__main__":
+    cf = r"C:\develop\extensometer\connection_online.txt"
+    session, engine = establishconnection(cf)
+    if not testconnection(engine):
+        print("Connecting to database failed")
+    else:
+        prepared = preparelayers(engine)
+        for (step, layer), target in prepared.items():
+            print(step, "reads", target, "for", layer)
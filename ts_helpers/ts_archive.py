@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Cold tier for old raw values: values before a cutoff are exported to Parquet
+files and deleted from the values table, readvalues merges the archived and
+the stored values of a series. Requires:
+Pyhton packages
+ - pyarrow (Parquet files via pandas)
+
+The archive is partitioned as <root>/source=<source>/year=<yyyy>/
+timeserieskey=<key>/values.parquet, so it can also be read as one dataset
+with pandas.read_parquet(root). The summary (see ts_helpers.statstable) and
+the rollups (see ts_rollup) are kept and still cover the archived values.
+For a partitioned values table the emptied partitions can be dropped with
+orm_loadtimeseries.droppartitions.
+"""
+
+#  Copyright notice
+#   --------------------------------------------------------------------
+#   Copyright (C) 2024 Deltares for Projects with a FEWS datamodel in
+#                 PostgreSQL/PostGIS database used in Water Information Systems
+#   Gerrit.Hendriksen@deltares.nl
+#
+#   This library is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this library.  If not, see <http://www.gnu.org/licenses/>.
+#   --------------------------------------------------------------------
+#
+# This tool is part of <a href="http://www.OpenEarth.eu">OpenEarthTools</a>.
+# OpenEarthTools is an online collaboration to share and manage data and
+# programming tools in an open source, version controlled environment.
+# Sign up to recieve regular updates of this function, and to contribute
+# your own tools.
+
+# system modules
+import os
+
+# third party modules
+import pandas as pd
+from sqlalchemy import text
+
+## Declare a Mapping to the database
+from orm_timeseries.orm_timeseries import TimeSeriesValuesAndFlags
+
+# ts_archive is used both as package and as module
+try:
+    from ts_helpers.ts_metrics import timed
+    from ts_helpers.ts_helpers import (
+        getengine,
+        ormmodels,
+        timeseriesstats,
+        archivestatetable,
+    )
+    from ts_helpers.ts_union import sourcename
+except ImportError:
+    from ts_metrics import timed
+    from ts_helpers import (
+        getengine,
+        ormmodels,
+        timeseriesstats,
+        archivestatetable,
+    )
+    from ts_union import sourcename
+
+# columns in the archive files
+archivecolumns = ["datetime", "scalarvalue", "flags"]
+
+# columns that identify a record of one series, the primary key of the values
+# table without timeserieskey (WSKIP stores several values per datetime)
+archivekey = ["datetime", "scalarvalue"]
+
+
+def archivepath(root, schema, year, timeserieskey):
+    """returns the path of the archive file of one series and year"""
+    return os.path.join(
+        root,
+        f"source={sourcename(schema)}",
+        f"year={int(year)}",
+        f"timeserieskey={int(timeserieskey)}",
+        "values.parquet",
+    )
+
+
+def _writearchive(path, df):
+    """merges df with the archive file at path (if any) and replaces the file,
+    returns the number of records in the file"""
+    if os.path.exists(path):
+        df = pd.concat([pd.read_parquet(path), df], ignore_index=True)
+    df = df.drop_duplicates(subset=archivekey, keep="last")
+    df = df.sort_values("datetime")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+    return len(df)
+
+
+@timed(kind="archive")
+def archivevalues(
+    fc,
+    root,
+    before=None,
+    keepyears=3,
+    timeserieskeys=None,
+    vacuum=True,
+    model=TimeSeriesValuesAndFlags,
+    schema=None,
+):
+    """
+    Moves the values before a cutoff to the Parquet archive. Per series the
+    values are deleted and returned in one statement and written to the
+    archive before the delete is committed, so a value is never deleted
+    without being archived and an interrupted run can simply be repeated.
+    The cutoff is recorded per series in the same transaction (archivestate
+    table), ts_bulk.writevalues and mergevalues skip values before it, so a
+    loader that fetches the full history does not bring archived values back.
+
+    Parameters
+    ----------
+    fc : string
+        Link to credentials file for access to database.
+    root : string
+        directory of the archive
+    before : datetime, optional
+        cutoff, default the start of the year keepyears years ago
+    keepyears : integer, optional
+        number of full years that are kept in the database, default 3
+    timeserieskeys : list of integers, optional
+        series to archive, default all series with values before the cutoff
+    vacuum : boolean, optional
+        vacuum the values table afterwards so the space is reused, default True
+    model : ORM class, optional
+        TimeSeriesValuesAndFlags class of the source schema
+    schema : string, optional
+        schema to work in (see ts_helpers.ormmodels), replaces the schema of
+        model
+
+    Returns
+    -------
+    dictionary with the number of archived series, records and files, None
+    in case of an exception
+
+    """
+    if schema is not None:
+        model = getattr(ormmodels(schema), model.__name__)
+    table = model.__table__
+    if before is None:
+        before = pd.Timestamp(year=pd.Timestamp.now().year - keepyears, month=1, day=1)
+    before = pd.Timestamp(before).to_pydatetime()
+    engine = getengine(fc)
+    target = engine.dialect.identifier_preparer.format_table(table)
+    if timeserieskeys is None:
+        stats = timeseriesstats(fc, schema=table.schema)
+        timeserieskeys = stats.index[stats["firstdatetime"] < before]
+
+    result = {"series": 0, "rows": 0, "files": 0}
+    delete = f"""delete from {target}
+        where timeserieskey = :k and datetime < :before
+        returning {', '.join(archivecolumns)}"""
+    state = engine.dialect.identifier_preparer.format_table(
+        archivestatetable(engine, ormmodels(table.schema).ArchiveState)
+    )
+    cutoff = f"""insert into {state} as a (timeserieskey, archivedbefore,
+            modificationtime)
+        values (:k, :before, localtimestamp)
+        on conflict (timeserieskey) do update set
+            archivedbefore = greatest(a.archivedbefore, excluded.archivedbefore),
+            modificationtime = excluded.modificationtime"""
+    try:
+        for key in timeserieskeys:
+            params = {"k": int(key), "before": before}
+            # an exception while writing the archive rolls the delete back
+            with engine.begin() as conn:
+                rows = conn.execute(text(delete), params).all()
+                if len(rows) == 0:
+                    continue
+                df = pd.DataFrame(rows, columns=archivecolumns)
+                df["datetime"] = pd.to_datetime(df["datetime"])
+                for year, group in df.groupby(df["datetime"].dt.year):
+                    _writearchive(archivepath(root, table.schema, year, key), group)
+                    result["files"] += 1
+                conn.execute(text(cutoff), params)
+            result["series"] += 1
+            result["rows"] += len(df)
+        if vacuum and result["rows"] > 0:
+            with engine.connect() as conn:
+                conn.execution_options(isolation_level="AUTOCOMMIT").execute(
+                    text(f"vacuum (analyze) {target}")
+                )
+    except Exception as e:
+        print("exception raised while archiving", table.fullname, e)
+        return None
+    print(
+        "archived",
+        result["rows"],
+        "records of",
+        result["series"],
+        "series of",
+        table.schema,
+        "before",
+        before,
+    )
+    return result
+
+
+def readarchive(root, schema, timeserieskey, start=None, end=None):
+    """returns the archived values (datetime, scalarvalue, flags) of one
+    series between start and end"""
+    folder = os.path.join(root, f"source={sourcename(schema)}")
+    if not os.path.isdir(folder):
+        return pd.DataFrame(columns=archivecolumns)
+    frames = []
+    for name in sorted(os.listdir(folder)):
+        if not name.startswith("year="):
+            continue
+        year = int(name.split("=")[1])
+        if start is not None and year < pd.Timestamp(start).year:
+            continue
+        if end is not None and year > pd.Timestamp(end).year:
+            continue
+        path = archivepath(root, schema, year, timeserieskey)
+        if os.path.exists(path):
+            frames.append(pd.read_parquet(path))
+    if len(frames) == 0:
+        return pd.DataFrame(columns=archivecolumns)
+    df = pd.concat(frames, ignore_index=True)
+    if start is not None:
+        df = df[df["datetime"] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df["datetime"] <= pd.Timestamp(end)]
+    return df
+
+
+@timed(kind="archive")
+def readvalues(
+    fc,
+    timeserieskey,
+    start=None,
+    end=None,
+    root=None,
+    model=TimeSeriesValuesAndFlags,
+    schema=None,
+):
+    """
+    Reads the values of one series between start and end from the archive
+    and the database, values in the database take precedence.
+
+    Parameters
+    ----------
+    fc : string
+        Link to credentials file for access to database.
+    timeserieskey : integer
+        the series
+    start, end : datetime, optional
+        period to read, default everything
+    root : string, optional
+        directory of the archive, None reads the database only
+    model : ORM class, optional
+        TimeSeriesValuesAndFlags class of the source schema
+    schema : string, optional
+        schema to work in (see ts_helpers.ormmodels), replaces the schema of
+        model
+
+    Returns
+    -------
+    pandas DataFrame with columns datetime, scalarvalue and flags, sorted by
+    datetime
+
+    """
+    if schema is not None:
+        model = getattr(ormmodels(schema), model.__name__)
+    table = model.__table__
+    engine = getengine(fc)
+    target = engine.dialect.identifier_preparer.format_table(table)
+    where = ["timeserieskey = :k"]
+    params = {"k": int(timeserieskey)}
+    if start is not None:
+        where.append("datetime >= :start")
+        params["start"] = pd.Timestamp(start).to_pydatetime()
+    if end is not None:
+        where.append("datetime <= :end")
+        params["end"] = pd.Timestamp(end).to_pydatetime()
+    strsql = f"""select {', '.join(archivecolumns)} from {target}
+        where {' and '.join(where)}"""
+    with engine.connect() as conn:
+        df = pd.read_sql(text(strsql), conn, params=params)
+    if root is not None:
+        archived = readarchive(root, table.schema, timeserieskey, start, end)
+        if len(archived) > 0:
+            df = pd.concat([archived, df], ignore_index=True)
+    df = df.drop_duplicates(subset=archivekey, keep="last")
+    return df.sort_values("datetime").reset_index(drop=True)
@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk writing of timeseries values via PostgreSQL COPY, requires:
+Pyhton packages
+ - psycopg2 (COPY is done on the raw DBAPI connection)
+"""
+
+#  Copyright notice
+#   --------------------------------------------------------------------
+#   Copyright (C) 2024 Deltares for Projects with a FEWS datamodel in
+#                 PostgreSQL/PostGIS database used in Water Information Systems
+#   Gerrit.Hendriksen@deltares.nl
+#
+#   This library is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this library.  If not, see <http://www.gnu.org/licenses/>.
+#   --------------------------------------------------------------------
+#
+# This tool is part of <a href="http://www.OpenEarth.eu">OpenEarthTools</a>.
+# OpenEarthTools is an online collaboration to share and manage data and
+# programming tools in an open source, version controlled environment.
+# Sign up to recieve regular updates of this function, and to contribute
+# your own tools.
+
+# system modules
+import io
+
+# third party modules
+import pandas as pd
+from sqlalchemy import text
+
+## Declare a Mapping to the database
+from orm_timeseries.orm_timeseries import TimeSeriesValuesAndFlags
+
+# instrumentation (opt-in), ts_bulk is used both as package and as module
+try:
+    from ts_helpers.ts_metrics import timed
+    from ts_helpers.ts_helpers import ormmodels, statstable, archivestatetable
+except ImportError:
+    from ts_metrics import timed
+    from ts_helpers import ormmodels, statstable, archivestatetable
+
+# number of records per COPY, limits the size of the in memory csv buffer
+chunksize = 500000
+
+
+def _preparevalues(df, columns):
+    """returns a copy of df with the given columns, datetimes with a timezone
+    are converted to UTC and stored without timezone"""
+    df = df[columns].copy()
+    if "datetime" in columns:
+        dt = pd.to_datetime(df["datetime"])
+        if dt.dt.tz is not None:
+            dt = dt.dt.tz_convert("UTC").dt.tz_localize(None)
+        df["datetime"] = dt
+    return df
+
+
+# (engine, full table name) --> primary key columns of the table as created
+# in the database. The ORM declares (timeserieskey, datetime, scalarvalue),
+# the compact profile (see orm_loadtimeseries) uses (timeserieskey, datetime)
+_primarykeys = {}
+
+
+def primarykey(engine, table):
+    """returns the names of the primary key columns of table as created in the
+    database (cached per process), the primary key of the ORM declaration if
+    the table does not exist"""
+    key = (engine, table.fullname)
+    if key not in _primarykeys:
+        strsql = """select a.attname from pg_index i
+            cross join lateral unnest(i.indkey) with ordinality k(attnum, ord)
+            join pg_attribute a on a.attrelid = i.indrelid and a.attnum = k.attnum
+            where i.indrelid = to_regclass(:t) and i.indisprimary
+            order by k.ord"""
+        target = engine.dialect.identifier_preparer.format_table(table)
+        with engine.connect() as conn:
+            columns = [r[0] for r in conn.execute(text(strsql), {"t": target})]
+        _primarykeys[key] = columns or [c.name for c in table.primary_key.columns]
+    return _primarykeys[key]
+
+
+# transaction sequences that are verified in this process
+_checkedsequences = set()
+
+
+def _transactionsql(engine, table, transactionid):
+    """returns the statement that records the period per timeserieskey of the
+    staged values in the transaction table of the schema of table, None if
+    recording is switched off (transactionid None) or there is no such table"""
+    trans = table.metadata.tables.get(f"{table.schema}.transaction")
+    if transactionid is None or trans is None:
+        return None
+    seq = trans.c.transactionkey.default
+    if (engine, trans.fullname) not in _checkedsequences:
+        seq.create(engine, checkfirst=True)
+        _checkedsequences.add((engine, trans.fullname))
+    prep = engine.dialect.identifier_preparer
+    return f"""insert into {prep.format_table(trans)} (transactionkey, timeserieskey,
+            transactiontime, periodstart, periodend, transactionid)
+        select nextval('{prep.format_sequence(seq)}'), timeserieskey, localtimestamp,
+            min(datetime), max(datetime), {int(transactionid)}
+        from tmp_values
+        where timeserieskey is not null and datetime is not null
+        group by timeserieskey"""
+
+
+def _statscte(engine, table):
+    """returns the common table expression that adds the records returned by
+    the insert in CTE m (timeserieskey, datetime, scalarvalue, inserted) to
+    the summary table of the schema of table, an empty string if the schema
+    has no summary table. Only inserted records are counted, the range of
+    values is widened by updated records as well"""
+    model = getattr(ormmodels(table.schema), "TimeSeriesStats", None)
+    if model is None:
+        return ""
+    stats = engine.dialect.identifier_preparer.format_table(statstable(engine, model))
+    return f""", st as (
+        insert into {stats} as s (timeserieskey, firstdatetime, lastdatetime,
+            nrecords, minvalue, maxvalue, modificationtime)
+        select timeserieskey, min(datetime), max(datetime),
+            count(*) filter (where inserted), min(scalarvalue), max(scalarvalue),
+            localtimestamp
+        from m group by timeserieskey
+        on conflict (timeserieskey) do update set
+            firstdatetime = least(s.firstdatetime, excluded.firstdatetime),
+            lastdatetime = greatest(s.lastdatetime, excluded.lastdatetime),
+            nrecords = s.nrecords + excluded.nrecords,
+            minvalue = least(s.minvalue, excluded.minvalue),
+            maxvalue = greatest(s.maxvalue, excluded.maxvalue),
+            modificationtime = excluded.modificationtime)"""
+
+
+def _archivefilter(engine, table, alias):
+    """returns the condition that drops the staged records (tmp_values with
+    alias) before the archive cutoff of their timeserieskey (see
+    ts_archive.archivevalues), so archived values are not written to the
+    values table again. An empty string if the schema has no archive state"""
+    model = getattr(ormmodels(table.schema), "ArchiveState", None)
+    if model is None:
+        return ""
+    state = engine.dialect.identifier_preparer.format_table(
+        archivestatetable(engine, model)
+    )
+    return f"""
+        and not exists (select 1 from {state} a
+            where a.timeserieskey = {alias}.timeserieskey
+            and {alias}.datetime < a.archivedbefore)"""
+
+
+# partitioning of the values table by range of datetime, year (default) or
+# month. Partitions are named <table>_y<yyyy> or <table>_m<yyyymm>
+partitioninterval = "year"
+
+# (engine, full table name) --> set of partition names, None if the table is
+# not partitioned
+_partitions = {}
+
+
+def partitionbounds(start, interval=None):
+    """returns the name suffix, start and end (timestamps) of the partition
+    that holds start"""
+    interval = interval or partitioninterval
+    start = pd.Timestamp(start)
+    if interval == "year":
+        lower = pd.Timestamp(year=start.year, month=1, day=1)
+        return f"y{lower:%Y}", lower, lower + pd.DateOffset(years=1)
+    if interval == "month":
+        lower = pd.Timestamp(year=start.year, month=start.month, day=1)
+        return f"m{lower:%Y%m}", lower, lower + pd.DateOffset(months=1)
+    raise ValueError(f"partition interval should be year or month, not {interval}")
+
+
+def partitionddl(engine, table, start, interval=None):
+    """returns the name and the create statement of the partition of table
+    that holds start"""
+    suffix, lower, upper = partitionbounds(start, interval)
+    name = f"{table.name}_{suffix}"
+    prep = engine.dialect.identifier_preparer
+    part = (
+        f"{prep.quote_schema(table.schema)}.{prep.quote(name)}"
+        if table.schema
+        else prep.quote(name)
+    )
+    strsql = f"""create table if not exists {part}
+        partition of {prep.format_table(table)}
+        for values from ('{lower:%Y-%m-%d}') to ('{upper:%Y-%m-%d}')"""
+    return name, strsql
+
+
+def listpartitions(cur, engine, table):
+    """returns the names of the partitions of table (cached per process), None
+    if table is not partitioned. cur is a DBAPI cursor"""
+    key = (engine, table.fullname)
+    if key not in _partitions:
+        target = engine.dialect.identifier_preparer.format_table(table)
+        cur.execute(
+            """select c.relname from pg_partitioned_table p
+               left join pg_inherits i on i.inhparent = p.partrelid
+               left join pg_class c on c.oid = i.inhrelid
+               where p.partrelid = to_regclass(%s)""",
+            (target,),
+        )
+        rows = cur.fetchall()
+        _partitions[key] = {r[0] for r in rows if r[0] is not None} if rows else None
+    return _partitions[key]
+
+
+def _createpartitions(cur, engine, table):
+    """creates the missing partitions of table for the datetimes in
+    tmp_values, no-op for a table that is not partitioned"""
+    existing = listpartitions(cur, engine, table)
+    if existing is None:
+        return []
+    cur.execute(f"""select distinct date_trunc('{partitioninterval}', datetime)
+            from tmp_values where datetime is not null""")
+    created = []
+    for (start,) in cur.fetchall():
+        name, strsql = partitionddl(engine, table, start)
+        if name not in existing:
+            cur.execute(strsql)
+            created.append(name)
+    return created
+
+
+def _stageandmerge(engine, df, table, columns, strsql, transactionid=None):
+    """copies df into temporary table tmp_values (same layout as table) and
+    executes strsql in the same transaction, strsql should return the number
+    of inserted and updated records (and maintains the summary table, see
+    _statscte). With a transactionid the period per timeserieskey is recorded
+    in the transaction table. For a partitioned table missing partitions are
+    created first"""
+    target = engine.dialect.identifier_preparer.format_table(table)
+    cols = ", ".join(columns)
+    conn = engine.raw_connection()
+    try:
+        transsql = _transactionsql(engine, table, transactionid)
+        cur = conn.cursor()
+        cur.execute(f"""create temp table tmp_values (like {target} including defaults)
+                on commit drop""")
+        for i in range(0, len(df), chunksize):
+            buf = io.StringIO()
+            _preparevalues(df.iloc[i : i + chunksize], columns).to_csv(
+                buf, index=False, header=False, date_format="%Y-%m-%d %H:%M:%S.%f"
+            )
+            buf.seek(0)
+            cur.copy_expert(
+                f"copy tmp_values ({cols}) from stdin with (format csv)", buf
+            )
+        created = _createpartitions(cur, engine, table)
+        cur.execute(strsql)
+        inserted, updated = cur.fetchone()
+        if transsql is not None:
+            cur.execute(transsql)
+        conn.commit()
+        if created:
+            _partitions[(engine, table.fullname)].update(created)
+        result = {
+            "rows": len(df),
+            "inserted": inserted,
+            "updated": updated,
+            "skipped": len(df) - inserted - updated,
+        }
+    except Exception as e:
+        conn.rollback()
+        print("exception raised while writing values to", target, e)
+        result = None
+    finally:
+        conn.close()
+    return result
+
+
+@timed(kind="bulk")
+def writevalues(
+    engine,
+    df,
+    model=TimeSeriesValuesAndFlags,
+    onconflict="nothing",
+    transactionid=0,
+    schema=None,
+):
+    """
+    Writes a DataFrame to the values table by streaming it with COPY into a
+    temporary staging table and merging the staging table into the target in
+    one statement. Records that collide with the primary key are skipped
+    (onconflict="nothing") or overwrite the stored record (onconflict="update").
+    Records before the archive cutoff of their timeserieskey are archived (see
+    ts_archive.archivevalues) and skipped.
+    The summary per timeserieskey (see ts_helpers.statstable) is updated in
+    the same transaction, after overwriting values with smaller or larger
+    values use ts_helpers.refreshstats to narrow the range of values again.
+
+    Parameters
+    ----------
+    engine : sqlalchemy engine
+        engine (shared, see ts_helpers.getengine)
+    df : pandas DataFrame
+        columns named after the columns of the values table (timeserieskey,
+        datetime, scalarvalue, flags), other columns are ignored
+    model : ORM class, optional
+        TimeSeriesValuesAndFlags class of the target schema
+    onconflict : string, optional
+        "nothing" (default) or "update"
+    transactionid : integer, optional
+        recorded with the period per timeserieskey in the transaction table
+        (see ts_helpers.watermarks), default 0, None skips recording
+    schema : string, optional
+        schema to write to (see ts_helpers.ormmodels), replaces the schema of
+        model
+
+    Returns
+    -------
+    dictionary with number of rows offered, inserted, updated and skipped,
+    None in case of an exception
+
+    """
+    if schema is not None:
+        model = getattr(ormmodels(schema), model.__name__)
+    table = model.__table__
+    columns = [c.name for c in table.columns if c.name in df.columns]
+    pkcolumns = primarykey(engine, table)
+    if not set(pkcolumns).issubset(columns):
+        print("please provide", ", ".join(pkcolumns), "these are required")
+        return None
+    if onconflict not in ("nothing", "update"):
+        print("onconflict should be nothing or update, not", onconflict)
+        return None
+    if len(df) == 0:
+        return {"rows": 0, "inserted": 0, "updated": 0, "skipped": 0}
+
+    prep = engine.dialect.identifier_preparer
+    target = prep.format_table(table)
+    cols = ", ".join(columns)
+    pkcols = ", ".join(pkcolumns)
+    updcolumns = [c for c in columns if c not in pkcolumns]
+    if onconflict == "update" and len(updcolumns) > 0:
+        action = "do update set " + ", ".join(f"{c} = excluded.{c}" for c in updcolumns)
+    else:
+        action = "do nothing"
+    strsql = f"""with m as (
+        insert into {target} ({cols})
+        select distinct on ({pkcols}) {cols} from tmp_values t
+        where {' and '.join(f't.{c} is not null' for c in pkcolumns)}{_archivefilter(engine, table, 't')}
+        on conflict ({pkcols}) {action}
+        returning timeserieskey, datetime, scalarvalue, (xmax = 0) as inserted)
+        {_statscte(engine, table)}
+        select count(*) filter (where inserted), count(*) filter (where not inserted) from m"""
+    return _stageandmerge(engine, df, table, columns, strsql, transactionid)
+
+
+@timed(kind="bulk")
+def mergevalues(
+    engine, df, model=TimeSeriesValuesAndFlags, transactionid=0, schema=None
+):
+    """
+    Incremental merge of a complete fetched frame. The frame is copied into a
+    staging table, anti-joined against the stored records on the primary key
+    columns and only the missing records are inserted, all in one transaction.
+    Records before the archive cutoff of their timeserieskey are archived (see
+    ts_archive.archivevalues) and skipped.
+    The summary per timeserieskey (see ts_helpers.statstable) is updated in
+    the same transaction.
+
+    Parameters
+    ----------
+    engine : sqlalchemy engine
+        engine (shared, see ts_helpers.getengine)
+    df : pandas DataFrame
+        columns timeserieskey, datetime, scalarvalue and flags
+    model : ORM class, optional
+        TimeSeriesValuesAndFlags class of the target schema
+    transactionid : integer, optional
+        recorded with the period per timeserieskey in the transaction table
+        (see ts_helpers.watermarks), default 0, None skips recording
+    schema : string, optional
+        schema to write to (see ts_helpers.ormmodels), replaces the schema of
+        model
+
+    Returns
+    -------
+    dictionary with number of rows offered, inserted and skipped, None in
+    case of an exception
+
+    """
+    if schema is not None:
+        model = getattr(ormmodels(schema), model.__name__)
+    table = model.__table__
+    columns = [c.name for c in table.columns if c.name in df.columns]
+    pkcolumns = primarykey(engine, table)
+    if not set(pkcolumns).issubset(columns):
+        print("please provide", ", ".join(pkcolumns), "these are required")
+        return None
+    if len(df) == 0:
+        return {"rows": 0, "inserted": 0, "updated": 0, "skipped": 0}
+
+    target = engine.dialect.identifier_preparer.format_table(table)
+    cols = ", ".join(columns)
+    pkcols = ", ".join(pkcolumns)
+    strsql = f"""with m as (
+        insert into {target} ({cols})
+        select distinct on ({pkcols}) {', '.join(f't.{c}' for c in columns)}
+        from tmp_values t
+        where not exists (select 1 from {target} v
+            where {' and '.join(f'v.{c} = t.{c}' for c in pkcolumns)})
+        and {' and '.join(f't.{c} is not null' for c in pkcolumns)}{_archivefilter(engine, table, 't')}
+        on conflict do nothing
+        returning timeserieskey, datetime, scalarvalue, true as inserted)
+        {_statscte(engine, table)}
+        select count(*), 0 from m"""
+    return _stageandmerge(engine, df, table, columns, strsql, transactionid)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoints of long API crawls (Lizard, WSKIP) in a local SQLite file, so a
+crawl that stops halfway (timeout, expired key) resumes where it stopped
+instead of starting again at the first page. Per crawl (run) the completed
+stations and timeseries are recorded, together with the cursor (url of the
+next page) of the event walk of every timeseries that is not completed yet.
+
+A run removes its checkpoints when it completes (see CrawlCheckpoint.reset),
+the next run starts from the beginning again. Keys that failed permanently
+(see CrawlCheckpoint.fail) do not keep a run from completing, and the
+checkpoints of a run that made no progress for maxage are discarded, so a
+crawl can not stay frozen on stale checkpoints.
+"""
+
+#  Copyright notice
+#   --------------------------------------------------------------------
+#   Copyright (C) 2024 Deltares for Projects with a FEWS datamodel in
+#                 PostgreSQL/PostGIS database used in Water Information Systems
+#   Gerrit.Hendriksen@deltares.nl
+#
+#   This library is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this library.  If not, see <http://www.gnu.org/licenses/>.
+#   --------------------------------------------------------------------
+#
+# This tool is part of <a href="http://www.OpenEarth.eu">OpenEarthTools</a>.
+# OpenEarthTools is an online collaboration to share and manage data and
+# programming tools in an open source, version controlled environment.
+# Sign up to recieve regular updates of this function, and to contribute
+# your own tools.
+
+# system modules
+import sqlite3
+import datetime
+
+
+class CrawlCheckpoint:
+    """
+    Checkpoints of one crawl in a SQLite file, every change is committed
+    immediately.
+
+    Parameters
+    ----------
+    path : string
+        SQLite file, created if missing, can be shared by several crawls
+    run : string
+        name of the crawl, e.g. hdsr_timeseries groundwaterstations/
+    maxage : integer, optional
+        seconds after the last checkpoint of the run after which the
+        checkpoints are discarded and the crawl starts at the beginning,
+        default one day. A crawl that makes progress keeps its checkpoints,
+        None keeps checkpoints until the run completes
+
+    """
+
+    def __init__(self, path, run, maxage=86400):
+        self.path = path
+        self.run = run
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """create table if not exists checkpoint (
+                run text, kind text, key text, value text, modificationtime text,
+                primary key (run, kind, key))"""
+        )
+        self.conn.commit()
+        if maxage is not None:
+            last = self.conn.execute(
+                "select max(modificationtime) from checkpoint where run = ?",
+                (run,),
+            ).fetchone()[0]
+            oldest = datetime.datetime.now() - datetime.timedelta(seconds=maxage)
+            if last is not None and datetime.datetime.fromisoformat(last) < oldest:
+                print("checkpoints of", run, "until", last, "are discarded")
+                self.reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _set(self, kind, key, value):
+        self.conn.execute(
+            """insert into checkpoint (run, kind, key, value, modificationtime)
+                values (?, ?, ?, ?, ?)
+                on conflict (run, kind, key) do update set
+                    value = excluded.value,
+                    modificationtime = excluded.modificationtime""",
+            (self.run, kind, str(key), value, datetime.datetime.now().isoformat()),
+        )
+        self.conn.commit()
+
+    def _delete(self, kind, key):
+        self.conn.execute(
+            "delete from checkpoint where run = ? and kind = ? and key = ?",
+            (self.run, kind, str(key)),
+        )
+        self.conn.commit()
+
+    def completed(self, kind):
+        """returns the keys of kind (station, timeseries, ...) that are
+        completed in this run"""
+        rows = self.conn.execute(
+            "select key from checkpoint where run = ? and kind = ? and value = 'done'",
+            (self.run, kind),
+        )
+        return {r[0] for r in rows}
+
+    def isdone(self, kind, key):
+        """returns True if key of kind is completed in this run"""
+        row = self.conn.execute(
+            """select 1 from checkpoint
+                where run = ? and kind = ? and key = ? and value = 'done'""",
+            (self.run, kind, str(key)),
+        ).fetchone()
+        return row is not None
+
+    def done(self, kind, key):
+        """records key of kind as completed, removes its cursor"""
+        self._set(kind, key, "done")
+        self._delete("cursor", key)
+
+    def fail(self, kind, key):
+        """records key of kind as failed: it does not keep the run from
+        completing and is tried again when its parent is not completed"""
+        self._set(kind, key, "failed")
+
+    def cursor(self, key):
+        """returns the url of the next page of the walk of key, None if the
+        walk has not started"""
+        row = self.conn.execute(
+            "select value from checkpoint where run = ? and kind = 'cursor' and key = ?",
+            (self.run, str(key)),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def setcursor(self, key, url):
+        """records url as the next page of the walk of key, call after the
+        previous page is stored"""
+        self._set("cursor", key, url)
+
+    def reset(self):
+        """removes all checkpoints of this run, the next run starts at the
+        beginning"""
+        self.conn.execute("delete from checkpoint where run = ?", (self.run,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
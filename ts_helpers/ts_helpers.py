@@ -35,10 +35,17 @@ Created on Thu Jan  7 14:49:58 2021
 import os
 import time
 import datetime
+import threading
+import sys
+import importlib
 
 # third party modules
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine, func, update, insert, text
+import dateutil.tz
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, func, update, insert, text, select
+from sqlalchemy import values, column, exists, literal, true
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import Boolean, Integer, Float, DateTime, String, Text
 from geoalchemy2 import Geometry
@@ -54,13 +61,136 @@ from orm_timeseries.orm_timeseries import (
     TimeStep,
     Flags,
     Transaction,
+    TimeSeriesStats,
+    ArchiveState,
+    BoundingBox,
+    GroupName,
 )
 
+# instrumentation (opt-in), ts_helpers is used both as package and as module
+try:
+    from ts_helpers.ts_metrics import timed
+except ImportError:
+    from ts_metrics import timed
+
+_timed = timed(FileSource.__table__.schema)
+
+# ORM module per schema. Every helper takes the schema it works in as argument
+# (default timeseries, which also holds the WSKIP data), so one process can
+# load all sources over one engine and one key registry.
+ormmodules = {
+    "timeseries": "orm_timeseries.orm_timeseries",
+    "bro_timeseries": "orm_timeseries.orm_timeseries_bro",
+    "hdsr_timeseries": "orm_timeseries.orm_timeseries_hdsr",
+    "hhnk_timeseries": "orm_timeseries.orm_timeseries_hhnk",
+    "delftimeseries": "orm_timeseries.orm_timeseries_delf",
+    "nobv_timeseries": "orm_timeseries.orm_timeseries_nobv",
+    "waterschappen_timeseries": "orm_timeseries.orm_timeseries_waterschappen",
+}
+
+
+def ormmodels(schema=None):
+    """Returns the ORM module (with FileSource, Location, TimeSeries etc.) of
+    schema, None gives the module of the timeseries schema"""
+    if schema is None:
+        return sys.modules[FileSource.__module__]
+    if schema not in ormmodules:
+        raise ValueError(
+            f"unknown schema {schema}, choose from {', '.join(ormmodules)}"
+        )
+    return importlib.import_module(ormmodules[schema])
+
+
+def _model(model, schema):
+    """returns the ORM class of schema with the name of model"""
+    if schema is None:
+        return model
+    return getattr(ormmodels(schema), model.__name__)
+
+
+# process wide registry of engines, keyed by connection string. Every helper
+# borrows a connection from the pool of the engine instead of creating (and
+# disposing) an engine per call.
+_connectionstrings = {}
+_engines = {}
+_sessionmakers = {}
+_registrylock = threading.Lock()
 
+# default pool configuration, can be altered with setpoolconfig before the
+# first call to establishconnection
+poolconfig = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_recycle": 1800,
+    "pool_pre_ping": True,
+}
+
+
+def setpoolconfig(**kwargs):
+    """Alters the pool configuration used for engines created after this call
+
+    Args:
+        kwargs: any keyword accepted by sqlalchemy create_engine (pool_size,
+                max_overflow, pool_recycle, pool_pre_ping, pool_timeout)
+    """
+    poolconfig.update(kwargs)
+
+
+def readconnectionstring(fc):
+    """Reads (once) the connectionstring from the file that is passed
+
+    Args:
+        fc (string): location of the file with a connectionstring
+
+    Returns:
+        string: the connectionstring
+    """
+    constr = _connectionstrings.get(fc)
+    if constr is None:
+        with open(fc) as f:
+            constr = f.read().strip()
+        _connectionstrings[fc] = constr
+    return constr
+
+
+def getengine(fc):
+    """Returns the shared engine for the connectionstring in file fc, the
+    engine (and connection pool) is created on first request only
+
+    Args:
+        fc (string): location of the file with a connectionstring
+
+    Returns:
+        engine: sqlalchemy engine object
+    """
+    constr = readconnectionstring(fc)
+    engine = _engines.get(constr)
+    if engine is None:
+        with _registrylock:
+            engine = _engines.get(constr)
+            if engine is None:
+                engine = create_engine(constr, echo=False, **poolconfig)
+                _sessionmakers[constr] = sessionmaker(bind=engine)
+                _engines[constr] = engine
+    return engine
+
+
+def disposeengines():
+    """Closes all pooled connections of all registered engines, call at the
+    end of a run"""
+    with _registrylock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _sessionmakers.clear()
+
+
+@timed()
 def establishconnection(fc):
     """
     Set up a orm session to the target database with the connectionstring
-    in the file that is passed
+    in the file that is passed. The engine is shared within the process,
+    so do not dispose the engine after use, close the session instead.
 
     Parameters
     ----------
@@ -76,11 +206,8 @@ def establishconnection(fc):
         returns orm session
 
     """
-    f = open(fc)
-    engine = create_engine(f.read(), echo=False)
-    f.close()
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    engine = getengine(fc)
+    session = _sessionmakers[readconnectionstring(fc)]()
     session.rollback()
     return session, engine
 
@@ -106,7 +233,92 @@ def testconnection(engine):
         return a
 
 
-def loadfilesource(source, fc, remark="", lasttransactionid=None):
+# in memory registry of resolved keys of the dimension tables. For every table
+# the natural key columns (the columns the helpers filter on) and the value
+# columns that are returned are given.
+keycolumns = {
+    "filesource": (("filesource",), ("filesourcekey", "lasttransactionid")),
+    "unit": (("unit",), ("unitkey",)),
+    "flags": (("id",), ("flagkey",)),
+    "parameter": (
+        ("id", "unitkey", "compartment", "waarnemingssoort"),
+        ("parameterkey",),
+    ),
+    "timesteps": (("id",), ("timestepkey",)),
+    "location": (("name",), ("locationkey",)),
+    "timeseries": (
+        ("locationkey", "parameterkey", "timestepkey", "filesourcekey"),
+        ("timeserieskey",),
+    ),
+}
+_keycache = {}
+
+
+def _cachekey(row, columns):
+    """returns a scalar for a single column, a tuple otherwise"""
+    if len(columns) == 1:
+        return row[0]
+    return tuple(row)
+
+
+def keycache(engine, model):
+    """Returns the key registry for the table of the given ORM class. On first
+    request the registry is filled with one select over the complete table,
+    after that lookups are done in memory and only misses go to the database.
+
+    Args:
+        engine (sqlalchemy engine): engine (shared, see getengine)
+        model (ORM class): one of FileSource, Unit, Flags, Parameter,
+                           TimeStep, TimeSeries or Location (of any schema)
+
+    Returns:
+        dictionary: natural key --> key (or tuple of values)
+    """
+    table = model.__table__
+    ckey = (engine, table.fullname)
+    cache = _keycache.get(ckey)
+    if cache is None:
+        natural, values = keycolumns[table.name]
+        stmt = select(*[table.c[c] for c in natural + values])
+        cache = {}
+        try:
+            with engine.connect() as conn:
+                for row in conn.execute(stmt):
+                    cache[_cachekey(row[: len(natural)], natural)] = _cachekey(
+                        row[len(natural) :], values
+                    )
+            _keycache[ckey] = cache
+        except Exception as e:
+            print("exception raised while warming key registry", table.fullname, e)
+    return cache
+
+
+def warmkeycache(
+    fc,
+    models=(FileSource, Unit, Flags, Parameter, TimeStep, TimeSeries, Location),
+    schema=None,
+):
+    """Fills the key registry for all dimension tables, one select per table,
+    typically called once at the start of a run
+
+    Args:
+        fc (string): link to file with connection string to database
+        models (tuple, optional): ORM classes of the tables to load
+        schema (string, optional): schema to work in (see ormmodels), replaces
+            the schema of models
+    """
+    engine = getengine(fc)
+    for model in models:
+        keycache(engine, _model(model, schema))
+
+
+def clearkeycache():
+    """Empties the key registry, i.e. after records have been deleted"""
+    _keycache.clear()
+
+
+@_timed
+def loadfilesource(source, fc, remark="", lasttransactionid=None, schema=None):
     """
     Checks whether a source is already recorded in the database. If not recorded,
     then creates a new entry. In any case the filesourcekey is returned.
@@ -121,6 +333,8 @@ def loadfilesource(source, fc, remark="", lasttransactionid=None):
         any arbitrary remark
     fc : string
         link to file with connection string to database
+    schema : string, optional
+        schema to work in (see ormmodels), default timeseries
 
     Returns
     -------
@@ -128,29 +342,36 @@ def loadfilesource(source, fc, remark="", lasttransactionid=None):
 
     """
 
+    orm = ormmodels(schema)
+    cache = keycache(getengine(fc), orm.FileSource)
+    if source in cache:
+        fkey, ftid = cache[source]
+        return (fkey,), ftid
+
     # setup connection to database
     session, engine = establishconnection(fc)
 
-    f = session.query(FileSource).filter_by(filesource=source).first()
+    f = session.query(orm.FileSource).filter_by(filesource=source).first()
     try:
         if str(f) == "None":
-            f = FileSource(
+            f = orm.FileSource(
                 filesource=source, remark=remark, lasttransactionid=lasttransactionid
             )
             session.add(f)
             session.commit()
         fkey = (f.filesourcekey,)
         ftid = f.lasttransactionid
+        cache[source] = (f.filesourcekey, ftid)
     except:
         fkey = None
         ftid = None
         print("exception raised while retrieving/assigning filesource")
     finally:
         session.close()
-        engine.dispose()
         return fkey, ftid
 
 
+@_timed
 def location(
     fc,
     fskey,
@@ -165,6 +386,8 @@ def location(
     diverid=None,
     tubebot=None,
     tubetop=None,
+    filterid=None,
+    schema=None,
 ):
     """
     Parameters
@@ -190,6 +413,10 @@ def location(
         integer value corresponding to global coordinate reference sytems (i.e. NL = RDNAP = 28992, WGS84=4326)
     altitude_msl : float
         eleveation area of the installation with respect to reference (i.e. m-MSL or m-NAP).
+    filterid: integer
+        unique number of the filter
+    schema : string, optional
+        schema to work in (see ormmodels), default timeseries
 
     Returns
     -------
@@ -207,17 +434,24 @@ def location(
         return
     else:
         print(x, y, epsg)
+    orm = ormmodels(schema)
+    cache = keycache(getengine(fc), orm.Location)
+    if name in cache:
+        return cache[name]
+
     session, engine = establishconnection(fc)
-    f = session.query(Location).filter_by(name=name).first()
+    f = session.query(orm.Location).filter_by(name=name).first()
     try:
         if str(f) == "None":
-            f = Location(
+            boundingboxtable(engine, orm.BoundingBox)
+            f = orm.Location(
                 filesourcekey=fskey,
                 name=name,
                 shortname=shortname,
                 description=description,
                 tubebot=tubebot,
                 tubetop=tubetop,
+                filterid=filterid,
                 x=x,
                 y=y,
                 z=z,
@@ -228,24 +462,307 @@ def location(
 
             session.add(f)
             session.commit()
-            if epsg == 28992:
-                strsql = "update timeseries.location set geom = st_setsrid(st_point(x,y),epsgcode) where geom is null"
-            else:
-                strsql = "update timeseries.location set geom = st_transform(st_setsrid(st_point(x,y),epsgcode),28992) where geom is null"
-            engine.execute(strsql)
+            setgeometry(session, orm.Location.__table__, [f.locationkey])
+            updateboundingbox(session, [f.locationkey], orm.BoundingBox)
+            session.commit()
         else:
             print("name already stored in location table", name, f.locationkey)
         lkey = f.locationkey
+        cache[name] = lkey
     except:
         lkey = None
         print("exception raised while retrieving/assigning location")
     finally:
         session.close()
-        engine.dispose()
         return lkey
 
 
-def sunit(fc, unit, descr):
+def geometryexpression(x, y, epsgcode):
+    """returns the sql expression that builds a point in EPSG:28992 from
+    coordinates in any crs (st_transform leaves 28992 points untouched)"""
+    return func.ST_Transform(func.ST_SetSRID(func.ST_Point(x, y), epsgcode), 28992)
+
+
+def setgeometry(conn, table, keys):
+    """Sets geom for the given locationkeys in one statement
+
+    Args:
+        conn (sqlalchemy connection or session): open connection
+        table (sqlalchemy table): location table (i.e. Location.__table__)
+        keys (list): locationkeys
+    """
+    stmt = (
+        update(table)
+        .where(table.c.locationkey.in_(keys))
+        .values(geom=geometryexpression(table.c.x, table.c.y, table.c.epsgcode))
+    )
+    conn.execute(stmt)
+
+
+@_timed
+def location_many(fc, df, fskey=None, model=Location, schema=None):
+    """
+    Registers a batch of locations in one insert statement. Names that are
+    already stored are left untouched, for new records the geometry
+    (EPSG:28992) is derived from x, y and epsgcode in the same statement.
+
+    Parameters
+    ----------
+    fc : string
+        Link to credentials file for access to database.
+    df : pandas DataFrame
+        One record per location, columns named after the location table
+        (name, x, y, epsgcode, filesourcekey, shortname, description, z,
+        altitude_msl, diverid, filterid, tubetop, tubebot). The columns fskey
+        and epsg are accepted as alias for filesourcekey and epsgcode.
+    fskey : integer, optional
+        filesourcekey for records without filesourcekey
+    model : ORM class, optional
+        Location class of the target schema
+    schema : string, optional
+        schema to work in (see ormmodels), replaces the schema of model
+
+    Returns
+    -------
+    dictionary with name --> locationkey for every name in df
+
+    """
+    model = _model(model, schema)
+    table = model.__table__
+    df = df.rename(columns={"fskey": "filesourcekey", "epsg": "epsgcode"})
+    if fskey is not None:
+        if isinstance(fskey, tuple):
+            fskey = fskey[0]
+        if "filesourcekey" in df.columns:
+            df["filesourcekey"] = df["filesourcekey"].fillna(fskey)
+        else:
+            df["filesourcekey"] = fskey
+    missing = {"name", "x", "y", "epsgcode", "filesourcekey"} - set(df.columns)
+    if missing:
+        print("please provide", ", ".join(sorted(missing)), "these are required")
+        return {}
+    df = df.dropna(subset=["name", "x", "y", "epsgcode"]).drop_duplicates("name")
+
+    engine = getengine(fc)
+    cache = keycache(engine, model)
+    new = df[~df["name"].isin(list(cache.keys()))]
+    if len(new) > 0:
+        cols = [
+            c for c in new.columns if c in table.c and c not in ("locationkey", "geom")
+        ]
+        records = new[cols].astype(object).where(pd.notna(new[cols]), None)
+        src = values(
+            *[column(c, table.c[c].type) for c in cols], name="newlocations"
+        ).data(list(records.itertuples(index=False, name=None)))
+        stmt = insert(table).from_select(
+            cols + ["geom"],
+            select(
+                *[src.c[c] for c in cols],
+                geometryexpression(src.c.x, src.c.y, src.c.epsgcode),
+            ).where(~exists().where(table.c.name == src.c.name)),
+        )
+        try:
+            boundingboxtable(engine, _model(BoundingBox, table.schema))
+            with engine.begin() as conn:
+                # serialise concurrent registrations, name is not a unique key
+                conn.execute(
+                    text("select pg_advisory_xact_lock(hashtext(:t))"),
+                    {"t": table.fullname},
+                )
+                inserted = [
+                    r[0] for r in conn.execute(stmt.returning(table.c.locationkey))
+                ]
+                updateboundingbox(conn, inserted, _model(BoundingBox, table.schema))
+                stmt = (
+                    select(table.c.name, func.min(table.c.locationkey))
+                    .where(table.c.name.in_(list(new["name"])))
+                    .group_by(table.c.name)
+                )
+                for name, lkey in conn.execute(stmt):
+                    cache[name] = lkey
+        except Exception as e:
+            print("exception raised while registering locations", e)
+    return {n: cache[n] for n in df["name"] if n in cache}
+
+
+# bounding box tables that are verified (created and filled) in this process
+_boundingboxes = set()
+
+# group of a location (alias l): the first three characters of the name, e.g.
+# ASD for the extensometers in Assendelft
+groupcodesql = "left(l.name, 3)"
+
+
+def _boundingboxsql(conn, model, where):
+    """returns the statement that widens the bounding boxes of the schema of
+    model with the locations (alias l) that satisfy where"""
+    prep = conn.engine.dialect.identifier_preparer
+    bb = prep.format_table(model.__table__)
+    loc = prep.format_table(schematable(model, "location"))
+    names = prep.format_table(schematable(model, "groupname"))
+    return f"""insert into {bb} as bb (groupcode, groupname, minx, miny, maxx,
+            maxy, nlocations, bbgeom, modificationtime)
+        select a.groupcode, coalesce(g.groupname, a.groupcode), a.minx, a.miny,
+            a.maxx, a.maxy, a.nlocations,
+            st_makeenvelope(a.minx, a.miny, a.maxx, a.maxy, 28992), localtimestamp
+        from (select {groupcodesql} as groupcode, min(st_x(l.geom)) as minx,
+                min(st_y(l.geom)) as miny, max(st_x(l.geom)) as maxx,
+                max(st_y(l.geom)) as maxy, count(*) as nlocations
+            from {loc} l
+            where l.geom is not null and l.name is not null and {where}
+            group by 1) a
+        left join {names} g on g.groupcode = a.groupcode
+        on conflict (groupcode) do update set
+            minx = least(bb.minx, excluded.minx),
+            miny = least(bb.miny, excluded.miny),
+            maxx = greatest(bb.maxx, excluded.maxx),
+            maxy = greatest(bb.maxy, excluded.maxy),
+            nlocations = bb.nlocations + excluded.nlocations,
+            bbgeom = st_makeenvelope(least(bb.minx, excluded.minx),
+                least(bb.miny, excluded.miny), greatest(bb.maxx, excluded.maxx),
+                greatest(bb.maxy, excluded.maxy), 28992),
+            modificationtime = excluded.modificationtime"""
+
+
+def boundingboxtable(engine, model=BoundingBox):
+    """Returns the bounding box table (extent and number of located locations
+    per group, see groupcodesql) of the schema of model. On first use in the
+    process the table and the group name table are created if missing and the
+    bounding box table is filled when empty. A table created by the former
+    extensometer/create_bb.sql (without groupcode) is replaced. After that
+    location and location_many widen the boxes of the locations they register.
+
+    Args:
+        engine (sqlalchemy engine): engine (shared, see getengine)
+        model (ORM class, optional): BoundingBox class of the target schema
+
+    Returns:
+        sqlalchemy Table
+    """
+    table = model.__table__
+    ckey = (engine, table.fullname)
+    if ckey not in _boundingboxes:
+        bb = engine.dialect.identifier_preparer.format_table(table)
+        strsql = """select count(*) from pg_attribute
+            where attrelid = to_regclass(:t) and attname = 'groupcode'"""
+        with engine.begin() as conn:
+            exists = conn.execute(text("select to_regclass(:t)"), {"t": bb}).scalar()
+            if exists and conn.execute(text(strsql), {"t": bb}).scalar() == 0:
+                print("replacing bounding box table", table.fullname)
+                conn.execute(text(f"drop table {bb}"))
+            schematable(model, "groupname").create(conn, checkfirst=True)
+            table.create(conn, checkfirst=True)
+            if conn.execute(text(f"select count(*) from {bb}")).scalar() == 0:
+                conn.execute(text(_boundingboxsql(conn, model, "true")))
+        _boundingboxes.add(ckey)
+    return table
+
+
+def updateboundingbox(conn, locationkeys, model=BoundingBox):
+    """Widens the bounding boxes with the given (newly registered) locations
+    in the transaction of conn, so map clients see the current extents
+    without a rebuild. The table must exist (see boundingboxtable).
+
+    Args:
+        conn (sqlalchemy connection or session): open connection
+        locationkeys (list): locationkeys of the new locations
+        model (ORM class, optional): BoundingBox class of the target schema
+    """
+    if len(locationkeys) == 0:
+        return
+    if not hasattr(conn, "engine"):
+        conn = conn.connection()
+    conn.execute(
+        text(_boundingboxsql(conn, model, "l.locationkey = any(:keys)")),
+        {"keys": [int(k) for k in locationkeys]},
+    )
+
+
+@_timed
+def rebuildboundingbox(fc, model=BoundingBox, schema=None):
+    """
+    Recomputes the bounding boxes of the schema of model from the location
+    table in one transaction, needed after locations are deleted or moved
+    (registrations only widen the boxes).
+
+    Parameters
+    ----------
+    fc : string
+        Link to credentials file for access to database.
+    model : ORM class, optional
+        BoundingBox class of the target schema
+    schema : string, optional
+        schema to work in (see ormmodels), replaces the schema of model
+
+    Returns
+    -------
+    number of groups, None in case of an exception
+
+    """
+    model = _model(model, schema)
+    engine = getengine(fc)
+    table = boundingboxtable(engine, model)
+    bb = engine.dialect.identifier_preparer.format_table(table)
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"delete from {bb}"))
+            return conn.execute(text(_boundingboxsql(conn, model, "true"))).rowcount
+    except Exception as e:
+        print("exception raised while rebuilding", table.fullname, e)
+        return None
+
+
+@_timed
+def setgroupnames(fc, groupnames, model=GroupName, schema=None):
+    """
+    Stores the display names of groups (e.g. ASD --> Assendelft) and applies
+    them to the bounding boxes.
+
+    Parameters
+    ----------
+    fc : string
+        Link to credentials file for access to database.
+    groupnames : dictionary
+        groupcode --> groupname
+    model : ORM class, optional
+        GroupName class of the target schema
+    schema : string, optional
+        schema to work in (see ormmodels), replaces the schema of model
+
+    Returns
+    -------
+    number of bounding boxes renamed
+
+    """
+    model = _model(model, schema)
+    table = model.__table__
+    engine = getengine(fc)
+    bbtable = boundingboxtable(engine, _model(BoundingBox, table.schema))
+    prep = engine.dialect.identifier_preparer
+    names = prep.format_table(table)
+    bb = prep.format_table(bbtable)
+    params = [{"code": k, "name": v} for k, v in groupnames.items()]
+    if len(params) == 0:
+        return 0
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"""insert into {names} (groupcode, groupname)
+                values (:code, :name)
+                on conflict (groupcode) do update set groupname = excluded.groupname"""
+            ),
+            params,
+        )
+        n = conn.execute(
+            text(f"""update {bb} bb set groupname = g.groupname from {names} g
+                where g.groupcode = bb.groupcode
+                and bb.groupname is distinct from g.groupname""")
+        ).rowcount
+    return n
+
+
+@_timed
+def sunit(fc, unit, descr, schema=None):
     """
     Parameters
     ----------
@@ -255,33 +772,41 @@ def sunit(fc, unit, descr):
         short unit description (mg/l).
     descr : string
         long unit description (milligram per liter in surface water).
+    schema : string, optional
+        schema to work in (see ormmodels), default timeseries
 
     Returns
     -------
     unitkey: integer
 
     """
+    orm = ormmodels(schema)
+    cache = keycache(getengine(fc), orm.Unit)
+    if unit in cache:
+        return cache[unit]
+
     session, engine = establishconnection(fc)
-    f = session.query(Unit).filter_by(unit=unit).first()
+    f = session.query(orm.Unit).filter_by(unit=unit).first()
     try:
         if str(f) == "None":
-            f = Unit(unit=unit, unitdescription=descr)
+            f = orm.Unit(unit=unit, unitdescription=descr)
             session.add(f)
             session.commit()
             unitkey = f.unitkey
         else:
             print("unit already stored in parameter table", unit, f.unitkey)
             unitkey = f.unitkey
+        cache[unit] = unitkey
     except:
         print("exception raised while retrieving/assigning unit")
         unitkey = None
     finally:
         session.close()
-        engine.dispose()
         return unitkey
 
 
-def sflag(fc, flag, descr=""):
+@_timed
+def sflag(fc, flag, descr="", schema=None):
     """
     Parameters
     ----------
@@ -291,31 +816,39 @@ def sflag(fc, flag, descr=""):
         indicator for quality of the measurment.
     descr : string
         long unit description (milligram per liter in surface water).
+    schema : string, optional
+        schema to work in (see ormmodels), default timeseries
 
     Returns
     -------
     flagkey: integer
 
     """
+    orm = ormmodels(schema)
+    cache = keycache(getengine(fc), orm.Flags)
+    if flag in cache:
+        return cache[flag]
+
     session, engine = establishconnection(fc)
-    f = session.query(Flags).filter_by(id=flag).first()
+    f = session.query(orm.Flags).filter_by(id=flag).first()
     try:
         if str(f) == "None":
-            f = Flags(id=flag, name=descr)
+            f = orm.Flags(id=flag, name=descr)
             session.add(f)
             session.commit()
         else:
             print("flag already stored in parameter table", flag, f.flagkey)
         flagkey = f.flagkey
+        cache[flag] = flagkey
     except:
         print("exception raised while retrieving/assigning flag")
         flagkey = None
     finally:
         session.close()
-        engine.dispose()
         return flagkey
 
 
+@_timed
 def sparameter(
     fc,
     parameter,
@@ -327,6 +860,7 @@ def sparameter(
     valueresolution=None,
     compartment=None,
     wns=None,
+    schema=None,
 ):
     """
     Parameters
@@ -349,17 +883,24 @@ def sparameter(
         Compartment describes the compartment of the measurement
     waarnemingssoort : String, optional
         Waarnemingssoort is de aquo codering voor de combinatie van typering, grootheid, parameter, hoedanigheid, eenheid en compartiment (bijna)
+    schema : string, optional
+        schema to work in (see ormmodels), default timeseries
     Returns
     -------
     parameterkey: integer
 
     """
-    session, engine = establishconnection(fc)
-
     # check or set unit
-    unitkey = sunit(fc, unit[0], unit[1])
+    unitkey = sunit(fc, unit[0], unit[1], schema)
+    orm = ormmodels(schema)
+    cache = keycache(getengine(fc), orm.Parameter)
+    nkey = (parameter, unitkey, compartment, wns)
+    if nkey in cache:
+        return cache[nkey]
+
+    session, engine = establishconnection(fc)
     f = (
-        session.query(Parameter)
+        session.query(orm.Parameter)
         .filter_by(
             id=parameter, unitkey=unitkey, compartment=compartment, waarnemingssoort=wns
         )
@@ -367,7 +908,7 @@ def sparameter(
     )
     try:
         if str(f) == "None":
-            f = Parameter(
+            f = orm.Parameter(
                 id=parameter,
                 shortname=shortname,
                 description=description,
@@ -389,16 +930,17 @@ def sparameter(
                 f.unitkey,
                 f.compartment,
             )
+        cache[nkey] = parameterkey
     except:
         print("exception raised while retrieving/assigning parameter")
         parameterkey = None
     finally:
         session.close()
-        engine.dispose()
         return parameterkey
 
 
-def stimestep(session, timestep, label=""):
+@_timed
+def stimestep(session, timestep, label="", schema=None):
     """
     Parameters
     ----------
@@ -408,20 +950,28 @@ def stimestep(session, timestep, label=""):
         timestep identifier.
     label: string
         label of the timestep i.e. description
+    schema : string, optional
+        schema to work in (see ormmodels), default timeseries
     Returns
     -------
     tstkey : integer
         timestepkey, unique identifier
     """
-    f = session.query(TimeStep).filter_by(id=timestep).first()
+    orm = ormmodels(schema)
+    cache = keycache(session.get_bind(), orm.TimeStep)
+    if timestep in cache:
+        return cache[timestep]
+
+    f = session.query(orm.TimeStep).filter_by(id=timestep).first()
     try:
         if str(f) == "None":
-            f = TimeStep(id=timestep, label=label)
+            f = orm.TimeStep(id=timestep, label=label)
             session.add(f)
             session.commit()
         else:
             print("timestep described in table", timestep, f.timestepkey)
         timestepkey = f.timestepkey
+        cache[timestep] = timestepkey
     except:
         timestepkey = None
         print("exception raised while retrieving/assigning timestep")
@@ -429,7 +979,10 @@ def stimestep(session, timestep, label=""):
         return timestepkey
 
 
-def sserieskey(fc, parameterkey, locationkey, filesourcekey, timestep="nonequidistant"):
+@_timed
+def sserieskey(
+    fc, parameterkey, locationkey, filesourcekey, timestep="nonequidistant", schema=None
+):
     """
 
 
@@ -445,6 +998,8 @@ def sserieskey(fc, parameterkey, locationkey, filesourcekey, timestep="nonequidi
         the unique filesource identifier
     timestep : string
         timestep id (the main name of the timestep, default is nonequidistant).
+    schema : string, optional
+        schema to work in (see ormmodels), default timeseries
 
     Returns
     -------
@@ -452,30 +1007,33 @@ def sserieskey(fc, parameterkey, locationkey, filesourcekey, timestep="nonequidi
         DESCRIPTION.
 
     """
+    orm = ormmodels(schema)
     session, engine = establishconnection(fc)
     lk = locationkey
     pk = parameterkey
-    tk = stimestep(session, timestep)
+    tk = stimestep(session, timestep, schema=schema)
     fk = filesourcekey
-    tsk = (
-        session.query(TimeSeries)
-        .filter_by(locationkey=lk, parameterkey=pk, timestepkey=tk, filesourcekey=fk)
-        .first()
-    )
+    if isinstance(fk, tuple):
+        # loadfilesource returns the filesourcekey as a tuple
+        fk = fk[0]
+    cache = keycache(engine, orm.TimeSeries)
+    if (lk, pk, tk, fk) in cache:
+        session.close()
+        return cache[(lk, pk, tk, fk)]
+
     try:
-        if tsk is None:
-            # find serieskey max value
-            i = (
-                session.query(func.max(TimeSeries.timeserieskey).label("timeserieskey"))
-                .one()
-                .timeserieskey
+        # serialise registration of series by concurrent loaders
+        lockseries(session, orm.TimeSeries)
+        tsk = (
+            session.query(orm.TimeSeries)
+            .filter_by(
+                locationkey=lk, parameterkey=pk, timestepkey=tk, filesourcekey=fk
             )
-            if i is None:
-                i = 1
-            else:
-                i = i + 1
-            atsk = TimeSeries(
-                timeserieskey=i,
+            .first()
+        )
+        if tsk is None:
+            atsk = orm.TimeSeries(
+                timeserieskey=reserve_series_keys(fc, 1, orm.TimeSeries)[0],
                 locationkey=lk,
                 parameterkey=pk,
                 timestepkey=tk,
@@ -486,15 +1044,168 @@ def sserieskey(fc, parameterkey, locationkey, filesourcekey, timestep="nonequidi
             session.commit()
             tsk = atsk
         timeserieskey = tsk.timeserieskey
+        cache[(lk, pk, tk, fk)] = timeserieskey
     except:
         timeserieskey = None
         print("exception raised while retrieving/assigning timeseries")
     finally:
         session.close()
-        engine.dispose()
         return timeserieskey
 
 
+def lockseries(conn, model=TimeSeries):
+    """Takes a transaction level advisory lock for registration of series in
+    the table of model, released at commit/rollback"""
+    conn.execute(
+        text("select pg_advisory_xact_lock(hashtext(:t))"),
+        {"t": model.__table__.fullname},
+    )
+
+
+# sequences that are verified (and synchronised with max(timeserieskey)) in
+# this process
+_syncedsequences = set()
+
+
+def seriessequence(engine, model=TimeSeries):
+    """Returns the sequence that generates the timeserieskey of model. On first
+    use in the process the sequence is created if missing and moved past the
+    highest timeserieskey that is already stored (keys used to be assigned
+    with max(timeserieskey)+1).
+
+    Args:
+        engine (sqlalchemy engine): engine (shared, see getengine)
+        model (ORM class, optional): TimeSeries class of the target schema
+
+    Returns:
+        sqlalchemy Sequence
+    """
+    table = model.__table__
+    seq = table.c.timeserieskey.default
+    ckey = (engine, table.fullname)
+    if ckey not in _syncedsequences:
+        prep = engine.dialect.identifier_preparer
+        # setval marks the sequence as called, so nextval returns m + 1, also
+        # for a fresh sequence (last_value 1, not called) when m is 1
+        strsql = f"""select setval('{prep.format_sequence(seq)}', m, true)
+            from (select max(timeserieskey) as m from {prep.format_table(table)}) t
+            where m >= (select last_value from {prep.format_sequence(seq)})"""
+        with engine.begin() as conn:
+            seq.create(conn, checkfirst=True)
+            conn.execute(text(strsql))
+        _syncedsequences.add(ckey)
+    return seq
+
+
+@_timed
+def reserve_series_keys(fc, n, model=TimeSeries, schema=None):
+    """Reserves n timeserieskeys from the sequence in one round trip. Keys are
+    unique over all processes that use the sequence, reserved keys that are
+    not used leave a gap.
+
+    Args:
+        fc (string): link to file with connection string to database
+        n (integer): number of keys
+        model (ORM class, optional): TimeSeries class of the target schema
+        schema (string, optional): schema to work in (see ormmodels), replaces
+            the schema of model
+
+    Returns:
+        list: n timeserieskeys
+    """
+    model = _model(model, schema)
+    if n < 1:
+        return []
+    engine = getengine(fc)
+    seq = seriessequence(engine, model)
+    stmt = select(seq.next_value()).select_from(func.generate_series(1, n))
+    with engine.connect() as conn:
+        keys = [r[0] for r in conn.execute(stmt)]
+    return keys
+
+
+@_timed
+def sserieskey_many(fc, df, timestep="nonequidistant", model=TimeSeries, schema=None):
+    """
+    Registers a batch of timeseries in one statement and returns the
+    timeserieskey of every combination of location, parameter, timestep and
+    filesource in df. New combinations get keys from reserve_series_keys.
+
+    Parameters
+    ----------
+    fc : string
+        Link to credentials file for access to database.
+    df : pandas DataFrame
+        columns locationkey, parameterkey, filesourcekey and optionally
+        timestepkey or timestep (timestep id)
+    timestep : string, optional
+        timestep id for records without timestep, default is nonequidistant
+    model : ORM class, optional
+        TimeSeries class of the target schema
+    schema : string, optional
+        schema to work in (see ormmodels), replaces the schema of model
+
+    Returns
+    -------
+    dictionary with (locationkey, parameterkey, timestepkey, filesourcekey)
+    --> timeserieskey
+
+    """
+    model = _model(model, schema)
+    table = model.__table__
+    natural = list(keycolumns["timeseries"][0])
+    engine = getengine(fc)
+    df = df.copy()
+    if "timestepkey" not in df.columns:
+        if "timestep" not in df.columns:
+            df["timestep"] = timestep
+        session, engine = establishconnection(fc)
+        tskeys = {
+            t: stimestep(session, t, schema=table.schema)
+            for t in df["timestep"].unique()
+        }
+        session.close()
+        df["timestepkey"] = df["timestep"].map(tskeys)
+    df["filesourcekey"] = df["filesourcekey"].map(
+        lambda fk: fk[0] if isinstance(fk, tuple) else fk
+    )
+    df = df.dropna(subset=natural)
+    combis = set(
+        tuple(int(v) for v in c) for c in df[natural].itertuples(index=False, name=None)
+    )
+
+    cache = keycache(engine, model)
+    new = [c for c in combis if c not in cache]
+    if len(new) > 0:
+        keys = reserve_series_keys(fc, len(new), model)
+        now = datetime.datetime.now()
+        src = values(
+            column("timeserieskey", Integer),
+            *[column(c, Integer) for c in natural],
+            name="newseries",
+        ).data([(k,) + c for k, c in zip(keys, new)])
+        stmt = insert(table).from_select(
+            ["timeserieskey"] + natural + ["valuetype", "modificationtime"],
+            select(
+                src.c.timeserieskey,
+                *[src.c[c] for c in natural],
+                literal(0, Integer),
+                literal(now, DateTime),
+            ).where(~exists().where(*[table.c[c] == src.c[c] for c in natural])),
+        )
+        try:
+            with engine.begin() as conn:
+                lockseries(conn, model)
+                conn.execute(stmt)
+                stmt = select(*[table.c[c] for c in natural], table.c.timeserieskey)
+                stmt = stmt.where(table.c.locationkey.in_(list({c[0] for c in new})))
+                for r in conn.execute(stmt):
+                    cache[tuple(r[:4])] = r[4]
+        except Exception as e:
+            print("exception raised while registering timeseries", e)
+    return {c: cache[c] for c in combis if c in cache}
+
+
 def read_config(configfile):
     """
     Reads config file with connection strings to M2Web api
@@ -527,7 +1238,10 @@ def read_config(configfile):
         return cf
 
 
-def settransaction(timeserieskey, periodstart, periodend, transactionid, session):
+@_timed
+def settransaction(
+    timeserieskey, periodstart, periodend, transactionid, session, schema=None
+):
     """
     Used to record the period and transactionid
 
@@ -543,13 +1257,15 @@ def settransaction(timeserieskey, periodstart, periodend, transactionid, session
         the transactionid
     session : SqlAlchemy session object
         the current session
+    schema : string, optional
+        schema to work in (see ormmodels), default timeseries
     Returns
     -------
     None.
 
     """
     transactiontime = datetime.datetime.now()
-    stmt = Transaction(
+    stmt = ormmodels(schema).Transaction(
         timeserieskey=timeserieskey,
         periodstart=periodstart,
         periodend=periodend,
@@ -560,41 +1276,473 @@ def settransaction(timeserieskey, periodstart, periodend, transactionid, session
     session.commit()
 
 
+def schematable(model, name):
+    """Returns the table name (e.g. timeseriesvaluesandflags) that is declared
+    in the same schema as the ORM class model"""
+    table = model.__table__
+    return table.metadata.tables[f"{table.schema}.{name}" if table.schema else name]
+
+
+@_timed
+def settransactions(fc, df, transactionid=0, model=Transaction, schema=None):
+    """
+    Bulk version of settransaction, records the period of a load for every
+    timeserieskey in df in one statement.
+
+    Parameters
+    ----------
+    fc : string
+        Link to credentials file for access to database.
+    df : pandas DataFrame
+        columns timeserieskey, periodstart and periodend, or timeserieskey and
+        datetime (the loaded values, the period is derived per timeserieskey)
+    transactionid : integer, optional
+        the transactionid, default 0
+    model : ORM class, optional
+        Transaction class of the target schema
+    schema : string, optional
+        schema to work in (see ormmodels), replaces the schema of model
+
+    Returns
+    -------
+    number of recorded transactions, None in case of an exception
+
+    """
+    model = _model(model, schema)
+    table = model.__table__
+    if "periodstart" not in df.columns:
+        df = df.groupby("timeserieskey")["datetime"].agg(["min", "max"])
+        df = df.reset_index().rename(columns={"min": "periodstart", "max": "periodend"})
+    df = df.dropna(subset=["timeserieskey", "periodstart", "periodend"])
+    if len(df) == 0:
+        return 0
+    now = datetime.datetime.now()
+    records = [
+        {
+            "timeserieskey": int(r.timeserieskey),
+            "periodstart": pd.Timestamp(r.periodstart).to_pydatetime(),
+            "periodend": pd.Timestamp(r.periodend).to_pydatetime(),
+            "transactiontime": now,
+            "transactionid": transactionid,
+        }
+        for r in df.itertuples(index=False)
+    ]
+    engine = getengine(fc)
+    try:
+        with engine.begin() as conn:
+            table.c.transactionkey.default.create(conn, checkfirst=True)
+            conn.execute(insert(table), records)
+        return len(records)
+    except Exception as e:
+        print("exception raised while recording transactions", e)
+        return None
+
+
+# summary tables that are verified (created and seeded) in this process
+_seededstats = set()
+
+# archive state tables that are verified (created) in this process
+_archivestates = set()
+
+
+def _statssql(engine, model, where):
+    """returns the statement that inserts the summary of the stored values of
+    the series of the schema of model that satisfy where (alias s is the
+    timeseries table)"""
+    prep = engine.dialect.identifier_preparer
+    stats = prep.format_table(model.__table__)
+    series = prep.format_table(schematable(model, "timeseries"))
+    vals = prep.format_table(schematable(model, "timeseriesvaluesandflags"))
+    return f"""insert into {stats} (timeserieskey, firstdatetime, lastdatetime,
+            nrecords, minvalue, maxvalue, modificationtime)
+        select s.timeserieskey, p.firstdatetime, p.lastdatetime, p.nrecords,
+            p.minvalue, p.maxvalue, localtimestamp
+        from {series} s cross join lateral (
+            select min(datetime) as firstdatetime, max(datetime) as lastdatetime,
+                count(*) as nrecords, min(scalarvalue) as minvalue,
+                max(scalarvalue) as maxvalue
+            from {vals} v where v.timeserieskey = s.timeserieskey) p
+        where p.nrecords > 0 and {where}
+        on conflict (timeserieskey) do nothing"""
+
+
+def statstable(engine, model=TimeSeriesStats):
+    """Returns the summary table (first/last datetime, number of records,
+    minimum and maximum value per timeserieskey) of the schema of model. On
+    first use in the process the table is created if missing and seeded for
+    the series that have values but no summary yet. After that the summary
+    is maintained by the bulk writers (see ts_bulk).
+
+    Args:
+        engine (sqlalchemy engine): engine (shared, see getengine)
+        model (ORM class, optional): TimeSeriesStats class of the target schema
+
+    Returns:
+        sqlalchemy Table
+    """
+    table = model.__table__
+    ckey = (engine, table.fullname)
+    if ckey not in _seededstats:
+        stats = engine.dialect.identifier_preparer.format_table(table)
+        where = f"""not exists (select 1 from {stats} x
+            where x.timeserieskey = s.timeserieskey)"""
+        with engine.begin() as conn:
+            table.create(conn, checkfirst=True)
+            conn.execute(text(_statssql(engine, model, where)))
+        _seededstats.add(ckey)
+    return table
+
+
+def archivestatetable(engine, model=ArchiveState):
+    """Returns the table with the archive cutoff per timeserieskey of the
+    schema of model (see ts_archive), values before the cutoff are in the
+    archive and are not written to the values table again (see ts_bulk). On
+    first use in the process the table is created if missing.
+
+    Args:
+        engine (sqlalchemy engine): engine (shared, see getengine)
+        model (ORM class, optional): ArchiveState class of the target schema
+
+    Returns:
+        sqlalchemy Table
+    """
+    table = model.__table__
+    ckey = (engine, table.fullname)
+    if ckey not in _archivestates:
+        with engine.begin() as conn:
+            table.create(conn, checkfirst=True)
+        _archivestates.add(ckey)
+    return table
+
+
+@_timed
+def refreshstats(fc, timeserieskeys=None, model=TimeSeriesStats, schema=None):
+    """
+    Recomputes the summary of the given series (default all series) from the
+    values table. Needed after values are deleted or replaced by other values
+    (the bulk writers only widen the range of values).
+
+    Parameters
+    ----------
+    fc : string
+        Link to credentials file for access to database.
+    timeserieskeys : list of integers, optional
+        series to recompute, default all series
+    model : ORM class, optional
+        TimeSeriesStats class of the target schema
+    schema : string, optional
+        schema to work in (see ormmodels), replaces the schema of model
+
+    Returns
+    -------
+    number of series with a summary after the refresh, None in case of an
+    exception
+
+    """
+    model = _model(model, schema)
+    table = model.__table__
+    engine = getengine(fc)
+    stats = engine.dialect.identifier_preparer.format_table(table)
+    if timeserieskeys is None:
+        where, params = "true", {}
+    else:
+        where = "s.timeserieskey = any(:keys)"
+        params = {"keys": [int(k) for k in timeserieskeys]}
+    try:
+        with engine.begin() as conn:
+            table.create(conn, checkfirst=True)
+            conn.execute(
+                text(f"delete from {stats} s where {where}"),
+                params,
+            )
+            n = conn.execute(text(_statssql(engine, model, where)), params).rowcount
+        _seededstats.add((engine, table.fullname))
+        _watermarks.pop((engine, table.fullname), None)
+        return n
+    except Exception as e:
+        print("exception raised while refreshing", table.fullname, e)
+        return None
+
+
+@_timed
+def timeseriesstats(fc, timeserieskeys=None, model=TimeSeriesStats, schema=None):
+    """
+    Returns the summary of the given series (default all series) with one
+    lookup in the summary table instead of aggregating the values table.
+
+    Parameters
+    ----------
+    fc : string
+        Link to credentials file for access to database.
+    timeserieskeys : list of integers, optional
+        series to return, default all series
+    model : ORM class, optional
+        TimeSeriesStats class of the target schema
+    schema : string, optional
+        schema to work in (see ormmodels), replaces the schema of model
+
+    Returns
+    -------
+    pandas DataFrame indexed by timeserieskey with columns firstdatetime,
+    lastdatetime, nrecords, minvalue, maxvalue and modificationtime, series
+    without values are missing
+
+    """
+    model = _model(model, schema)
+    engine = getengine(fc)
+    table = statstable(engine, model)
+    stmt = select(table)
+    if timeserieskeys is not None:
+        stmt = stmt.where(table.c.timeserieskey.in_([int(k) for k in timeserieskeys]))
+    with engine.connect() as conn:
+        df = pd.DataFrame(conn.execute(stmt).fetchall(), columns=table.c.keys())
+    return df.set_index("timeserieskey")
+
+
+# watermark (datetime of the last stored value) per timeserieskey, keyed like
+# the key registry on (engine, full name of the summary table)
+_watermarks = {}
+
+
+@_timed
+def seedwatermarks(fc, model=Transaction, schema=None):
+    """Records a transaction (transactionid 0) for every series that has values
+    but no transaction yet, the period is taken from the values table. Only
+    series without a transaction are looked up (via the primary key index).
+    Returns the number of seeded series."""
+    model = _model(model, schema)
+    table = model.__table__
+    series = schematable(model, "timeseries")
+    vals = schematable(model, "timeseriesvaluesandflags")
+    period = (
+        select(
+            func.min(vals.c.datetime).label("periodstart"),
+            func.max(vals.c.datetime).label("periodend"),
+        )
+        .where(vals.c.timeserieskey == series.c.timeserieskey)
+        .lateral("period")
+    )
+    stmt = insert(table).from_select(
+        [
+            "timeserieskey",
+            "transactiontime",
+            "periodstart",
+            "periodend",
+            "transactionid",
+        ],
+        select(
+            series.c.timeserieskey,
+            literal(datetime.datetime.now(), DateTime),
+            period.c.periodstart,
+            period.c.periodend,
+            literal(0, Integer),
+        )
+        .select_from(series.join(period, true()))
+        .where(
+            period.c.periodend.isnot(None),
+            ~exists().where(table.c.timeserieskey == series.c.timeserieskey),
+        ),
+    )
+    engine = getengine(fc)
+    with engine.begin() as conn:
+        table.c.transactionkey.default.create(conn, checkfirst=True)
+        n = conn.execute(stmt).rowcount
+    return n
+
+
+@_timed
+def watermarks(fc, model=TimeSeriesStats, seed=True, schema=None):
+    """
+    Returns the watermark of every series in the schema of model in one query,
+    i.e. the datetime of the last stored value, read from the summary table
+    (see statstable). Incremental loads can start from the watermark without
+    scanning the values or transaction table.
+
+    Parameters
+    ----------
+    fc : string
+        Link to credentials file for access to database.
+    model : ORM class, optional
+        TimeSeriesStats class of the target schema
+    seed : boolean, optional
+        first make sure the summary table exists and is seeded for the series
+        that have values but no summary yet, default True
+    schema : string, optional
+        schema to work in (see ormmodels), replaces the schema of model
+
+    Returns
+    -------
+    dictionary with timeserieskey --> lastdatetime (pandas Timestamp)
+
+    """
+    model = _model(model, schema)
+    table = model.__table__
+    engine = getengine(fc)
+    if seed:
+        statstable(engine, model)
+    stmt = select(table.c.timeserieskey, table.c.lastdatetime).where(
+        table.c.lastdatetime.isnot(None)
+    )
+    with engine.connect() as conn:
+        wm = {r[0]: pd.Timestamp(r[1]) for r in conn.execute(stmt)}
+    _watermarks[(engine, table.fullname)] = wm
+    return wm
+
+
+@_timed
+def watermark(fc, timeserieskey, model=TimeSeriesStats, schema=None):
+    """Returns the watermark (pandas Timestamp) of one timeserieskey or None if
+    nothing is loaded yet. The watermarks of the schema are read once (see
+    watermarks) and reflect the state at that moment."""
+    model = _model(model, schema)
+    wm = _watermarks.get((getengine(fc), model.__table__.fullname))
+    if wm is None:
+        wm = watermarks(fc, model)
+    return wm.get(timeserieskey)
+
+
+def _timezone(tz):
+    """returns the timezone for tz, "local" is the timezone of this machine
+    (including daylight saving time), other strings are IANA names e.g. UTC or
+    Europe/Amsterdam"""
+    if tz == "local":
+        return dateutil.tz.tzlocal()
+    return tz
+
+
+def _asdatetimes(dt, like):
+    """returns the DatetimeIndex dt as the type of like (Series with the same
+    index or numpy datetime64 array)"""
+    if isinstance(like, pd.Series):
+        return pd.Series(dt, index=like.index, name=like.name)
+    return dt.to_numpy()
+
+
+def epochtodatetime(lt, unit="ms", tz="UTC"):
+    """
+    Converts an array of epoch times (time since 1970-01-01 UTC) in one call.
+
+    Parameters
+    ----------
+    lt : numpy array, pandas Series or list
+        epoch times, missing values give NaT
+    unit : string, optional
+        unit of the epoch times, ms (default) or s
+    tz : string, optional
+        timezone of the result, UTC (default), local (timezone of this machine)
+        or an IANA name like Europe/Amsterdam
+
+    Returns
+    -------
+    datetime64 values (without timezone) in timezone tz, as pandas Series when
+    lt is a Series, otherwise as numpy array
+
+    """
+    dt = pd.to_datetime(pd.Series(lt).to_numpy(), unit=unit, utc=True)
+    dt = dt.tz_convert(_timezone(tz)).tz_localize(None)
+    return _asdatetimes(dt, lt)
+
+
+def isotodatetime(strdates, tz="UTC"):
+    """
+    Converts an array of ISO 8601 strings (e.g. 2024-01-01T12:00:00Z) in one call.
+
+    Parameters
+    ----------
+    strdates : numpy array, pandas Series or list
+        ISO 8601 strings, strings with an offset (Z, +01:00) are converted to tz,
+        strings without an offset are taken to be in tz already
+    tz : string, optional
+        timezone of the result, UTC (default), local (timezone of this machine)
+        or an IANA name like Europe/Amsterdam
+
+    Returns
+    -------
+    datetime64 values (without timezone) in timezone tz, as pandas Series when
+    strdates is a Series, otherwise as numpy array
+
+    """
+    s = pd.Series(strdates).astype("string")
+    offset = s.str.contains(r"(?:Z|[+-]\d{2}:?\d{2})$", regex=True)
+    offset = offset.fillna(False).to_numpy(dtype=bool)
+    dt = pd.Series(pd.NaT, index=s.index, dtype="datetime64[ns]")
+    if offset.any():
+        aware = pd.to_datetime(s[offset], format="ISO8601", utc=True)
+        dt[offset] = aware.dt.tz_convert(_timezone(tz)).dt.tz_localize(None)
+    if (~offset).any():
+        dt[~offset] = pd.to_datetime(s[~offset], format="ISO8601")
+    return _asdatetimes(pd.DatetimeIndex(dt), strdates)
+
+
+def datetimetoepoch(dates, unit="ms", tz="UTC"):
+    """
+    Converts an array of datetimes or ISO 8601 strings to epoch times in one call.
+
+    Parameters
+    ----------
+    dates : numpy array, pandas Series or list
+        datetimes or ISO 8601 strings, values without timezone are taken to be
+        in timezone tz
+    unit : string, optional
+        unit of the epoch times, ms (default) or s
+    tz : string, optional
+        timezone of values without timezone, UTC (default), local (timezone of
+        this machine) or an IANA name like Europe/Amsterdam
+
+    Returns
+    -------
+    epoch times as int64 (missing values give -1), as pandas Series when dates
+    is a Series, otherwise as numpy array
+
+    """
+    s = pd.Series(dates)
+    if s.dtype == object or pd.api.types.is_string_dtype(s):
+        s = pd.Series(isotodatetime(s, tz), index=s.index)
+    dt = pd.DatetimeIndex(s)
+    if dt.tz is None:
+        dt = dt.tz_localize(_timezone(tz), ambiguous="NaT", nonexistent="NaT")
+    lt = dt.as_unit(unit).asi8
+    lt = np.where(dt.isna(), -1, lt)
+    if isinstance(dates, pd.Series):
+        return pd.Series(lt, index=dates.index, name=dates.name)
+    return lt
+
+
 def convertlttodate(lt, ddapi=False):
     """
     Parameters
     ----------
     lt : integer
-        integer representation of time.
+        integer representation of time (epoch milliseconds), for arrays use
+        epochtodatetime.
 
     Returns
     -------
-    adate : datetime object
-        return gregorian date.
+    adate : string
+        return gregorian date (UTC).
 
     """
+    adate = pd.Timestamp(epochtodatetime([lt])[0])
     if ddapi:
-        adate = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(lt / 1000.0))
-    else:
-        adate = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(lt / 1000.0))
-    return adate
+        return adate.strftime("%Y-%m-%dT%H:%M:%SZ")
+    return adate.strftime("%Y-%m-%d %H:%M:%S")
 
 
 def dateto_integer(dt_time, ddapi=False):
     """
     Parameters
     ----------
-    dt_time : datetime
-        date time object.
+    dt_time : string
+        date time string, for arrays use datetimetoepoch.
     ddapi : boolean
-        ddapi = True means that DD-API is called, DD-API demands dateformat with T and Z
+        ddapi = True means that DD-API is called, DD-API demands dateformat with T
+        and Z (UTC), otherwise the string is taken to be in local time
     Returns
     -------
     TYPE: integer
-        returns integer representation of time.
+        returns integer representation of time (epoch milliseconds).
 
     """
     if ddapi:
-        return time.mktime(time.strptime(dt_time, "%Y-%m-%dT%H:%M:%SZ")) * 1000
-    else:
-        return time.mktime(time.strptime(dt_time, "%Y-%m-%d %H:%M:%S")) * 1000
+        return int(datetimetoepoch([dt_time], tz="UTC")[0])
+    return int(datetimetoepoch([dt_time], tz="local")[0])
@@ -55,80 +55,34 @@ from orm_timeseries.orm_timeseries_nobv import (
     Flags,
     Transaction,
     TimeSeriesValuesAndFlags,
+    TimeSeriesStats,
+    BoundingBox,
+    GroupName,
 )
 
+# the helpers live in the base module and take the schema they work in as
+# argument, this module binds them to the schema of the ORM classes above.
+# Engines and the key registry are shared with every other source.
+from ts_helpers import ts_helpers as _ts
+from ts_helpers.ts_helpers import establishconnection, getengine, disposeengines
+from ts_helpers.ts_helpers import keycache, clearkeycache, setgeometry
+from ts_helpers.ts_helpers import lockseries, read_config
+from ts_helpers.ts_helpers import epochtodatetime, isotodatetime, datetimetoepoch
+from ts_helpers.ts_helpers import convertlttodate, dateto_integer
 
-def establishconnection(fc):
-    """
-    Set up a orm session to the target database with the connectionstring
-    in the file that is passed
-
-    Parameters
-    ----------
-    fc : string
-        DESCRIPTION.
-        Location of the file with a connectionstring to a PostgreSQL/PostGIS
-        database
-
-    Returns
-    -------
-    session : ormsession
-        DESCRIPTION.
-        returns orm session
+schema = FileSource.__table__.schema
 
-    """
-    f = open(fc)
-    engine = create_engine(f.read(), echo=False)
-    f.close()
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    session.rollback()
-    return session, engine
 
+def warmkeycache(fc):
+    """Fills the key registry for the dimension tables of this schema, one
+    select per table"""
+    _ts.warmkeycache(fc, schema=schema)
 
-def loadfilesource(source, fc, remark="", lasttransactionid=None):
-    """
-    Checks whether a source is already recorded in the database. If not recorded,
-    then creates a new entry. In any case the filesourcekey is returned.
-
-    Parameters
-    ----------
-    source : string
-        string with source (can be filesource or link to online api)
-    deviceid : integer
-        unique identifier provided by the manufacturer, specifically introduced for trailer ids
-    remark : string
-        any arbitrary remark
-    fc : string
-        link to file with connection string to database
-
-    Returns
-    -------
-    filesourcekey of the record entered or found
 
-    """
-
-    # setup connection to database
-    session, engine = establishconnection(fc)
-
-    f = session.query(FileSource).filter_by(filesource=source).first()
-    try:
-        if str(f) == "None":
-            f = FileSource(
-                filesource=source, remark=remark, lasttransactionid=lasttransactionid
-            )
-            session.add(f)
-            session.commit()
-        fkey = (f.filesourcekey,)
-        ftid = f.lasttransactionid
-    except:
-        fkey = None
-        ftid = None
-        print("exception raised while retrieving/assigning filesource")
-    finally:
-        session.close()
-        engine.dispose()
-        return fkey, ftid
+def loadfilesource(source, fc, remark="", lasttransactionid=None):
+    """Returns the filesourcekey of source in this schema, see
+    ts_helpers.loadfilesource"""
+    return _ts.loadfilesource(source, fc, remark, lasttransactionid, schema=schema)
 
 
 def location(
@@ -147,157 +101,40 @@ def location(
     tubebot=None,
     tubetop=None,
 ):
-    """
-    Parameters
-    ----------
-    fc : String
-
-        Link to credentials file for access to database.
-    fskey : integer
-        Foreignkey value that is the link to the filesource or online source of the information.
-    name : string
-        Name for the location.
-    shortname : string
-        Alternative name for the location.
-    description : string
-        Description of the location.
-    filterid: integer
-        unique number of the filter
-    x : float
-        x or long coordinate.
-    y : float
-        y or lat coordinate.
-    z : float
-        eleveation of the installation with respect to reference (i.e. m-MSL or m-NAP).
-    epsg : integer
-        integer value corresponding to global coordinate reference sytems (i.e. NL = RDNAP = 28992, WGS84=4326)
-    altitude_msl : float
-        eleveation area of the installation with respect to reference (i.e. m-MSL or m-NAP).
-
-    Returns
-    -------
-    Id of the location
+    """Returns the locationkey of name in this schema, see ts_helpers.location"""
+    return _ts.location(
+        fc,
+        fskey,
+        name,
+        x,
+        y,
+        epsg,
+        shortname=shortname,
+        description=description,
+        z=z,
+        altitude_msl=altitude_msl,
+        diverid=diverid,
+        tubebot=tubebot,
+        tubetop=tubetop,
+        filterid=filterid,
+        schema=schema,
+    )
 
-    """
-    # setup connection to database
-    if fskey == None:
-        print("please give filesourcekey, this is required")
-        return
-    if x == None or y == None or epsg == None:
-        print(
-            "please provide coordinates and a proper crs epsg code, these are required"
-        )
-        return
-    else:
-        print(x, y, epsg)
-    session, engine = establishconnection(fc)
-    f = session.query(Location).filter_by(name=name).first()
-    try:
-        if str(f) == "None":
-            f = Location(
-                filesourcekey=fskey,
-                name=name,
-                shortname=shortname,
-                description=description,
-                tubebot=tubebot,
-                tubetop=tubetop,
-                filterid=filterid,
-                x=x,
-                y=y,
-                z=z,
-                epsgcode=epsg,
-                diverid=diverid,
-                altitude_msl=altitude_msl,
-            )
-
-            session.add(f)
-            session.commit()
-            if epsg == 28992:
-                strsql = "update nobv_timeseries.location set geom = st_setsrid(st_point(x,y),epsgcode) where geom is null"
-            else:
-                strsql = "update nobv_timeseries.location set geom = st_transform(st_setsrid(st_point(x,y),epsgcode),28992) where geom is null"
-            engine.execute(strsql)
-        else:
-            print("name already stored in location table", name, f.locationkey)
-        lkey = f.locationkey
-    except:
-        lkey = None
-        print("exception raised while retrieving/assigning location")
-    finally:
-        session.close()
-        engine.dispose()
-        return lkey
 
+def location_many(fc, df, fskey=None):
+    """Registers a batch of locations in this schema in one statement, see
+    ts_helpers.location_many. Returns name --> locationkey"""
+    return _ts.location_many(fc, df, fskey, schema=schema)
 
-def sunit(fc, unit, descr):
-    """
-    Parameters
-    ----------
-    fc : string
-        Link to credentials file for access to database..
-    unit : string
-        short unit description (mg/l).
-    descr : string
-        long unit description (milligram per liter in surface water).
-
-    Returns
-    -------
-    unitkey: integer
 
-    """
-    session, engine = establishconnection(fc)
-    f = session.query(Unit).filter_by(unit=unit).first()
-    try:
-        if str(f) == "None":
-            f = Unit(unit=unit, unitdescription=descr)
-            session.add(f)
-            session.commit()
-            unitkey = f.unitkey
-        else:
-            print("unit already stored in parameter table", unit, f.unitkey)
-            unitkey = f.unitkey
-    except:
-        print("exception raised while retrieving/assigning unit")
-        unitkey = None
-    finally:
-        session.close()
-        engine.dispose()
-        return unitkey
+def sunit(fc, unit, descr):
+    """Returns the unitkey of unit in this schema, see ts_helpers.sunit"""
+    return _ts.sunit(fc, unit, descr, schema=schema)
 
 
 def sflag(fc, flag, descr=""):
-    """
-    Parameters
-    ----------
-    fc : string
-        Link to credentials file for access to database..
-    flag : string
-        indicator for quality of the measurment.
-    descr : string
-        long unit description (milligram per liter in surface water).
-
-    Returns
-    -------
-    flagkey: integer
-
-    """
-    session, engine = establishconnection(fc)
-    f = session.query(Flags).filter_by(id=flag).first()
-    try:
-        if str(f) == "None":
-            f = Flags(id=flag, name=descr)
-            session.add(f)
-            session.commit()
-        else:
-            print("flag already stored in parameter table", flag, f.flagkey)
-        flagkey = f.flagkey
-    except:
-        print("exception raised while retrieving/assigning flag")
-        flagkey = None
-    finally:
-        session.close()
-        engine.dispose()
-        return flagkey
+    """Returns the flagkey of flag in this schema, see ts_helpers.sflag"""
+    return _ts.sflag(fc, flag, descr, schema=schema)
 
 
 def sparameter(
@@ -312,283 +149,110 @@ def sparameter(
     compartment=None,
     wns=None,
 ):
-    """
-    Parameters
-    ----------
-    fc : sting
-        Link to credentials file for access to database.
-    parameter : string
-        Short notation of the parameter (P for Phosphate for instance).
-    name : string
-        Long name for parameter (Phosphate for instance).
-    unit : list of string (unit, unitname)
-        Integer derived from unit table.
-    description : string
-        Addistional description for the parameter.
-    shortname : string, optional
-        An alternative short description, similar to aquo code! check https://www.aquo.nl/index.php/Id-471174de-c041-2d35-103a-1e0f6f55bd87 . The default is None.
-    valueresolution : float, optional
-        ?. The default is None.
-    compartment : String, optional
-        Compartment describes the compartment of the measurement
-    waarnemingssoort : String, optional
-        Waarnemingssoort is de aquo codering voor de combinatie van typering, grootheid, parameter, hoedanigheid, eenheid en compartiment (bijna)
-    Returns
-    -------
-    parameterkey: integer
-
-    """
-    session, engine = establishconnection(fc)
-
-    # check or set unit
-    unitkey = sunit(fc, unit[0], unit[1])
-    f = (
-        session.query(Parameter)
-        .filter_by(
-            id=parameter, unitkey=unitkey, compartment=compartment, waarnemingssoort=wns
-        )
-        .first()
+    """Returns the parameterkey of parameter in this schema, see
+    ts_helpers.sparameter"""
+    return _ts.sparameter(
+        fc,
+        parameter,
+        name,
+        unit,
+        description,
+        parametergroup=parametergroup,
+        shortname=shortname,
+        valueresolution=valueresolution,
+        compartment=compartment,
+        wns=wns,
+        schema=schema,
     )
-    try:
-        if str(f) == "None":
-            f = Parameter(
-                id=parameter,
-                shortname=shortname,
-                description=description,
-                name=name,
-                unitkey=unitkey,
-                valueresolution=valueresolution,
-                compartment=compartment,
-                waarnemingssoort=wns,
-            )
-            session.add(f)
-            session.commit()
-            parameterkey = f.parameterkey
-        else:
-            parameterkey = f.parameterkey
-            print(
-                "parameter already stored in parameter table",
-                name,
-                f.parameterkey,
-                f.unitkey,
-                f.compartment,
-            )
-    except:
-        print("exception raised while retrieving/assigning parameter")
-        parameterkey = None
-    finally:
-        session.close()
-        engine.dispose()
-        return parameterkey
 
 
 def stimestep(session, timestep, label=""):
-    """
-    Parameters
-    ----------
-    session : sqlalchemy sessionmaker object
-        sqlalchemy sessionmaker object.
-    timestep : string
-        timestep identifier.
-    label: string
-        label of the timestep i.e. description
-    Returns
-    -------
-    tstkey : integer
-        timestepkey, unique identifier
-    """
-    f = session.query(TimeStep).filter_by(id=timestep).first()
-    try:
-        if str(f) == "None":
-            f = TimeStep(id=timestep, label=label)
-            session.add(f)
-            session.commit()
-        else:
-            print("timestep described in table", timestep, f.timestepkey)
-        timestepkey = f.timestepkey
-    except:
-        timestepkey = None
-        print("exception raised while retrieving/assigning timestep")
-    finally:
-        return timestepkey
+    """Returns the timestepkey of timestep in this schema, see
+    ts_helpers.stimestep"""
+    return _ts.stimestep(session, timestep, label, schema=schema)
 
 
 def sserieskey(fc, parameterkey, locationkey, filesourcekey, timestep="nonequidistant"):
-    """
+    """Returns the timeserieskey of the combination in this schema, see
+    ts_helpers.sserieskey"""
+    return _ts.sserieskey(
+        fc, parameterkey, locationkey, filesourcekey, timestep, schema=schema
+    )
 
 
-    Parameters
-    ----------
-    fc : string
-         Link to credentials file for access to database.
-    parameter : integer
-        paramterkey (the unique identifier of the paramter).
-    locationkey : integer
-        the unique location identifier
-    filesourcekey : TYPE
-        the unique filesource identifier
-    timestep : string
-        timestep id (the main name of the timestep, default is nonequidistant).
-
-    Returns
-    -------
-    TYPE
-        DESCRIPTION.
+def reserve_series_keys(fc, n, model=TimeSeries):
+    """Reserves n timeserieskeys from the sequence of this schema, see
+    ts_helpers.reserve_series_keys"""
+    return _ts.reserve_series_keys(fc, n, model)
 
-    """
-    session, engine = establishconnection(fc)
-    lk = locationkey
-    pk = parameterkey
-    tk = stimestep(session, timestep)
-    fk = filesourcekey
-    tsk = (
-        session.query(TimeSeries)
-        .filter_by(locationkey=lk, parameterkey=pk, timestepkey=tk, filesourcekey=fk)
-        .first()
+
+def sserieskey_many(fc, df, timestep="nonequidistant", model=TimeSeries):
+    """Registers a batch of timeseries in this schema, see
+    ts_helpers.sserieskey_many"""
+    return _ts.sserieskey_many(fc, df, timestep, model)
+
+
+def settransaction(timeserieskey, periodstart, periodend, transactionid, session):
+    """Records the period and transactionid of a load in this schema, see
+    ts_helpers.settransaction"""
+    _ts.settransaction(
+        timeserieskey, periodstart, periodend, transactionid, session, schema=schema
     )
-    try:
-        if tsk is None:
-            # find serieskey max value
-            i = (
-                session.query(func.max(TimeSeries.timeserieskey).label("timeserieskey"))
-                .one()
-                .timeserieskey
-            )
-            if i is None:
-                i = 1
-            else:
-                i = i + 1
-            atsk = TimeSeries(
-                timeserieskey=i,
-                locationkey=lk,
-                parameterkey=pk,
-                timestepkey=tk,
-                filesourcekey=fk,
-                modificationtime=datetime.datetime.now(),
-            )
-            session.add(atsk)
-            session.commit()
-            tsk = atsk
-        timeserieskey = tsk.timeserieskey
-    except:
-        timeserieskey = None
-        print("exception raised while retrieving/assigning timeseries")
-    finally:
-        session.close()
-        engine.dispose()
-        return timeserieskey
-
-
-def read_config(configfile):
-    """
-    Reads config file with connection strings to M2Web api
 
-    Parameters
-    ----------
-    connectionfile : TYPE
-        contains connection strings to web api
 
-        Structure of the file should be:
-            [m2web]
-            m2wdevid = (should be derive via https://developer.ewon.biz/content/ewon-programming)
-            m2wtoken = (is provided by data provider)
+def settransactions(fc, df, transactionid=0, model=Transaction):
+    """Records the period of a load per timeserieskey in this schema, see
+    ts_helpers.settransactions"""
+    return _ts.settransactions(fc, df, transactionid, model)
 
-    Returns
-    -------
-    m2wdevid as string
-    m2wtoken as string
 
-    """
-    import configparser
+def seedwatermarks(fc, model=Transaction):
+    """Seeds the transaction table of this schema from the values table, see
+    ts_helpers.seedwatermarks"""
+    return _ts.seedwatermarks(fc, model)
 
-    # Parse and load
-    if not os.path.isfile(configfile):
-        print("Please give valid path for ", configfile)
-        return None
-    else:
-        cf = configparser.ConfigParser()
-        cf.read(configfile)
-        return cf
 
+def refreshstats(fc, timeserieskeys=None, model=TimeSeriesStats):
+    """Recomputes the summary of series in this schema from the values table,
+    see ts_helpers.refreshstats"""
+    return _ts.refreshstats(fc, timeserieskeys, model)
 
-def settransaction(timeserieskey, periodstart, periodend, transactionid, session):
-    """
-    Used to record the period and transactionid
-
-    Parameters
-    ----------
-    timeserieskey : integer
-        timeserieskey
-    periodstart : DateTime
-        start date of the set of data retrieved for specific stransactionid
-    periodend : DateTime
-        start date of the set of data retrieved for specific stransactionid.
-    transactionid : Integer
-        the transactionid
-    session : SqlAlchemy session object
-        the current session
-    Returns
-    -------
-    None.
 
-    """
-    transactiontime = datetime.datetime.now()
-    stmt = Transaction(
-        timeserieskey=timeserieskey,
-        periodstart=periodstart,
-        periodend=periodend,
-        transactiontime=transactiontime,
-        transactionid=transactionid,
-    )
-    session.add(stmt)
-    session.commit()
+def timeseriesstats(fc, timeserieskeys=None, model=TimeSeriesStats):
+    """Returns the summary of series in this schema, see
+    ts_helpers.timeseriesstats"""
+    return _ts.timeseriesstats(fc, timeserieskeys, model)
 
 
-def convertdatetostring(date):
-    """converts datetime object to string
+def watermarks(fc, model=TimeSeriesStats, seed=True):
+    """Returns timeserieskey --> watermark for all series in this schema, see
+    ts_helpers.watermarks"""
+    return _ts.watermarks(fc, model, seed)
 
-    Args:
-        date (datetime object):
-    """
-    strdate = date.strftime("%y-%m-%d")
-    return strdate
 
+def watermark(fc, timeserieskey, model=TimeSeriesStats):
+    """Returns the watermark of one series in this schema, see
+    ts_helpers.watermark"""
+    return _ts.watermark(fc, timeserieskey, model)
 
-def convertlttodate(lt, ddapi=False):
-    """
-    Parameters
-    ----------
-    lt : integer
-        integer representation of time.
 
-    Returns
-    -------
-    adate : datetime object
-        return gregorian date.
+def rebuildboundingbox(fc, model=BoundingBox):
+    """Recomputes the bounding boxes of this schema from the location table,
+    see ts_helpers.rebuildboundingbox"""
+    return _ts.rebuildboundingbox(fc, model)
 
-    """
-    if ddapi:
-        adate = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(lt / 1000.0))
-    else:
-        adate = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(lt / 1000.0))
-    return adate
 
+def setgroupnames(fc, groupnames, model=GroupName):
+    """Stores the display names of groups in this schema, see
+    ts_helpers.setgroupnames"""
+    return _ts.setgroupnames(fc, groupnames, model)
 
-def dateto_integer(dt_time, ddapi=False):
-    """
-    Parameters
-    ----------
-    dt_time : datetime
-        date time object.
-    ddapi : boolean
-        ddapi = True means that DD-API is called, DD-API demands dateformat with T and Z
-    Returns
-    -------
-    TYPE: integer
-        returns integer representation of time.
 
+def convertdatetostring(date):
+    """converts datetime object to string
+
+    Args:
+        date (datetime object):
     """
-    if ddapi:
-        return time.mktime(time.strptime(dt_time, "%Y-%m-%dT%H:%M:%SZ")) * 1000
-    else:
-        return time.mktime(time.strptime(dt_time, "%Y-%m-%d %H:%M:%S")) * 1000
+    strdate = date.strftime("%y-%m-%d")
+    return strdate
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of HTTP responses for API metadata that hardly changes
+(Lizard station lists and timeseries metadata, the ArcGIS location layers of
+WSKIP). Responses are kept in a local SQLite file: within the ttl a response
+is served from the file, after the ttl it is revalidated with the ETag or
+Last-Modified of the server when available (a 304 response costs no body),
+otherwise fetched again. The file is kept below maxbytes by removing the
+least recently used responses. Hits, revalidations and misses are counted
+(see HttpCache.stats) and recorded in ts_metrics when enabled.
+
+Do not cache data that changes, e.g. events.
+"""
+
+#  Copyright notice
+#   --------------------------------------------------------------------
+#   Copyright (C) 2024 Deltares for Projects with a FEWS datamodel in
+#                 PostgreSQL/PostGIS database used in Water Information Systems
+#   Gerrit.Hendriksen@deltares.nl
+#
+#   This library is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this library.  If not, see <http://www.gnu.org/licenses/>.
+#   --------------------------------------------------------------------
+#
+# This tool is part of <a href="http://www.OpenEarth.eu">OpenEarthTools</a>.
+# OpenEarthTools is an online collaboration to share and manage data and
+# programming tools in an open source, version controlled environment.
+# Sign up to recieve regular updates of this function, and to contribute
+# your own tools.
+
+# system modules
+import json
+import time
+import sqlite3
+from urllib.parse import urlencode, urlparse
+
+# ts_httpcache is used both as package and as module
+try:
+    from ts_helpers import ts_metrics
+except ImportError:
+    import ts_metrics
+
+
+def cachekey(url, params=None):
+    """returns the key of a request, the url with the sorted parameters"""
+    if not params:
+        return url
+    query = urlencode(sorted((str(k), str(v)) for k, v in params.items()))
+    return f"{url}{'&' if '?' in url else '?'}{query}"
+
+
+class CachedResponse:
+    """response served by HttpCache.get, with the attributes of a requests
+    response that the ingesters use"""
+
+    def __init__(self, status_code, content, headers, fromcache):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.fromcache = fromcache
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class HttpCache:
+    """
+    Cache of HTTP responses in a SQLite file.
+
+    Parameters
+    ----------
+    path : string
+        SQLite file, created if missing
+    ttl : integer, optional
+        seconds a response is served without asking the server, default one
+        day
+    maxbytes : integer, optional
+        maximum size of the cached bodies, default 256 MB
+
+    """
+
+    def __init__(self, path, ttl=86400, maxbytes=256 * 2**20):
+        self.path = path
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.counts = {"hits": 0, "revalidated": 0, "misses": 0}
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""create table if not exists response (
+                key text primary key, status integer, etag text,
+                lastmodified text, body blob, size integer, stored real,
+                accessed real)""")
+        self.conn.execute(
+            "create index if not exists response_accessed on response (accessed)"
+        )
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _count(self, outcome, url):
+        self.counts[outcome] += 1
+        if ts_metrics.enabled:
+            name = f"cache {outcome} {urlparse(url).netloc}"
+            ts_metrics.record("http", name, ts_metrics.currenttag(), 0)
+
+    def lookup(self, url, params=None):
+        """
+        Returns (body, headers) for a request: body is the cached body when it
+        is still fresh (counted as hit), otherwise None and headers are the
+        conditional request headers (If-None-Match, If-Modified-Since) to send
+        to the server. Pass the answer of the server to store.
+        """
+        key = cachekey(url, params)
+        row = self.conn.execute(
+            "select etag, lastmodified, body, stored from response where key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None, {}
+        etag, lastmodified, body, stored = row
+        if time.time() - stored < self.ttl:
+            self.conn.execute(
+                "update response set accessed = ? where key = ?", (time.time(), key)
+            )
+            self.conn.commit()
+            self._count("hits", url)
+            return body, {}
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if lastmodified:
+            headers["If-Modified-Since"] = lastmodified
+        return None, headers
+
+    def store(self, url, params, status, body, headers):
+        """
+        Handles the answer of the server to a request that lookup did not
+        serve: a 304 renews the cached response (counted as revalidated), a
+        200 replaces it (counted as miss). Returns the body to use, None if
+        the answer is not cacheable (the caller uses its own body).
+        """
+        key = cachekey(url, params)
+        now = time.time()
+        if status == 304:
+            row = self.conn.execute(
+                "select body from response where key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self.conn.execute(
+                    "update response set stored = ?, accessed = ? where key = ?",
+                    (now, now, key),
+                )
+                self.conn.commit()
+                self._count("revalidated", url)
+                return row[0]
+        self._count("misses", url)
+        if status != 200:
+            return None
+        self.conn.execute(
+            """insert or replace into response (key, status, etag, lastmodified,
+                body, size, stored, accessed) values (?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                key,
+                status,
+                headers.get("ETag"),
+                headers.get("Last-Modified"),
+                body,
+                len(body),
+                now,
+                now,
+            ),
+        )
+        self._evict()
+        self.conn.commit()
+        return body
+
+    def _evict(self):
+        """removes the least recently used responses above maxbytes"""
+        total = self.conn.execute("select coalesce(sum(size), 0) from response")
+        excess = total.fetchone()[0] - self.maxbytes
+        if excess <= 0:
+            return
+        rows = self.conn.execute("select key, size from response order by accessed")
+        keys = []
+        for key, size in rows.fetchall():
+            if excess <= 0:
+                break
+            keys.append((key,))
+            excess -= size
+        self.conn.executemany("delete from response where key = ?", keys)
+
+    def get(self, url, params=None, session=None, **kwargs):
+        """
+        Cached replacement of requests.get for metadata requests.
+
+        Parameters
+        ----------
+        url : string
+            url of the request
+        params : dictionary, optional
+            query parameters
+        session : requests.Session, optional
+            session (reused connections), default requests
+        kwargs :
+            other arguments of requests.get (headers, timeout)
+
+        Returns
+        -------
+        CachedResponse with status_code, content, headers, text, json() and
+        fromcache (True when no body was transferred)
+
+        """
+        body, conditional = self.lookup(url, params)
+        if body is not None:
+            return CachedResponse(200, body, {}, True)
+        if session is None:
+            import requests as session
+        headers = {**kwargs.pop("headers", {}), **conditional}
+        response = session.get(url, params=params, headers=headers, **kwargs)
+        body = self.store(
+            url, params, response.status_code, response.content, response.headers
+        )
+        if body is None:
+            return CachedResponse(
+                response.status_code, response.content, response.headers, False
+            )
+        return CachedResponse(200, body, response.headers, response.status_code == 304)
+
+    def stats(self):
+        """returns the number of hits, revalidations (304), misses, cached
+        responses and cached bytes"""
+        n, size = self.conn.execute(
+            "select count(*), coalesce(sum(size), 0) from response"
+        ).fetchone()
+        return {**self.counts, "responses": n, "bytes": size}
+
+    def clear(self):
+        """removes all cached responses"""
+        self.conn.execute("delete from response")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,676 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous client for the Lizard v4 API of the waterboards (HDSR, HHNK,
+Delfland). Station pages, timeseries metadata and event pages are fetched
+concurrently over one pool of reused connections with a limit per host, the
+events come out of an async iterator as DataFrames that are written with the
+bulk writer (see ts_bulk.writevalues) while the next pages are fetched.
+Requires:
+Pyhton packages
+ - aiohttp
+ - nest-asyncio (only when called from a running event loop, e.g. Jupyter)
+
+Call loadlizard for a complete crawl of a source, or use LizardClient for
+separate requests.
+"""
+
+#  Copyright notice
+#   --------------------------------------------------------------------
+#   Copyright (C) 2024 Deltares for Projects with a FEWS datamodel in
+#                 PostgreSQL/PostGIS database used in Water Information Systems
+#   Gerrit.Hendriksen@deltares.nl
+#
+#   This library is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this library.  If not, see <http://www.gnu.org/licenses/>.
+#   --------------------------------------------------------------------
+#
+# This tool is part of <a href="http://www.OpenEarth.eu">OpenEarthTools</a>.
+# OpenEarthTools is an online collaboration to share and manage data and
+# programming tools in an open source, version controlled environment.
+# Sign up to recieve regular updates of this function, and to contribute
+# your own tools.
+
+# system modules
+import json
+import time
+import asyncio
+from collections import deque
+from urllib.parse import urlparse
+
+# third party modules
+import aiohttp
+import pandas as pd
+
+# ts_lizard is used both as package and as module
+try:
+    from ts_helpers import ts_metrics
+    from ts_helpers.ts_metrics import timed
+    from ts_helpers.ts_helpers import getengine, ormmodels, isotodatetime
+    from ts_helpers.ts_helpers import loadfilesource, location_many
+    from ts_helpers.ts_helpers import sparameter, sflag, sserieskey, watermarks
+    from ts_helpers.ts_bulk import writevalues
+    from ts_helpers.ts_checkpoint import CrawlCheckpoint
+    from ts_helpers.ts_httpcache import HttpCache
+except ImportError:
+    import ts_metrics
+    from ts_metrics import timed
+    from ts_helpers import getengine, ormmodels, isotodatetime
+    from ts_helpers import loadfilesource, location_many
+    from ts_helpers import sparameter, sflag, sserieskey, watermarks
+    from ts_bulk import writevalues
+    from ts_checkpoint import CrawlCheckpoint
+    from ts_httpcache import HttpCache
+
+# Lizard v4 API per source schema
+lizardurls = {
+    "hdsr_timeseries": "https://hdsr.lizard.net/api/v4/",
+    "hhnk_timeseries": "https://hhnk.lizard.net/api/v4/",
+    "delftimeseries": "https://delfland.lizard.net/api/v4/",
+}
+
+# responses that are retried
+retrystatus = (429, 500, 502, 503, 504)
+
+
+class LizardClient:
+    """
+    Async context manager with one aiohttp session for a Lizard v4 API, at
+    most perhost requests per host run at the same time and connections are
+    kept open for the next request.
+
+    Parameters
+    ----------
+    apikey : string, optional
+        Lizard API key, anonymous access if None
+    perhost : integer, optional
+        maximum number of concurrent requests per host, default 8
+    pagesize : integer, optional
+        page_size of list requests, default 1000
+    timeout : integer, optional
+        timeout of a request in seconds, default 300
+    retries : integer, optional
+        number of retries of a request after a connection error, timeout or
+        one of retrystatus, with exponential backoff, default 3
+    cache : HttpCache, optional
+        cache of the station and timeseries metadata (see ts_httpcache),
+        events are never cached. Default None, no cache
+
+    """
+
+    def __init__(
+        self, apikey=None, perhost=8, pagesize=1000, timeout=300, retries=3, cache=None
+    ):
+        self.headers = {"Content-Type": "application/json"}
+        if apikey is not None:
+            self.headers.update({"username": "__key__", "password": apikey})
+        self.perhost = perhost
+        self.pagesize = pagesize
+        self.timeout = timeout
+        self.retries = retries
+        self.cache = cache
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.perhost)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+        self.session = None
+
+    async def get(self, url, params=None, cached=False):
+        """returns the JSON response of url, raises IOError when all attempts
+        fail, with cached the cache of the client is used (see request)"""
+        return (await self.request(url, params, cached))[0]
+
+    async def request(self, url, params=None, cached=False):
+        """
+        Returns (JSON response of url, True if the response is served by the
+        cache without asking the server), raises IOError when all attempts
+        fail. With cached and a cache a fresh cached response is returned,
+        otherwise the server is asked with the ETag or Last-Modified of the
+        cached response and the response is cached.
+        """
+        cached = cached and self.cache is not None
+        conditional = {}
+        if cached:
+            body, conditional = self.cache.lookup(url, params)
+            if body is not None:
+                return json.loads(body), True
+        for attempt in range(self.retries + 1):
+            t0 = time.perf_counter()
+            try:
+                async with self.session.get(
+                    url, params=params, headers=conditional
+                ) as response:
+                    if response.status not in retrystatus:
+                        response.raise_for_status()
+                        if not cached:
+                            return await response.json(), False
+                        body = await response.read()
+                        body = self.cache.store(
+                            url, params, response.status, body, response.headers
+                        )
+                        if body is not None:
+                            return json.loads(body), False
+                        # 304 for a response that is no longer cached
+                        conditional = {}
+                        error = "304 without cached response"
+                        continue
+                    error = f"status {response.status}"
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            finally:
+                if ts_metrics.enabled:
+                    name = f"GET {urlparse(url).netloc}"
+                    seconds = time.perf_counter() - t0
+                    ts_metrics.record("http", name, ts_metrics.currenttag(), seconds)
+            if attempt < self.retries:
+                await asyncio.sleep(2**attempt)
+        raise IOError(f"request {url} failed: {error}")
+
+    async def pages(self, url, params=None, cached=False):
+        """
+        Async iterator of the results (list of records) of every page of a
+        list endpoint. Numbered pages (stations, timeseries) are fetched
+        concurrently after the first page, at most perhost pages ahead of the
+        consumer, cursor pages (events) one after another. With cached the
+        pages are taken from the cache of the client.
+        """
+        params = dict(params or {})
+        params.setdefault("page_size", self.pagesize)
+        first = await self.get(url, params, cached)
+        yield first["results"]
+        nxt = first.get("next")
+        if not nxt:
+            return
+        # an empty first page with a count (the collection changed between
+        # requests) gives no page size, next is followed instead
+        numbered = first.get("count") is not None and "cursor=" not in nxt
+        if not numbered or len(first["results"]) == 0:
+            while nxt:
+                page = await self.get(nxt, cached=cached)
+                yield page["results"]
+                nxt = page.get("next")
+            return
+        npages = -(-first["count"] // len(first["results"]))
+        del first
+        ahead, p = deque(), 2
+        try:
+            while p <= npages or ahead:
+                while p <= npages and len(ahead) < self.perhost:
+                    page = self.get(url, {**params, "page": p}, cached)
+                    ahead.append(asyncio.ensure_future(page))
+                    p += 1
+                yield (await ahead.popleft())["results"]
+        finally:
+            for task in ahead:
+                task.cancel()
+
+    async def walk(self, url, params=None, cursor=None):
+        """
+        Async iterator of (results, url of the next page) of the pages of url
+        one after another, starting at cursor (the url of a next page) when
+        given, so an interrupted walk can be resumed.
+        """
+        if cursor is None:
+            params = dict(params or {})
+            params.setdefault("page_size", self.pagesize)
+            page = await self.get(url, params)
+        else:
+            page = await self.get(cursor)
+        while True:
+            nxt = page.get("next")
+            yield page["results"], nxt
+            if not nxt:
+                return
+            page = await self.get(nxt)
+
+    async def stations(self, url, params=None):
+        """async iterator of the records of the stations endpoint url, taken
+        from the cache of the client when possible"""
+        async for results in self.pages(url, params, cached=True):
+            for station in results:
+                yield station
+
+    async def timeseries(self, urls):
+        """returns the metadata of the timeseries urls, fetched concurrently,
+        None for a timeseries that could not be fetched. Metadata served by the
+        cache of the client without asking the server has the item fromcache
+        True, its end may be outdated."""
+
+        async def fetch(url):
+            try:
+                ts, fromcache = await self.request(url, cached=True)
+                if fromcache:
+                    ts["fromcache"] = True
+                return ts
+            except Exception as e:
+                print("exception raised while fetching", url, e)
+                return None
+
+        return await asyncio.gather(*(fetch(url) for url in urls))
+
+    async def events(self, timeseries, params=None, buffer=None, stop=None):
+        """
+        Async iterator of (timeseries, DataFrame) per event page of the given
+        timeseries (metadata as returned by timeseries). Pages of different
+        timeseries are fetched concurrently, at most buffer pages (default
+        2 * perhost) wait to be consumed. Request parameters of one timeseries
+        (e.g. time__gt) can be given in its item params, they are added to
+        params, a walk resumes at the page in its item cursor (see walk).
+
+        The DataFrames have the columns datetime (UTC without timezone),
+        scalarvalue and flag, the url of the next page is stored in
+        df.attrs["next"] (None for the last page of a timeseries, which is
+        also yielded when empty). A timeseries whose walk fails yields
+        (timeseries, None) after the pages fetched so far. The walk of a
+        timeseries whose url the consumer adds to the set stop ends after the
+        page that is being fetched.
+        """
+        stop = set() if stop is None else stop
+        buffer = buffer or 2 * self.perhost
+        queue = asyncio.Queue(maxsize=buffer)
+        done = object()
+        slots = asyncio.Semaphore(self.perhost)
+
+        async def fetch(ts):
+            url = ts["url"].rstrip("/") + "/events/"
+            tsparams = {**(params or {}), **ts.get("params", {})}
+            async with slots:
+                try:
+                    cursor = ts.get("cursor")
+                    async for results, nxt in self.walk(url, tsparams, cursor):
+                        if ts["url"] in stop:
+                            return
+                        if len(results) > 0 or nxt is None:
+                            df = eventframe(results)
+                            df.attrs["next"] = nxt
+                            await queue.put((ts, df))
+                except Exception as e:
+                    print("exception raised while fetching", url, e)
+                    await queue.put((ts, None))
+
+        async def produce():
+            try:
+                await asyncio.gather(*(fetch(ts) for ts in timeseries))
+            finally:
+                await queue.put(done)
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                yield item
+        finally:
+            producer.cancel()
+
+
+def eventframe(results):
+    """returns the events (records of an events page) as DataFrame with the
+    columns datetime, scalarvalue and flag"""
+    df = pd.DataFrame.from_records(results, columns=["time", "value", "flag"])
+    return pd.DataFrame(
+        {
+            "datetime": isotodatetime(df["time"]).to_numpy(),
+            "scalarvalue": pd.to_numeric(df["value"]).to_numpy(),
+            "flag": pd.to_numeric(df["flag"]).to_numpy(),
+        }
+    )
+
+
+def lizardlocations(station):
+    """returns [(location record, timeseries urls)] of a station record: one
+    location per filter of a groundwaterstation (named after the filter code),
+    the station itself for other stations"""
+    x, y = station["geometry"]["coordinates"][:2]
+    record = {
+        "x": x,
+        "y": y,
+        "epsgcode": 4326,
+        "description": station.get("station_type"),
+    }
+    if "filters" not in station:
+        return [(dict(record, name=station["name"]), station.get("timeseries") or [])]
+    locations = []
+    for f in station["filters"] or []:
+        loc = dict(
+            record,
+            name=f["code"],
+            altitude_msl=f.get("top_level"),
+            tubetop=f.get("filter_top_level"),
+            tubebot=f.get("filter_bottom_level"),
+        )
+        locations.append((loc, f.get("timeseries") or []))
+    return locations
+
+
+def lizardwatermark(timestamp):
+    """returns the ISO 8601 string (UTC) of a stored datetime for time__gt"""
+    return pd.Timestamp(timestamp).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _stationlocations(fc, schema, orm, stations, skiptypes, result):
+    """
+    Registers the filesources and locations of one page of stations (blocking,
+    run in a thread by _loadlizard), returns
+    (timeseries url --> (location name, filesource key, station url), location
+    name --> locationkey, station url --> set of timeseries urls that are not
+    completed).
+    """
+    records, urls, pending = [], {}, {}
+    for station in stations:
+        if station.get("station_type") in skiptypes:
+            continue
+        result["stations"] += 1
+        fskey = loadfilesource(station["url"], fc, schema=schema)[0]
+        if fskey is None:
+            continue
+        pending[station["url"]] = set()
+        for loc, tsurls in lizardlocations(station):
+            loc["filesourcekey"] = fskey[0]
+            records.append(loc)
+            for url in tsurls:
+                urls[url] = (loc["name"], fskey, station["url"])
+                pending[station["url"]].add(url)
+    lkeys = {}
+    if len(records) > 0:
+        lkeys = location_many(fc, pd.DataFrame(records), model=orm.Location)
+    result["locations"] += len(lkeys)
+    return urls, lkeys, pending
+
+
+def _serieskeys(fc, schema, series):
+    """returns timeseries url --> timeserieskey (None if it could not be
+    registered) for a list of (url, timeseries metadata, locationkey,
+    filesource key), blocking, run in a thread by _loadlizard"""
+    skeys = {}
+    for url, ts, lkey, fskey in series:
+        obs = ts["observation_type"]
+        pkey = sparameter(
+            fc,
+            obs["unit"],
+            obs["parameter"],
+            [obs["unit"], obs["reference_frame"]],
+            obs["description"],
+            schema=schema,
+        )
+        skeys[url] = sserieskey(
+            fc, pkey, lkey, fskey, timestep="nonequidistant", schema=schema
+        )
+    return skeys
+
+
+def _writeevents(fc, schema, engine, orm, df, skey):
+    """registers the flags of a page of events and writes it to the values
+    table, blocking, run in a thread by _loadlizard, see writevalues"""
+    flags = {
+        f: sflag(fc, str(int(f)), "FEWS-flag", schema=schema)
+        for f in df["flag"].unique()
+    }
+    df = df.assign(timeserieskey=skey, flags=df["flag"].map(flags))
+    return writevalues(engine, df, orm.TimeSeriesValuesAndFlags)
+
+
+async def _loadlizard(
+    fc,
+    schema,
+    apikey,
+    endpoint,
+    start,
+    maxflag,
+    perhost,
+    skiptypes,
+    incremental,
+    cp,
+    hc,
+):
+    """crawls the endpoint of the Lizard API of schema, see loadlizard"""
+    orm = ormmodels(schema)
+    engine = getengine(fc)
+    result = {
+        "stations": 0,
+        "resumed": 0,
+        "locations": 0,
+        "series": 0,
+        "skipped": 0,
+        "failed": 0,
+        "rows": 0,
+    }
+    # with incremental a series is only requested when Lizard has events
+    # after the stored watermark, and only those events
+    wm = watermarks(fc, model=orm.TimeSeriesStats) if incremental else {}
+    params = {"value__isnull": "false", "time__gte": start}
+    # False when a station is not completed, the checkpoints are kept then
+    completed = True
+
+    async with LizardClient(apikey, perhost, cache=hc) as client:
+        # a pipeline per page of stations: locations, timeseries and events of
+        # the page are stored before the next page is taken, so the memory
+        # used does not grow with the number of stations
+        url = lizardurls[schema] + endpoint
+        async for stations in client.pages(url, cached=True):
+            # the checkpoints (SQLite) are used on the event loop only, the
+            # database calls are run in a thread so the fetches go on
+            if cp is not None:
+                todo = [s for s in stations if not cp.isdone("station", s["url"])]
+                result["resumed"] += len(stations) - len(todo)
+                stations = todo
+            urls, lkeys, pending = await asyncio.to_thread(
+                _stationlocations, fc, schema, orm, stations, skiptypes, result
+            )
+            del stations
+
+            def complete(url, failed=False):
+                # a station is completed when all its timeseries are completed
+                # or failed, failed timeseries are tried again by the next run
+                if failed:
+                    result["failed"] += 1
+                if cp is None:
+                    return
+                if failed:
+                    cp.fail("timeseries", url)
+                else:
+                    cp.done("timeseries", url)
+                station = urls[url][2]
+                pending[station].discard(url)
+                if len(pending[station]) == 0:
+                    cp.done("station", station)
+
+            if cp is not None:
+                for station in [s for s, p in pending.items() if len(p) == 0]:
+                    cp.done("station", station)
+                for url in cp.completed("timeseries") & set(urls):
+                    complete(url)
+                    del urls[url]
+
+            # timeseries of the page, the keys are resolved in one thread hop
+            found = []
+            for url, ts in zip(urls, await client.timeseries(list(urls))):
+                if ts is None:
+                    complete(url, failed=True)
+                    continue
+                name, fskey = urls[url][:2]
+                if name not in lkeys:
+                    # location without code or coordinates
+                    complete(url, failed=True)
+                    continue
+                found.append((url, ts, lkeys[name], fskey))
+            skeys = await asyncio.to_thread(_serieskeys, fc, schema, found)
+            series, metas = {}, []
+            for url, ts, lkey, fskey in found:
+                skey = skeys[url]
+                if skey is None:
+                    complete(url, failed=True)
+                    continue
+                meta = {"url": url}
+                last = wm.get(skey)
+                if last is not None:
+                    # the end of cached metadata may be outdated, such a series
+                    # is requested, time__gt keeps the request small
+                    end = None if ts.get("fromcache") else ts.get("end")
+                    if end is not None and isotodatetime([end])[0] <= last:
+                        result["skipped"] += 1
+                        complete(url)
+                        continue
+                    meta["params"] = {"time__gt": lizardwatermark(last)}
+                if cp is not None:
+                    meta["cursor"] = cp.cursor(url)
+                series[url] = skey
+                metas.append(meta)
+            result["series"] += len(series)
+
+            # events of the page, every page of events is written and released
+            # while at most a few next pages are fetched (see events), the walk
+            # of a failed series is stopped
+            failed = set()
+            async for ts, df in client.events(metas, params, stop=failed):
+                url = ts["url"]
+                if url in failed:
+                    continue
+                if df is None:
+                    # the walk failed (e.g. a 4xx response)
+                    failed.add(url)
+                    complete(url, failed=True)
+                    continue
+                nxt = df.attrs["next"]
+                df = df[df["flag"].notna() & (df["flag"] <= maxflag)]
+                if len(df) > 0:
+                    written = await asyncio.to_thread(
+                        _writeevents, fc, schema, engine, orm, df, series[url]
+                    )
+                    if written is None:
+                        # an interrupted run resumes at this page
+                        failed.add(url)
+                        complete(url, failed=True)
+                        continue
+                    result["rows"] += written["inserted"]
+                del df
+                if cp is None:
+                    continue
+                if nxt is None:
+                    complete(url)
+                else:
+                    cp.setcursor(url, nxt)
+            if any(len(p) > 0 for p in pending.values()):
+                completed = False
+    if cp is not None and completed:
+        # completed, the next run starts at the first page again
+        cp.reset()
+    return result
+
+
+@timed()
+def loadlizard(
+    fc,
+    schema,
+    apikey=None,
+    endpoint="groundwaterstations/",
+    start="2018-01-01T00:00:00Z",
+    maxflag=0,
+    perhost=8,
+    skiptypes=("weather",),
+    incremental=True,
+    checkpoint=None,
+    cache=None,
+):
+    """
+    Loads the stations, timeseries and events of the Lizard API of a source
+    into its schema, one page of stations at a time: the locations of the
+    page are registered in one batch, its timeseries metadata and event pages
+    are fetched concurrently and every page of events is written with
+    ts_bulk.writevalues and released. Only a few pages are fetched ahead, so
+    the memory used does not grow with the number of stations.
+
+    Parameters
+    ----------
+    fc : string
+        Link to credentials file for access to database.
+    schema : string
+        schema of the source, one of lizardurls
+    apikey : string, optional
+        Lizard API key
+    endpoint : string, optional
+        groundwaterstations/ (default, a location per filter) or
+        measuringstations/ (a location per station)
+    start : string, optional
+        ISO 8601 datetime of the first event, default 2018-01-01T00:00:00Z
+    maxflag : integer, optional
+        events with a higher flag are skipped, default 0
+    perhost : integer, optional
+        maximum number of concurrent requests, default 8
+    skiptypes : tuple of strings, optional
+        station types that are skipped, default weather
+    incremental : boolean, optional
+        request per series only the events after its watermark (see
+        ts_helpers.watermarks) and skip series whose end in Lizard is not
+        after the watermark, default True. False requests all events from
+        start
+    checkpoint : string, optional
+        SQLite file with the checkpoints of the crawl (see ts_checkpoint), a
+        crawl that stopped resumes at the stations, timeseries and event
+        pages that were not completed. The checkpoints are removed when the
+        crawl completes. Default None, no checkpoints
+    cache : string, optional
+        SQLite file with the cached station and timeseries metadata (see
+        ts_httpcache), default None, no cache
+
+    Returns
+    -------
+    dictionary with the number of stations, stations completed by a previous
+    run (resumed), locations, series requested, series skipped (no new
+    events), series failed (tried again by the next run) and rows written
+
+    """
+    cp = None
+    if checkpoint is not None:
+        cp = CrawlCheckpoint(checkpoint, f"{schema} {endpoint}")
+    hc = None
+    if cache is not None:
+        hc = HttpCache(cache)
+    coro = _loadlizard(
+        fc,
+        schema,
+        apikey,
+        endpoint,
+        start,
+        maxflag,
+        perhost,
+        skiptypes,
+        incremental,
+        cp,
+        hc,
+    )
+    try:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coro)
+        # called from a running event loop (Jupyter, Spyder)
+        import nest_asyncio
+
+        nest_asyncio.apply()
+        return asyncio.get_event_loop().run_until_complete(coro)
+    finally:
+        if cp is not None:
+            cp.close()
+        if hc is not None:
+            print("http cache", hc.stats())
+            hc.close()
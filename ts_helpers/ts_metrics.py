@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in instrumentation of ingest runs: times and counts ts_helpers calls, SQL
+round trips, HTTP requests and bulk writes per source schema and writes a
+summary (calls, rows, seconds, p50/p95 latency) as JSON at the end of a run.
+
+Switch on with enable(path) at the start of a script or by setting the
+environment variable TS_METRICS to the path of the summary file.
+"""
+
+#  Copyright notice
+#   --------------------------------------------------------------------
+#   Copyright (C) 2024 Deltares for Projects with a FEWS datamodel in
+#                 PostgreSQL/PostGIS database used in Water Information Systems
+#   Gerrit.Hendriksen@deltares.nl
+#
+#   This library is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this library.  If not, see <http://www.gnu.org/licenses/>.
+#   --------------------------------------------------------------------
+#
+# This tool is part of <a href="http://www.OpenEarth.eu">OpenEarthTools</a>.
+# OpenEarthTools is an online collaboration to share and manage data and
+# programming tools in an open source, version controlled environment.
+# Sign up to recieve regular updates of this function, and to contribute
+# your own tools.
+
+# system modules
+import os
+import re
+import time
+import json
+import atexit
+import datetime
+import functools
+import random
+import inspect
+import threading
+from urllib.parse import urlparse
+
+# third party modules
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+enabled = False
+
+# (kind, name, schema) --> [rows, calls, total seconds, reservoir of
+# durations], the reservoir is a uniform random sample of at most
+# reservoirsize durations for the p50/p95, so memory stays bounded on long runs
+reservoirsize = 1024
+_samples = {}
+_sampleslock = threading.Lock()
+_started = None
+_path = None
+_atexit = False
+
+# schema used to tag SQL and HTTP samples outside an instrumented call, the
+# innermost instrumented call sets the tag for the statements it executes
+_defaulttag = None
+_context = threading.local()
+
+# original requests.Session.request, restored by disable
+_request = None
+
+
+def record(kind, name, schema, seconds, rows=0):
+    """Adds one sample, kind is one of ts_helpers, sql, http, bulk, rollup
+    or archive"""
+    key = (kind, name, schema)
+    with _sampleslock:
+        sample = _samples.setdefault(key, [0, 0, 0.0, []])
+        sample[0] += rows
+        sample[1] += 1
+        sample[2] += seconds
+        if len(sample[3]) < reservoirsize:
+            sample[3].append(seconds)
+        else:
+            i = random.randrange(sample[1])
+            if i < reservoirsize:
+                sample[3][i] = seconds
+
+
+def currenttag():
+    """Returns the schema of the innermost running instrumented call, or the
+    default tag"""
+    stack = getattr(_context, "stack", None)
+    if stack:
+        return stack[-1]
+    return _defaulttag
+
+
+def settag(schema):
+    """Sets the schema used to tag samples outside an instrumented call"""
+    global _defaulttag
+    _defaulttag = schema
+
+
+def _rows(result):
+    """number of rows handled by a call, taken from the result: the length of
+    a DataFrame or list of records, the rows of a dictionary, otherwise 0
+    (e.g. the key tuple of loadfilesource)"""
+    if isinstance(result, dict):
+        return result.get("rows", 0) or 0
+    if isinstance(result, list) or hasattr(result, "columns"):
+        return len(result)
+    return 0
+
+
+def timed(schema=None, kind="ts_helpers"):
+    """
+    Decorator that times and counts the calls of a function while
+    instrumentation is enabled. Calls with a schema or model argument are
+    tagged with that schema, other calls with schema.
+
+    Parameters
+    ----------
+    schema : string, optional
+        schema of the ORM classes the function works on
+    kind : string, optional
+        ts_helpers (default), bulk, rollup or archive
+
+    """
+
+    def decorator(f):
+        signature = inspect.signature(f)
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return f(*args, **kwargs)
+            tag = schema
+            try:
+                arguments = signature.bind_partial(*args, **kwargs).arguments
+                model = arguments.get("model")
+                if model is None and "model" in signature.parameters:
+                    model = signature.parameters["model"].default
+                if arguments.get("schema") is not None:
+                    tag = arguments["schema"]
+                elif hasattr(model, "__table__"):
+                    tag = model.__table__.schema
+            except TypeError:
+                pass
+            stack = _context.__dict__.setdefault("stack", [])
+            stack.append(tag)
+            t0 = time.perf_counter()
+            try:
+                result = f(*args, **kwargs)
+            finally:
+                stack.pop()
+            record(kind, f.__name__, tag, time.perf_counter() - t0, _rows(result))
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+_sqlname = re.compile(
+    r"^\s*(\w+).*?\b(?:from|into|update|table)\s+([\w.\"]+)", re.I | re.S
+)
+
+
+def _beforecursor(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("ts_metrics_start", []).append(time.perf_counter())
+
+
+def _aftercursor(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.get("ts_metrics_start")
+    if not start:
+        return
+    seconds = time.perf_counter() - start.pop()
+    m = _sqlname.match(statement)
+    if m is None:
+        name = statement.split(None, 1)[0].lower() if statement.strip() else ""
+        tag = currenttag()
+    else:
+        table = m.group(2).replace('"', "")
+        name = f"{m.group(1).lower()} {table}"
+        tag = table.rsplit(".", 1)[0] if "." in table else currenttag()
+    record("sql", name, tag, seconds, max(cursor.rowcount, 0))
+
+
+def _timedrequest(self, method, url, *args, **kwargs):
+    t0 = time.perf_counter()
+    try:
+        return _request(self, method, url, *args, **kwargs)
+    finally:
+        name = f"{method.upper()} {urlparse(url).netloc}"
+        record("http", name, currenttag(), time.perf_counter() - t0)
+
+
+def enable(path=None, schema=None):
+    """
+    Switches instrumentation on for the rest of the run.
+
+    Parameters
+    ----------
+    path : string, optional
+        JSON file the summary is written to at the end of the run
+    schema : string, optional
+        schema used to tag SQL and HTTP samples outside instrumented calls
+
+    """
+    global enabled, _started, _path, _request, _atexit
+    if schema is not None:
+        settag(schema)
+    if path is not None:
+        _path = path
+        if not _atexit:
+            atexit.register(writesummary)
+            _atexit = True
+    if enabled:
+        return
+    enabled = True
+    _started = datetime.datetime.now()
+    event.listen(Engine, "before_cursor_execute", _beforecursor)
+    event.listen(Engine, "after_cursor_execute", _aftercursor)
+    try:
+        import requests
+
+        _request = requests.Session.request
+        requests.Session.request = _timedrequest
+    except ImportError:
+        pass
+
+
+def disable():
+    """Switches instrumentation off, samples are kept"""
+    global enabled, _request
+    if not enabled:
+        return
+    enabled = False
+    event.remove(Engine, "before_cursor_execute", _beforecursor)
+    event.remove(Engine, "after_cursor_execute", _aftercursor)
+    if _request is not None:
+        import requests
+
+        requests.Session.request = _request
+        _request = None
+
+
+def reset():
+    """Removes all samples"""
+    with _sampleslock:
+        _samples.clear()
+
+
+def summary():
+    """
+    Returns the summary of the samples so far.
+
+    Returns
+    -------
+    dictionary with the start of the run, the elapsed seconds and per kind,
+    name and schema the number of calls, rows, total seconds and the p50 and
+    p95 latency in seconds (estimated from the reservoir), sorted by total
+    seconds
+
+    """
+    with _sampleslock:
+        samples = {k: (v[0], v[1], v[2], list(v[3])) for k, v in _samples.items()}
+    metrics = []
+    for (kind, name, schema), (rows, calls, total, seconds) in samples.items():
+        seconds = np.asarray(seconds)
+        metrics.append(
+            {
+                "kind": kind,
+                "name": name,
+                "schema": schema,
+                "calls": int(calls),
+                "rows": int(rows),
+                "seconds": float(total),
+                "p50": float(np.percentile(seconds, 50)),
+                "p95": float(np.percentile(seconds, 95)),
+            }
+        )
+    metrics.sort(key=lambda m: m["seconds"], reverse=True)
+    started = _started or datetime.datetime.now()
+    return {
+        "started": started.isoformat(timespec="seconds"),
+        "seconds": (datetime.datetime.now() - started).total_seconds(),
+        "metrics": metrics,
+    }
+
+
+def writesummary(path=None):
+    """Writes the summary as JSON to path (default the path given to enable),
+    returns the path or None if there is nothing to write"""
+    path = path or _path
+    if path is None or len(_samples) == 0:
+        return None
+    with open(path, "w") as f:
+        json.dump(summary(), f, indent=2)
+    print("instrumentation summary written to", path)
+    return path
+
+
+if os.environ.get("TS_METRICS"):
+    enable(os.environ["TS_METRICS"])
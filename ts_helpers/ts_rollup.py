@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Daily and monthly rollups (min, mean, max and number of records) of the
+values per timeseries. The rollups are refreshed incrementally: only the
+periods of the loads recorded in the transaction table since the previous
+refresh are recomputed (see ts_helpers.settransactions and ts_bulk). Daily
+rollups are aggregated from the values table, monthly rollups from the daily
+rollups.
+
+Call refreshrollups after loading a source, read with readrollups.
+"""
+
+#  Copyright notice
+#   --------------------------------------------------------------------
+#   Copyright (C) 2024 Deltares for Projects with a FEWS datamodel in
+#                 PostgreSQL/PostGIS database used in Water Information Systems
+#   Gerrit.Hendriksen@deltares.nl
+#
+#   This library is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this library.  If not, see <http://www.gnu.org/licenses/>.
+#   --------------------------------------------------------------------
+#
+# This tool is part of <a href="http://www.OpenEarth.eu">OpenEarthTools</a>.
+# OpenEarthTools is an online collaboration to share and manage data and
+# programming tools in an open source, version controlled environment.
+# Sign up to recieve regular updates of this function, and to contribute
+# your own tools.
+
+# third party modules
+import pandas as pd
+from sqlalchemy import text
+
+## Declare a Mapping to the database
+from orm_timeseries.orm_timeseries import TimeSeriesRollup
+
+# ts_rollup is used both as package and as module
+try:
+    from ts_helpers.ts_metrics import timed
+    from ts_helpers.ts_helpers import getengine, ormmodels, seedwatermarks
+    from ts_helpers.ts_helpers import timeseriesstats
+except ImportError:
+    from ts_metrics import timed
+    from ts_helpers import getengine, ormmodels, seedwatermarks
+    from ts_helpers import timeseriesstats
+
+# resolutions from fine to coarse, with the approximate length of a period
+resolutions = {"day": pd.Timedelta(days=1), "month": pd.Timedelta(days=30.44)}
+
+
+def _tables(engine, model):
+    """returns the formatted names of the rollup, state, transaction, values
+    and timeseries tables of the schema of model"""
+    prep = engine.dialect.identifier_preparer
+    orm = ormmodels(model.__table__.schema)
+    return {
+        "rollup": prep.format_table(model.__table__),
+        "state": prep.format_table(orm.RollupState.__table__),
+        "transaction": prep.format_table(orm.Transaction.__table__),
+        "values": prep.format_table(orm.TimeSeriesValuesAndFlags.__table__),
+        "timeseries": prep.format_table(orm.TimeSeries.__table__),
+    }
+
+
+def _rollupsql(t, resolution):
+    """returns the statements that replace the rollups of resolution for the
+    periods in temporary table tmp_periods (timeserieskey, periodstart, periodend)"""
+    if resolution == "day":
+        source = f"""select v.timeserieskey, date_trunc('day', v.datetime) as period,
+                min(v.scalarvalue) as minvalue, avg(v.scalarvalue) as meanvalue,
+                max(v.scalarvalue) as maxvalue, count(*) as nrecords
+            from tmp_periods p join {t['values']} v on v.timeserieskey = p.timeserieskey
+                and v.datetime >= date_trunc('day', p.periodstart)
+                and v.datetime < date_trunc('day', p.periodend) + interval '1 day'
+            group by 1, 2"""
+    else:
+        source = f"""select r.timeserieskey, date_trunc('month', r.datetime) as period,
+                min(r.minvalue) as minvalue,
+                sum(r.meanvalue * r.nrecords) / sum(r.nrecords) as meanvalue,
+                max(r.maxvalue) as maxvalue, sum(r.nrecords) as nrecords
+            from tmp_periods p join {t['rollup']} r on r.timeserieskey = p.timeserieskey
+                and r.resolution = 'day'
+                and r.datetime >= date_trunc('month', p.periodstart)
+                and r.datetime < date_trunc('month', p.periodend) + interval '1 month'
+            group by 1, 2"""
+    delete = f"""delete from {t['rollup']} r using tmp_periods p
+        where r.timeserieskey = p.timeserieskey and r.resolution = '{resolution}'
+        and r.datetime >= date_trunc('{resolution}', p.periodstart)
+        and r.datetime <= p.periodend"""
+    insert = f"""insert into {t['rollup']} (timeserieskey, resolution, datetime,
+            minvalue, meanvalue, maxvalue, nrecords)
+        select timeserieskey, '{resolution}', period, minvalue, meanvalue,
+            maxvalue, nrecords
+        from ({source}) a"""
+    return delete, insert
+
+
+def _rollup(conn, t, periodsql, params, resolution):
+    """replaces the rollups of resolution for the periods selected by
+    periodsql, returns the number of rollups written"""
+    conn.execute(text("drop table if exists tmp_periods"))
+    conn.execute(
+        text(f"create temp table tmp_periods on commit drop as {periodsql}"), params
+    )
+    delete, insert = _rollupsql(t, resolution)
+    conn.execute(text(delete))
+    return conn.execute(text(insert)).rowcount
+
+
+@timed(kind="rollup")
+def refreshrollups(fc, model=TimeSeriesRollup, schema=None):
+    """
+    Refreshes the daily and monthly rollups of the schema of model for the
+    loads recorded in the transaction table since the previous refresh. The
+    first refresh of a resolution (no state yet) rolls up all stored values
+    of every series, as rebuildrollups, also the values loaded before the
+    first transaction.
+
+    Parameters
+    ----------
+    fc : string
+        Link to credentials file for access to database.
+    model : ORM class, optional
+        TimeSeriesRollup class of the target schema
+    schema : string, optional
+        schema to work in (see ts_helpers.ormmodels), replaces the schema of
+        model
+
+    Returns
+    -------
+    dictionary with resolution --> number of rollups written, None in case of
+    an exception
+
+    """
+    if schema is not None:
+        model = getattr(ormmodels(schema), model.__name__)
+    orm = ormmodels(model.__table__.schema)
+    engine = getengine(fc)
+    t = _tables(engine, model)
+    result = {}
+    try:
+        with engine.begin() as conn:
+            model.__table__.create(conn, checkfirst=True)
+            orm.RollupState.__table__.create(conn, checkfirst=True)
+            state = dict(
+                conn.execute(
+                    text(f"select resolution, transactionkey from {t['state']}")
+                )
+            )
+        if len(state) == 0:
+            seedwatermarks(fc, orm.Transaction)
+        with engine.begin() as conn:
+            # the share lock waits for loads that are still running, so all
+            # transactions up to upto are committed
+            conn.execute(text(f"lock table {t['transaction']} in share mode"))
+            upto = conn.execute(
+                text(f"select max(transactionkey) from {t['transaction']}")
+            ).scalar()
+        if upto is None:
+            return result
+        periodsql = f"""select timeserieskey, min(periodstart) as periodstart,
+                max(periodend) as periodend
+            from {t['transaction']}
+            where transactionkey > :since and transactionkey <= :upto
+            group by timeserieskey"""
+        fullsql = f"""select timeserieskey, '-infinity'::timestamp as periodstart,
+                'infinity'::timestamp as periodend
+            from {t['timeseries']}"""
+        for resolution in resolutions:
+            if resolution in state:
+                if state[resolution] >= upto:
+                    result[resolution] = 0
+                    continue
+                sql, params = periodsql, {"since": state[resolution], "upto": upto}
+            else:
+                sql, params = fullsql, {}
+            with engine.begin() as conn:
+                result[resolution] = _rollup(conn, t, sql, params, resolution)
+                conn.execute(
+                    text(f"""insert into {t['state']} (resolution, transactionkey,
+                            modificationtime)
+                        values (:resolution, :upto, localtimestamp)
+                        on conflict (resolution) do update set
+                            transactionkey = excluded.transactionkey,
+                            modificationtime = excluded.modificationtime"""),
+                    {"resolution": resolution, "upto": upto},
+                )
+        return result
+    except Exception as e:
+        print("exception raised while refreshing", model.__table__.fullname, e)
+        return None
+
+
+@timed(kind="rollup")
+def rebuildrollups(fc, timeserieskeys, model=TimeSeriesRollup, schema=None):
+    """
+    Recomputes all daily and monthly rollups of the given series, needed after
+    values are deleted (the incremental refresh only sees loads).
+
+    Parameters
+    ----------
+    fc : string
+        Link to credentials file for access to database.
+    timeserieskeys : list of integers
+        series to recompute
+    model : ORM class, optional
+        TimeSeriesRollup class of the target schema
+    schema : string, optional
+        schema to work in (see ts_helpers.ormmodels), replaces the schema of
+        model
+
+    Returns
+    -------
+    dictionary with resolution --> number of rollups written, None in case of
+    an exception
+
+    """
+    if schema is not None:
+        model = getattr(ormmodels(schema), model.__name__)
+    engine = getengine(fc)
+    t = _tables(engine, model)
+    periodsql = f"""select timeserieskey, '-infinity'::timestamp as periodstart,
+            'infinity'::timestamp as periodend
+        from {t['timeseries']} where timeserieskey = any(:keys)"""
+    params = {"keys": [int(k) for k in timeserieskeys]}
+    try:
+        with engine.begin() as conn:
+            model.__table__.create(conn, checkfirst=True)
+            return {r: _rollup(conn, t, periodsql, params, r) for r in resolutions}
+    except Exception as e:
+        print("exception raised while rebuilding", model.__table__.fullname, e)
+        return None
+
+
+def chooseresolution(start, end, points=100):
+    """returns the coarsest resolution (month, day) that gives at least points
+    values per series between start and end, raw if none does"""
+    span = pd.Timestamp(end) - pd.Timestamp(start)
+    for resolution in reversed(list(resolutions)):
+        if span / resolutions[resolution] >= points:
+            return resolution
+    return "raw"
+
+
+@timed(kind="rollup")
+def readrollups(
+    fc,
+    timeserieskeys,
+    start=None,
+    end=None,
+    points=100,
+    resolution=None,
+    model=TimeSeriesRollup,
+    schema=None,
+):
+    """
+    Reads the values of the given series between start and end at the
+    coarsest resolution that still gives at least points values per series
+    (see chooseresolution), so long spans are read from the monthly or daily
+    rollups instead of the values table.
+
+    Parameters
+    ----------
+    fc : string
+        Link to credentials file for access to database.
+    timeserieskeys : list of integers
+        series to read
+    start, end : datetime, optional
+        period to read, default the period with values of the series (see
+        ts_helpers.timeseriesstats)
+    points : integer, optional
+        minimum number of values per series, default 100
+    resolution : string, optional
+        month, day or raw, overrules the choice of resolution
+    model : ORM class, optional
+        TimeSeriesRollup class of the target schema
+    schema : string, optional
+        schema to work in (see ts_helpers.ormmodels), replaces the schema of
+        model
+
+    Returns
+    -------
+    pandas DataFrame with columns timeserieskey, datetime, minvalue,
+    meanvalue, maxvalue and nrecords (for raw values minvalue, meanvalue and
+    maxvalue are the value and nrecords is 1), the resolution is stored in
+    df.attrs["resolution"]
+
+    """
+    if schema is not None:
+        model = getattr(ormmodels(schema), model.__name__)
+    keys = [int(k) for k in timeserieskeys]
+    if start is None or end is None:
+        stats = timeseriesstats(fc, keys, schema=model.__table__.schema)
+        if len(stats) == 0:
+            stats = pd.DataFrame({"firstdatetime": [pd.NaT], "lastdatetime": [pd.NaT]})
+        start = stats["firstdatetime"].min() if start is None else start
+        end = stats["lastdatetime"].max() if end is None else end
+    if resolution is None:
+        if pd.isnull(start) or pd.isnull(end):
+            resolution = "raw"
+        else:
+            resolution = chooseresolution(start, end, points)
+
+    engine = getengine(fc)
+    t = _tables(engine, model)
+    where = ["timeserieskey = any(:keys)"]
+    params = {"keys": keys, "resolution": resolution}
+    if not pd.isnull(start):
+        where.append("datetime >= :start")
+        params["start"] = pd.Timestamp(start).to_pydatetime()
+    if not pd.isnull(end):
+        where.append("datetime <= :end")
+        params["end"] = pd.Timestamp(end).to_pydatetime()
+    if resolution == "raw":
+        strsql = f"""select timeserieskey, datetime, scalarvalue as minvalue,
+                scalarvalue as meanvalue, scalarvalue as maxvalue, 1 as nrecords
+            from {t['values']}"""
+    else:
+        where.insert(0, "resolution = :resolution")
+        strsql = f"""select timeserieskey, datetime, minvalue, meanvalue, maxvalue,
+                nrecords
+            from {t['rollup']}"""
+    strsql += " where " + " and ".join(where)
+    strsql += " order by timeserieskey, datetime"
+    with engine.connect() as conn:
+        df = pd.read_sql(text(strsql), conn, params=params)
+    df.attrs["resolution"] = resolution
+    return df
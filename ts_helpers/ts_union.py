@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Union layer over the timeseries schemas of all sources: per table a view in
+schema alltimeseries that unions the table of every source schema with a
+column source (bro, hdsr, hhnk, ...), and a materialized view seriesstats
+with the location, parameter and summary (see ts_helpers.statstable) per
+series of all sources. Cross-source queries become one statement instead of
+one statement per schema.
+
+The columns are taken from the ORM declarations, tables that are not
+declared (e.g. location_metadata2) are read from the catalog. Columns that
+a schema lacks are filled with null.
+"""
+
+#  Copyright notice
+#   --------------------------------------------------------------------
+#   Copyright (C) 2024 Deltares for Projects with a FEWS datamodel in
+#                 PostgreSQL/PostGIS database used in Water Information Systems
+#   Gerrit.Hendriksen@deltares.nl
+#
+#   This library is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This library is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this library.  If not, see <http://www.gnu.org/licenses/>.
+#   --------------------------------------------------------------------
+#
+# This tool is part of <a href="http://www.OpenEarth.eu">OpenEarthTools</a>.
+# OpenEarthTools is an online collaboration to share and manage data and
+# programming tools in an open source, version controlled environment.
+# Sign up to recieve regular updates of this function, and to contribute
+# your own tools.
+
+# third party modules
+from sqlalchemy import text
+
+# ts_union is used both as package and as module
+try:
+    from ts_helpers.ts_metrics import timed
+    from ts_helpers.ts_helpers import ormmodules, ormmodels
+except ImportError:
+    from ts_metrics import timed
+    from ts_helpers import ormmodules, ormmodels
+
+unionschema = "alltimeseries"
+
+# source schemas of the master metadata (see make_mastermetadata), wskip has
+# no ORM module but the layout of the timeseries schema
+sourceschemas = (
+    "bro_timeseries",
+    "hdsr_timeseries",
+    "hhnk_timeseries",
+    "wskip_timeseries",
+    "waterschappen_timeseries",  # handmetingen
+    "nobv_timeseries",  # nobv handmatige bewerkingen data
+)
+
+# schemas of the union layer, the schemas of ts_helpers.ormmodules and the
+# source schemas. The WSKIP data is unioned once, from wskip_timeseries (the
+# schema the master metadata reads); the default schema timeseries of the
+# ingesters also holds WSKIP data and is left out, so no series appears twice
+# under two sources
+unionschemas = tuple(s for s in ormmodules if s != "timeseries") + tuple(
+    s for s in sourceschemas if s not in ormmodules
+)
+
+# tables in the union layer, the values table is only a view (not stored)
+uniontables = (
+    "filesource",
+    "location",
+    "parameter",
+    "unit",
+    "flags",
+    "timeseries",
+    "timeseriesstats",
+    "timeseriesrollup",
+    "boundingbox",
+    "timeseriesvaluesandflags",
+    "location_metadata2",
+)
+
+
+def sourcename(schema):
+    """returns the source of schema, the prefix used in well_id (bro for
+    bro_timeseries)"""
+    if schema.endswith("_timeseries"):
+        return schema[: -len("_timeseries")]
+    return schema
+
+
+def _columns(conn, schema, name):
+    """returns [(column, type)] of table name in schema, from the ORM
+    declaration when declared (schemas without ORM module use the layout of
+    the timeseries schema) or else from the catalog, None if the table does
+    not exist"""
+    if (
+        conn.execute(text("select to_regclass(:t)"), {"t": f"{schema}.{name}"}).scalar()
+        is None
+    ):
+        return None
+    orm = ormmodels(schema if schema in ormmodules else None)
+    table = orm.Base.metadata.tables.get(f"{orm.FileSource.__table__.schema}.{name}")
+    if table is not None:
+        dialect = conn.engine.dialect
+        return [(c.name, c.type.compile(dialect=dialect)) for c in table.columns]
+    strsql = """select a.attname, format_type(a.atttypid, a.atttypmod)
+        from pg_attribute a
+        where a.attrelid = to_regclass(:t) and a.attnum > 0 and not a.attisdropped
+        order by a.attnum"""
+    return [tuple(r) for r in conn.execute(text(strsql), {"t": f"{schema}.{name}"})]
+
+
+def unionviewsql(conn, name, schemas):
+    """returns the select that unions table name of schemas with a column
+    source, None if no schema has the table. Columns a schema lacks are null,
+    columns with a different type per schema are cast to text"""
+    layouts = {}
+    for schema in schemas:
+        columns = _columns(conn, schema, name)
+        if columns is not None:
+            layouts[schema] = dict(columns)
+    if len(layouts) == 0:
+        return None
+    types = {}
+    for columns in layouts.values():
+        for column, type_ in columns.items():
+            if types.setdefault(column, type_) != type_:
+                types[column] = "text"
+    prep = conn.engine.dialect.identifier_preparer
+    selects = []
+    for schema, columns in layouts.items():
+        fields = [f"'{sourcename(schema)}'::text as source"]
+        for column, type_ in types.items():
+            if column not in columns:
+                fields.append(f"null::{type_} as {prep.quote(column)}")
+            elif columns[column] != type_:
+                fields.append(f"{prep.quote(column)}::{type_} as {prep.quote(column)}")
+            else:
+                fields.append(prep.quote(column))
+        selects.append(
+            f"select {', '.join(fields)} from {prep.quote_schema(schema)}.{prep.quote(name)}"
+        )
+    return "\nunion all\n".join(selects)
+
+
+# series of all sources with location, parameter and summary, unique on
+# (source, timeserieskey) so it can be refreshed concurrently
+seriesstatssql = f"""select t.source, t.timeserieskey, t.locationkey,
+        t.source || '_' || t.locationkey::text as well_id, l.name, p.id as parameter,
+        s.firstdatetime, s.lastdatetime, s.nrecords, s.minvalue, s.maxvalue, l.geom
+    from {unionschema}.timeseries t
+    join {unionschema}.location l on l.source = t.source and l.locationkey = t.locationkey
+    join {unionschema}.parameter p on p.source = t.source and p.parameterkey = t.parameterkey
+    left join {unionschema}.timeseriesstats s
+        on s.source = t.source and s.timeserieskey = t.timeserieskey"""
+
+
+@timed()
+def createunionlayer(engine, schemas=None, tables=uniontables, replace=False):
+    """
+    Creates the union views in schema alltimeseries and the materialized view
+    seriesstats. Existing views are kept unless replace is True (needed after
+    a change of the schemas or of the layout of a table).
+
+    Parameters
+    ----------
+    engine : sqlalchemy engine
+        engine (shared, see ts_helpers.getengine)
+    schemas : list of strings, optional
+        source schemas, default unionschemas (the schemas of
+        ts_helpers.ormmodules and sourceschemas, WSKIP once)
+    tables : list of strings, optional
+        tables to union, default uniontables
+    replace : boolean, optional
+        drop and create the views, default False
+
+    Returns
+    -------
+    list of the views that are created
+
+    """
+    schemas = list(schemas or unionschemas)
+    prep = engine.dialect.identifier_preparer
+    created = []
+    with engine.begin() as conn:
+        conn.execute(text(f"create schema if not exists {unionschema}"))
+        if replace:
+            conn.execute(
+                text(f"drop materialized view if exists {unionschema}.seriesstats")
+            )
+        for name in tables:
+            view = f"{unionschema}.{prep.quote(name)}"
+            exists = conn.execute(text("select to_regclass(:v)"), {"v": view}).scalar()
+            if exists is not None and not replace:
+                continue
+            strsql = unionviewsql(conn, name, schemas)
+            if strsql is None:
+                continue
+            conn.execute(text(f"drop view if exists {view}"))
+            conn.execute(text(f"create view {view} as\n{strsql}"))
+            created.append(view)
+        mview = f"{unionschema}.seriesstats"
+        if conn.execute(text("select to_regclass(:v)"), {"v": mview}).scalar() is None:
+            conn.execute(text(f"create materialized view {mview} as\n{seriesstatssql}"))
+            conn.execute(
+                text(f"create unique index on {mview} (source, timeserieskey)")
+            )
+            conn.execute(text(f"create index on {mview} using gist (geom)"))
+            created.append(mview)
+    return created
+
+
+@timed()
+def refreshunionlayer(engine):
+    """Refreshes the materialized view seriesstats concurrently, readers keep
+    reading the previous content during the refresh"""
+    with engine.begin() as conn:
+        conn.execute(
+            text(f"refresh materialized view concurrently {unionschema}.seriesstats")
+        )
+    return
@@ -65,7 +65,10 @@ from ts_helpers_bro import (
     convertlttodate,
     stimestep,
     convertdatetostring,
+    keycache,
+    watermark,
 )
+from ts_bulk import writevalues, mergevalues
 
 
 # %%
@@ -82,27 +85,25 @@ session, engine = establishconnection(fc)
 
 
 def lastgwstage(engine, brolocation, t, pid, fid):
-    """Retrieves last entrance in the database for the given combination of BROid, filesourckey and paramaterkey
+    """Retrieves the watermark (end of the latest load) for the given combination of location, filesourcekey and paramaterkey
 
     Args:
-        brolocation (string): location of bro_id, incl. filternumber
+        brolocation (string): location, the filternumber t is appended
         pid (integer): parameterkey
         fid (integer): filesourckey
     """
-    strsql = f"""
-    select max(datetime) from bro_timeseries.location l
-    join bro_timeseries.timeseries ts on ts.locationkey = l.locationkey
-    join bro_timeseries.parameter p on p.parameterkey = ts.parameterkey
-    join bro_timeseries.filesource f on f.filesourcekey = ts.filesourcekey
-    join bro_timeseries.timeseriesvaluesandflags tsf on tsf.timeserieskey = ts.timeserieskey
-    where l.name = '{brolocation}_{t}' and f.filesourcekey = {fid} and p.parameterkey = {pid}
-    """
-    ld = engine.execute(strsql).fetchall()
-    adate = ld[0][0]
+    lid = keycache(engine, Location).get(f"{brolocation}_{t}")
+    if lid is None:
+        return None
+    tskey = stimestep(session, "nonequidistant")
+    sid = keycache(engine, TimeSeries).get((lid, pid, tskey, fid))
+    if sid is None:
+        return None
+    adate = watermark(fc, sid)
     if adate is None:
         strdate = None
     else:
-        adate = adate + timedelta(hours=2)
+        adate = adate + pd.Timedelta(hours=2)
         strdate = adate.strftime("%Y-%m-%d")
         print(brolocation, strdate)
     return strdate
@@ -124,7 +125,7 @@ pid = sparameter(fc, "grondwater", "grondwater", ("stand", "m-NAP"), "grondwater
 strSql = """select bro_id,number_of_monitoring_tubes from bro_timeseries.groundwater_monitoring_well 
             where veenperceel and removed = 'nee'"""
 
-updatedb = True  # in this case there is already data available, data will be updated record by record
+updatedb = True  # in this case there is already data available, only missing records are added
 # set to False if complete reread of the BRO data is necessary
 
 conn = engine.connect()
@@ -166,41 +167,9 @@ for i in res:
             dfval.drop(["qualifier"], axis=1, inplace=True)
             dfval.dropna(inplace=True)
             if len(dfval) > 0 and updatedb:
-                for i, r in dfval.iterrows():
-                    date_time_obj = r["datetime"]
-                    vl = r["scalarvalue"]
-                    flagid = r["flags"]
-                    sid = r["timeserieskey"]
-                    anid = (
-                        session.query(tsv)
-                        .filter_by(
-                            timeserieskey=sid, datetime=date_time_obj, scalarvalue=vl
-                        )
-                        .first()
-                    )
-                    if anid == None:
-                        print(
-                            "adding:",
-                            r["datetime"],
-                            r["scalarvalue"],
-                            r["timeserieskey"],
-                            r["flags"],
-                        )
-                        insert = tsv(
-                            timeserieskey=sid,
-                            datetime=date_time_obj,
-                            scalarvalue=vl,
-                            flags=flagid,
-                        )
-                        session.merge(insert)
-                        session.commit()
+                merged = mergevalues(engine, dfval, tsv)
+                if merged is not None:
+                    print("added", merged["inserted"], "of", merged["rows"], "records")
             # incase complete redo of the data then updatedb = false
             elif len(dfval) > 0 and not updatedb:
-                dfval.to_sql(
-                    "timeseriesvaluesandflags",
-                    engine,
-                    if_exists="append",
-                    schema="bro_timeseries",
-                    index=False,
-                    method="multi",
-                )
+                writevalues(engine, dfval, tsv)
@@ -44,10 +44,16 @@ from orm_timeseries.orm_timeseries import TimeSeriesValuesAndFlags as tsv
 from ts_helpers.ts_helpers import (
     loadfilesource,
     location,
+    location_many,
     establishconnection,
     Location,
+    TimeSeries,
 )
 from ts_helpers.ts_helpers import sparameter, stimestep, sflag, sserieskey
+from ts_helpers.ts_helpers import keycache, watermark, epochtodatetime
+from ts_helpers.ts_bulk import mergevalues
+from ts_helpers.ts_checkpoint import CrawlCheckpoint
+from ts_helpers.ts_httpcache import HttpCache
 
 # globals
 local = False
@@ -63,16 +69,38 @@ session, engine = establishconnection(fc)
 mapserver_url = "https://gis.wetterskipfryslan.nl/arcgis/rest/services/Grondwatersite_mpn/MapServer/"
 
 
-def procesdata(jsonrespons, fid):
+def procesdata(jsonrespons, fid, checkpoint=None):
     """Consumes the jsonrespons and stores:
        location, flag, parameter, serieskey and loads the data by calling storetimeseries
 
     Args:
         jsonrespons (json): first layer with location, parameter information
         fid (integer): file identifier store in the data model
+        checkpoint (CrawlCheckpoint): locations that are completed in a
+                    previous (interrupted) run are skipped, default None
+
+    Returns:
+        boolean: True if the data of all locations is stored
     """
 
     features = jsonrespons["features"]
+    # register all locations of the response in one go
+    dfloc = pd.DataFrame(
+        [
+            {
+                "name": f["attributes"]["NAAM"],
+                "x": f["geometry"]["x"],
+                "y": f["geometry"]["y"],
+                "epsgcode": 4326,
+                "shortname": f["attributes"]["TELEMETRIELOCATIEID"],
+                "description": f["attributes"]["OMSCHRIJVING"],
+                "z": f["attributes"]["MAAIVELD"],
+            }
+            for f in features
+        ]
+    )
+    lids = location_many(fc, dfloc, fskey=fid)
+    complete = True
     for i in range(len(features)):
         ogw = None
         dgw = None
@@ -88,10 +116,17 @@ def procesdata(jsonrespons, fid):
         x = jsonrespons["features"][i]["geometry"]["x"]
         y = jsonrespons["features"][i]["geometry"]["y"]
         print(tid, nam)
+        if checkpoint is not None and checkpoint.isdone("station", tid):
+            print("Data for location", nam, "stored in a previous run")
+            continue
+        # locations without groundwater series have nothing to store
+        stored = True
         # set location parameter
-        lid = location(
-            fc, fid, nam, x, y, epsg=4326, shortname=tid, description=des, z=mv
-        )
+        lid = lids.get(nam)
+        if lid is None:
+            lid = location(
+                fc, fid, nam, x, y, epsg=4326, shortname=tid, description=des, z=mv
+            )
         # set the flag key to validated
         flagid = sflag(fc, "validated")
 
@@ -115,7 +150,7 @@ def procesdata(jsonrespons, fid):
             )
             sid2 = sserieskey(fc, pid2, lid, fid, fm)
             # store timeseries associated with location for tid (the identifier of the telemetrielocationid)
-            storetimeseries(sid, tid, flagid, sid2)
+            stored = storetimeseries(sid, tid, flagid, sid2)
         elif ogw == "j" and dgw == None:
             pid = sparameter(
                 fc,
@@ -126,7 +161,7 @@ def procesdata(jsonrespons, fid):
             )
             sid = sserieskey(fc, pid, lid, fid, fm)
             # store timeseries associated with location for tid (the identifier of the telemetrielocationid)
-            storetimeseries(sid, tid, flagid)
+            stored = storetimeseries(sid, tid, flagid)
         elif dgw == "j" and ogw == None:
             pid = sparameter(
                 fc,
@@ -137,9 +172,15 @@ def procesdata(jsonrespons, fid):
             )
             sid = sserieskey(fc, pid2, lid, fid, fm)
             # store timeseries associated with location for tid (the identifier of the telemetrielocationid)
-            storetimeseries(sid, tid, flagid)
+            stored = storetimeseries(sid, tid, flagid)
 
+        if not stored:
+            complete = False
+            continue
+        if checkpoint is not None:
+            checkpoint.done("station", tid)
         print("Data for location", nam, "stored in database")
+    return complete
 
 
 def storetimeseries(sid, id, flagid, sid2=None):
@@ -153,6 +194,9 @@ def storetimeseries(sid, id, flagid, sid2=None):
         flagid (integer): identifier indicating quality of the data
         sid2 (integer): in case of a second filter for the same location a
                         unique identifier describes a different dataset
+
+    Returns:
+        boolean: True if the request succeeded and the data is stored
     """
 
     # now for each location retrieve the timeseries data.
@@ -163,80 +207,51 @@ def storetimeseries(sid, id, flagid, sid2=None):
     print(id, ts.status_code)
     if ts.status_code == 200:
         tsdata = ts.json()
-        for v in range(len(tsdata["features"])):
-            text = "ondiep"
-            tid = None
-            if sid2 is not None:
-                tid = tsdata["features"][v]["attributes"]["TELEMETRIEKANAALID"]
-                if tid == "Ai5":
-                    dt = tsdata["features"][v]["attributes"]["MONSTERDATUM"]
-                    vl = tsdata["features"][v]["attributes"]["WAARDE"]
-                elif tid == "Ai6":
-                    dt = tsdata["features"][v]["attributes"]["MONSTERDATUM"]
-                    vl = tsdata["features"][v]["attributes"]["WAARDE"]
-                    text = "diep"
-            else:
-                dt = tsdata["features"][v]["attributes"]["MONSTERDATUM"]
-                vl = tsdata["features"][v]["attributes"]["WAARDE"]
-
-            date_time_obj = timestamp_to_datetime(dt)
-            print(text, id, tid, sid, date_time_obj, vl)
-            anid = (
-                session.query(tsv)
-                .filter_by(timeserieskey=sid, datetime=date_time_obj, scalarvalue=vl)
-                .first()
-            )
-            if anid == None:
-                insert = tsv(
-                    timeserieskey=sid,
-                    datetime=date_time_obj,
-                    scalarvalue=vl,
-                    flags=flagid,
-                )
-                session.merge(insert)
-                session.commit()
+        df = pd.DataFrame([f["attributes"] for f in tsdata["features"]])
+        if len(df) == 0:
+            return True
+        if sid2 is not None:
+            # Ai5 is the shallow (ondiep) filter, Ai6 the deep (diep) filter,
+            # both are stored under sid as before
+            df = df.loc[df["TELEMETRIEKANAALID"].isin(["Ai5", "Ai6"])].copy()
+        df["timeserieskey"] = sid
+        # epoch milliseconds, stored in the local time of the machine as before
+        df["datetime"] = epochtodatetime(df["MONSTERDATUM"], tz="local")
+        df["scalarvalue"] = df["WAARDE"]
+        df["flags"] = flagid
+        df = df[["timeserieskey", "datetime", "scalarvalue", "flags"]].dropna()
+        res = mergevalues(engine, df, tsv)
+        if res is not None:
+            print(id, "added", res["inserted"], "of", res["rows"], "records")
+        return res is not None
+    return False
 
 
 def lastgwstage(engine, gwslocation, t, pid, fid):
-    """Retrieves last entrance in the database for the given combination of BROid, filesourckey and paramaterkey
+    """Retrieves the watermark (end of the latest load) for the given combination of location, filesourcekey and paramaterkey
 
     Args:
-        brolocation (string): location of bro_id, incl. filternumber
+        gwslocation (string): location, the filternumber t is appended
         pid (integer): parameterkey
         fid (integer): filesourckey
     """
-    strsql = f"""
-    select max(datetime) from wskip_timeseries.location l
-    join wskip_timeseries.timeseries ts on ts.locationkey = l.locationkey
-    join wskip_timeseries.parameter p on p.parameterkey = ts.parameterkey
-    join wskip_timeseries.filesource f on f.filesourcekey = ts.filesourcekey
-    join wskip_timeseries.timeseriesvaluesandflags tsf on tsf.timeserieskey = ts.timeserieskey
-    where l.name = '{gwslocation}_{t}' and f.filesourcekey = {fid} and p.parameterkey = {pid}
-    """
-    ld = engine.execute(strsql).fetchall()
-    adate = ld[0][0]
+    lid = keycache(engine, Location).get(f"{gwslocation}_{t}")
+    if lid is None:
+        return None
+    tskey = stimestep(session, "nonequidistant")
+    sid = keycache(engine, TimeSeries).get((lid, pid, tskey, fid))
+    if sid is None:
+        return None
+    adate = watermark(fc, sid)
     if adate is None:
         strdate = None
     else:
-        adate = adate + timedelta(hours=2)
+        adate = adate + pd.Timedelta(hours=2)
         strdate = adate.strftime("%Y-%m-%d")
         print(gwslocation, strdate)
     return strdate
 
 
-# Function to convert timestamp to datetime
-def timestamp_to_datetime(timestamp):
-    """Genereates a valid datetemobject from datatime given in seconds
-
-    Args:
-        timestamp (integer): julian date in seconds
-
-    Returns:
-        datetime: returns valid datetime object
-    """
-    return datetime.fromtimestamp(timestamp / 1000.0)
-
-
 # the website mentions the elevation (m-mv) where the observations are done, these observations
 # are retrieved from https://www.wetterskipfryslan.nl/kaarten/grondwaterstanden. Every location reveals
 # this elevation. In some cases there are shallow and deep measurements, shallow is the first number in de list of values, deep the last)
@@ -289,14 +304,32 @@ if __name__ == "__main__":
         """https://gis.wetterskipfryslan.nl/arcgis/rest/services/Grondwatersite_mpn/MapServer/0/query?returnGeometry=true&where=1=1&outSr=4326&outFields=*&geometry={"xmin":5.625,"ymin":52.482780222078226,"xmax":8.4375,"ymax":54.16243396806779,"spatialReference":{"wkid":4326}}&geometryType=esriGeometryEnvelope&spatialRel=esriSpatialRelIntersects&inSr=4326&geometryPrecision=6&f=json""",
     )
 
+    # an interrupted run resumes at the locations that were not completed, the
+    # checkpoints are removed when all links are completed
+    checkpoint = CrawlCheckpoint(
+        os.path.join(os.path.dirname(fc), "crawl_checkpoints.sqlite"),
+        "wskip_timeseries",
+    )
+    # the location layer hardly changes, it is taken from the local cache and
+    # only downloaded again when the server reports a change
+    cache = HttpCache(os.path.join(os.path.dirname(fc), "http_cache.sqlite"))
     for alink in lstlnks:
         print(alink)
-        response = requests.get(alink)
+        if checkpoint.isdone("page", alink):
+            print("completed in a previous run")
+            continue
+        response = cache.get(alink)
         if response.status_code == 200:
             data = response.json()
             # store link as filesource
             fid = loadfilesource(alink, fc, remark="online resource")[0][0]
             # procesgeom loads/checks geometry, parameter, and stores all data
-            procesdata(data, fid)
+            if procesdata(data, fid, checkpoint):
+                checkpoint.done("page", alink)
         else:
             print(f"Request failed with status code: {response.status_code}")
+    if checkpoint.completed("page") >= set(lstlnks):
+        checkpoint.reset()
+    checkpoint.close()
+    print("http cache", cache.stats())
+    cache.close()
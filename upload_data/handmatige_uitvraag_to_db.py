@@ -73,7 +73,9 @@ from ts_helpers.ts_helpers_waterschappen import (
     dateto_integer,
     convertlttodate,
     stimestep,
+    watermark,
 )
+from ts_helpers.ts_bulk import writevalues
 
 
 def read_config(af):
@@ -84,19 +86,6 @@ def read_config(af):
     return cf
 
 
-def latest_entry(skey):
-    """function to find the lastest timestep entry per skey.
-    input = skey
-    output = pandas df containing either none or a date"""
-    stmt = """select max(datetime) from waterschappen_timeseries.timeseriesvaluesandflags
-        where timeserieskey={s};""".format(
-        s=skey
-    )
-    r = engine.execute(stmt).fetchall()[0][0]
-    r = pd.to_datetime(r)
-    return r
-
-
 prefixes = [">", "#", "*", "$"]
 dntusecol = ["mex", "chflysi", "mexb"]
 
@@ -361,9 +350,8 @@ for root in paths:
                     dfx = dfx.dropna()
                     dfx.sort_values(by=["datetime"], inplace=True)
 
-                    r = latest_entry(
-                        skeyz
-                    )  # find if there was already a timeseries stored in the database
+                    # find if there was already a timeseries stored in the database
+                    r = watermark(fc, skeyz)
                     duplicate_rows = dfx[dfx.duplicated()]  # find duplicated entries
                     # print(duplicate_rows)
                     dfx = dfx.drop_duplicates()
@@ -372,13 +360,7 @@ for root in paths:
                         print('yes')
                         dfx["timeserieskey"] = skeyz
                         dfx["flags"] = flag
-                        dfx.to_sql(
-                            "timeseriesvaluesandflags",
-                            engine,
-                            index=False,
-                            if_exists="append",
-                            schema="waterschappen_timeseries",
-                        )
+                        writevalues(engine, dfx, TimeSeriesValuesAndFlags)
                     else:
                         print("not updating")
 
@@ -484,7 +466,7 @@ for root in paths:
                     dfx["scalarvalue"] = dfx["scalarvalue"].astype("float64")
                     dfx = dfx.dropna()
 
-                    r = latest_entry(skeyz)
+                    r = watermark(fc, skeyz)
                     duplicate_rows = dfx[dfx.duplicated()]  # if data has duplicated
                     # print(duplicate_rows)
                     dfx = dfx.drop_duplicates()  # remove the duplicated
@@ -495,13 +477,7 @@ for root in paths:
                     if r != dfx["datetime"].iloc[-1]:
                         dfx["timeserieskey"] = skeyz
                         dfx["flags"] = flag
-                        dfx.to_sql(
-                            "timeseriesvaluesandflags",
-                            engine,
-                            index=False,
-                            if_exists="append",
-                            schema="waterschappen_timeseries",
-                        )
+                        writevalues(engine, dfx, TimeSeriesValuesAndFlags)
                     else:
                         print("not updating:", r, dfx['datetime'].iloc[-1])
 
@@ -60,7 +60,11 @@ from ts_helpers_hhnk import (
     dateto_integer,
     convertlttodate,
     stimestep,
+    watermark,
+    isotodatetime,
+    schema,
 )
+from ts_lizard import loadlizard
 
 # ------temp paths/things for testing
 path_csv = r"C:\projecten\nobv\2023\code"
@@ -92,152 +96,22 @@ else:
 session, engine = establishconnection(fc)
 
 
-# Functions
-# function to find latest entry
-def latest_entry(skey):
-    """function to find the lastest timestep entry per skey.
-    input = skey
-    output = pandas df containing either none or a date"""
-    stmt = """select max(datetime) from hhnk_timeseries.timeseriesvaluesandflags
-        where timeserieskey={s};""".format(
-        s=skey
-    )
-    r = engine.execute(stmt).fetchall()[0][0]
-    r = pd.to_datetime(r)
-    return r
-
-
-# %% Retrieving data from API and putting in database
-# the url to retrieve the data from, groundwaterstation data
-ground = "https://hhnk.lizard.net/api/v4/groundwaterstations/"
-# creation of empty lists to fill during retrieving process
-gdata = []
-tsv = []
-timeurllist = []
-
-# retrieve information about the different groundwater stations, this loops through all the pages
-response = requests.get(ground, headers=json_headers).json()
-groundwater = response["results"]
-while response["next"]:
-    response = requests.get(response["next"]).json()
-    groundwater.extend(response["results"])
-
-    # start retrieving of the seperate timeseries per groundwaterstation
-    # first request is to retrieve the base information of the location and geometry entries
-    for i in range(len(response)):
-        geom = response["results"][i]["geometry"]
-        # creation of a metadata dict to store the data
-        if response["results"][i][
-            "filters"
-        ]:  # looks if key 'filters'is filled, if not, it skips the entry
-            for j in range(len(response["results"][i].get("filters"))):
-                fskey = loadfilesource(response["results"][i]["url"], fc)
-
-                locationkey = location(
-                    fc=fc,
-                    fskey=fskey[0][0],
-                    name=response["results"][i]["filters"][j]["code"],
-                    x=geom["coordinates"][0],
-                    y=geom["coordinates"][1],
-                    epsg=4326,
-                    description=response["results"][i]["station_type"],
-                    altitude_msl=response["results"][i]["filters"][j]["top_level"],
-                    tubetop=response["results"][i]["filters"][j]["filter_top_level"],
-                    tubebot=response["results"][i]["filters"][j]["filter_bottom_level"],
-                )
-
-                # here there is a call to find out if there is a timeseries entry is in the filter column
-                if response["results"][i]["filters"][j][
-                    "timeseries"
-                ]:  # some fill in filters but not timeseries so sort for that
-                    # some filter entries contain up to four timeseries entries
-                    # also need to loop over all the timeseries entries
-                    for k in range(
-                        len(response["results"][i]["filters"][j]["timeseries"])
-                    ):
-                        if response["results"][i]["filters"][0]["timeseries"]:
-
-                            ts = response["results"][i]["filters"][j]["timeseries"][k]
-
-                            # new call to retrieve timeseries
-                            tsresponse = requests.get(ts).json()
-
-                            params = {
-                                "value__isnull": False,
-                                "time__gte": "2018-01-01T00:00:00Z",
-                                "page_size": "100",
-                            }
-                            # to get the actual timeseries, we need to call the 'events' parameter
-                            # therefor we need to make a new request, where we can use the parameters which we defined previouslgy
-                            t = requests.get(ts + "events", params=params).json()
-
-                            # only retrieving data which has a flag below five, flags are added next to the timeseries
-                            # this is why we first need to extract all timeseries before we can filter on flags...
-                            # for flags see: https://publicwiki.deltares.nl/display/FEWSDOC/D+Time+Series+Flags
-                            if t["results"]:
-                                while t[
-                                    "next"
-                                ]:  # iteration trhough all the different timeseries page, continue as long as there is a next page
-                                    t = requests.get(t["next"]).json()
-
-                                    pkeygws = sparameter(
-                                        fc,
-                                        tsresponse["observation_type"]["unit"],
-                                        tsresponse["observation_type"]["parameter"],
-                                        [
-                                            tsresponse["observation_type"]["unit"],
-                                            tsresponse["observation_type"][
-                                                "reference_frame"
-                                            ],
-                                        ],  # unit
-                                        tsresponse["observation_type"]["description"],
-                                    )
-                                    skeygws = sserieskey(
-                                        fc,
-                                        pkeygws,
-                                        locationkey,
-                                        fskey[0],
-                                        timestep="nonequidistant",
-                                    )
-
-                                    df = pd.DataFrame.from_dict(t["results"])
-                                    df = df[df.flag == 0]
-
-                                    if df.flag.size > 0:
-                                        flagkey = sflag(
-                                            fc, str(df.flag.values[0]), "FEWS-flag"
-                                        )
-
-                                        df["datetime"] = pd.to_datetime(df["time"])
-
-                                        r = latest_entry(skeygws)
-                                        if r != (df["datetime"].iloc[-1]).replace(
-                                            tzinfo=None
-                                        ):
-                                            try:
-                                                df.drop(
-                                                    columns=[
-                                                        "validation_code",
-                                                        "comment",
-                                                        "time",
-                                                        "last_modified",
-                                                        "detection_limit",
-                                                        "flag",
-                                                    ],
-                                                    inplace=True,
-                                                )
-                                                df = df.rename(
-                                                    columns={"value": "scalarvalue"}
-                                                )  # change column
-                                                df["timeserieskey"] = skeygws
-                                                df["flags"] = flagkey
-                                                df.to_sql(
-                                                    "timeseriesvaluesandflags",
-                                                    engine,
-                                                    index=False,
-                                                    if_exists="append",
-                                                    schema="hhnk_timeseries",
-                                                )
-                                            except:
-                                                continue
+# %%
+# stations, timeseries and event pages are fetched concurrently from the Lizard
+# API and every page of events is written with the bulk writer (see ts_lizard).
+# Only events with flag 0 are stored, for flags see:
+# https://publicwiki.deltares.nl/display/FEWSDOC/D+Time+Series+Flags
+# An interrupted crawl resumes from the checkpoints when it is started again.
+# Station and timeseries metadata are kept in a local HTTP cache.
+result = loadlizard(
+    fc,
+    schema,
+    apikey=password,
+    endpoint="groundwaterstations/",
+    start="2018-01-01T00:00:00Z",
+    maxflag=0,
+    checkpoint=os.path.join(os.path.dirname(configfile), "crawl_checkpoints.sqlite"),
+    cache=os.path.join(os.path.dirname(configfile), "http_cache.sqlite"),
+)
+print("loaded", result)
 # %%
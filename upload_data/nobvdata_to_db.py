@@ -71,7 +71,9 @@ from ts_helpers.ts_helpers_nobv import (
     dateto_integer,
     convertlttodate,
     stimestep,
+    watermark,
 )
+from ts_helpers.ts_bulk import writevalues
 
 
 def read_config(af):
@@ -82,19 +84,6 @@ def read_config(af):
     return cf
 
 
-def latest_entry(skey):
-    """function to find the lastest timestep entry per skey.
-    input = skey
-    output = pandas df containing either none or a date"""
-    stmt = """select max(datetime) from nobv_timeseries.timeseriesvaluesandflags
-        where timeserieskey={s};""".format(
-        s=skey
-    )
-    r = engine.execute(stmt).fetchall()[0][0]
-    r = pd.to_datetime(r)
-    return r
-
-
 prefixes = [">", "#", "*", "$"]
 dntusecol = ["mex", "chflysi", "mexb"]
 
@@ -321,18 +310,12 @@ for root, subdirs, files in os.walk(root):
                     dfx = dfx.dropna()
                     print(dfx)
 
-                    r = latest_entry(skeyz)
+                    r = watermark(fc, skeyz)
 
                     if r != dfx["datetime"].iloc[-1]:
                         dfx["timeserieskey"] = skeyz
                         dfx["flags"] = flag
-                        dfx.to_sql(
-                            "timeseriesvaluesandflags",
-                            engine,
-                            index=False,
-                            if_exists="append",
-                            schema="nobv_timeseries",
-                        )
+                        writevalues(engine, dfx, TimeSeriesValuesAndFlags)
                     else:
                         print("not updating")
             elif data == "GWM":
@@ -434,18 +417,12 @@ for root, subdirs, files in os.walk(root):
                     dfx = dfx.dropna()
                     print(dfx)
 
-                    r = latest_entry(skeyz)
+                    r = watermark(fc, skeyz)
 
                     if r != dfx["datetime"].iloc[-1]:
                         dfx["timeserieskey"] = skeyz
                         dfx["flags"] = flag
-                        dfx.to_sql(
-                            "timeseriesvaluesandflags",
-                            engine,
-                            index=False,
-                            if_exists="append",
-                            schema="nobv_timeseries",
-                        )
+                        writevalues(engine, dfx, TimeSeriesValuesAndFlags)
                     else:
                         print("not updating")
 